@@ -0,0 +1,365 @@
+"""
+Aggregations behind ``GET /api/weather-records/analytics/``.
+
+Statistics, daily trends and the per-city summary are each computed with a
+single query, either over raw ``weather_records`` rows or, for windows
+aligned to bucket boundaries, over the hourly/daily rollup tables.
+
+With ``bucket`` set, ``daily_trends`` gives way to ``trends``: calendar
+hours, days, ISO weeks or months in a given time zone, from the start of
+the bucket holding the window start up to now. These are read from the
+hourly rollups whenever the zone is a whole number of hours off UTC (the
+daily rollups for UTC days and longer), and from raw rows otherwise.
+
+``build_comparison`` serves ``GET /api/weather-records/compare/`` the same
+way for several cities at once: one query grouped by city and bucket, laid
+out as one array per city and metric.
+"""
+from datetime import datetime, time, timedelta, timezone as dt_timezone
+
+from django.db.models import (
+    Avg, Count, DateTimeField, ExpressionWrapper, F, FloatField, Max, Min, Sum, Value
+)
+from django.db.models.functions import Coalesce, Trunc, TruncDate
+from django.utils import timezone
+
+from . import rollups
+from .models import WeatherRecord
+
+
+def _round(value, digits=2):
+    return round(value, digits) if value is not None else None
+
+
+def _raw_metrics():
+    return {
+        'avg_temperature': Avg('temperature'),
+        'max_temperature': Max('temperature'),
+        'min_temperature': Min('temperature'),
+        'avg_humidity': Avg('humidity'),
+        'avg_pressure': Avg('pressure'),
+        'avg_wind_speed': Avg('wind_speed'),
+        'total_records': Count('id'),
+    }
+
+
+def _rollup_metrics():
+    def mean(field):
+        return ExpressionWrapper(Sum(f'{field}_sum') / Sum('record_count'),
+                                 output_field=FloatField())
+
+    return {
+        'avg_temperature': mean('temperature'),
+        'max_temperature': Max('temperature_max'),
+        'min_temperature': Min('temperature_min'),
+        'avg_humidity': mean('humidity'),
+        'avg_pressure': mean('pressure'),
+        'avg_wind_speed': mean('wind_speed'),
+        'total_records': Coalesce(Sum('record_count'), 0),
+    }
+
+
+def _daily_trends(queryset, time_field, start_date, days, metrics):
+    # Shift readings back by the window's offset into its first day so
+    # that truncating to the date yields 24h buckets starting at
+    # start_date, then aggregate all days in a single grouped query.
+    offset = start_date - start_date.replace(hour=0, minute=0, second=0, microsecond=0)
+    shifted = ExpressionWrapper(F(time_field) - Value(offset), output_field=DateTimeField())
+    day_rows = (
+        queryset.annotate(day=TruncDate(shifted, tzinfo=dt_timezone.utc))
+        .values('day')
+        .annotate(avg_temp=metrics['avg_temperature'],
+                  avg_humidity=metrics['avg_humidity'])
+        .order_by()
+    )
+    day_avgs = {row['day']: row for row in day_rows}
+
+    daily_data = []
+    for i in range(days):
+        day_start = start_date + timedelta(days=i)
+        day_avg = day_avgs.get(day_start.date(), {})
+        daily_data.append({
+            'date': day_start.strftime('%Y-%m-%d'),
+            'avg_temperature': _round(day_avg.get('avg_temp')),
+            'avg_humidity': _round(day_avg.get('avg_humidity'))
+        })
+    return daily_data
+
+
+def _city_summary(queryset, metrics):
+    city_rows = (
+        queryset.values('city_id', 'city__name', 'city__country')
+        .annotate(avg_temp=metrics['avg_temperature'], count=metrics['total_records'])
+        .order_by('city__name')
+    )
+    return [
+        {
+            'city_name': row['city__name'],
+            'country': row['city__country'],
+            'avg_temperature': round(row['avg_temp'], 2),
+            'record_count': row['count']
+        }
+        for row in city_rows
+    ]
+
+
+BUCKETS = ('hour', 'day', 'week', 'month')
+
+
+def bucket_floor(value, bucket, tz):
+    """Start of the ``bucket`` holding ``value``, in time zone ``tz``."""
+    local = value.astimezone(tz)
+    if bucket == 'hour':
+        return local.replace(minute=0, second=0, microsecond=0)
+    day = local.date()
+    if bucket == 'week':
+        day -= timedelta(days=day.weekday())
+    elif bucket == 'month':
+        day = day.replace(day=1)
+    return datetime.combine(day, time(), tzinfo=tz)
+
+
+def next_bucket(start, bucket, tz):
+    if bucket == 'hour':
+        return (start.astimezone(dt_timezone.utc) + timedelta(hours=1)).astimezone(tz)
+    day = start.date()
+    if bucket == 'day':
+        day += timedelta(days=1)
+    elif bucket == 'week':
+        day += timedelta(weeks=1)
+    else:
+        day = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+    return datetime.combine(day, time(), tzinfo=tz)
+
+
+def _bucket_starts(start, end, bucket, tz):
+    starts = []
+    while start <= end:
+        starts.append(start)
+        start = next_bucket(start, bucket, tz)
+    return starts
+
+
+def _trends_source(starts, bucket):
+    """Rollup resolution whose buckets nest inside every one of ``starts``, or None."""
+    offsets = {start.utcoffset() for start in starts}
+    if bucket != 'hour' and offsets == {timedelta(0)}:
+        return rollups.DAILY
+    if all(offset % timedelta(hours=1) == timedelta(0) for offset in offsets):
+        return rollups.HOURLY
+    return None
+
+
+def _bucket_start(time_field, bucket, tz, starts):
+    """
+    Expression for the start of each row's bucket. Hours are truncated in
+    UTC, shifted by how far ``tz`` is off the whole hour, so the two hours
+    that share a wall-clock time when clocks go back stay apart; longer
+    buckets are truncated in ``tz``. Compare results as UTC instants.
+    """
+    phases = {start.utcoffset() % timedelta(hours=1) for start in starts}
+    if bucket != 'hour' or len(phases) > 1:
+        # Zones whose offset changes by part of an hour (Lord Howe Island)
+        # keep local hours, folding at worst one ambiguous hour together
+        return Trunc(time_field, bucket, tzinfo=tz)
+    phase = phases.pop()
+    if not phase:
+        return Trunc(time_field, 'hour', tzinfo=dt_timezone.utc)
+    shifted = ExpressionWrapper(F(time_field) + Value(phase), output_field=DateTimeField())
+    return ExpressionWrapper(Trunc(shifted, 'hour', tzinfo=dt_timezone.utc) - Value(phase),
+                             output_field=DateTimeField())
+
+
+def _utc(value):
+    return value.astimezone(dt_timezone.utc)
+
+
+def _bucketed_trends(start, now, bucket, tz, city_id):
+    starts = _bucket_starts(bucket_floor(start, bucket, tz), now, bucket, tz)
+    if not starts:
+        return []
+    resolution = _trends_source(starts, bucket)
+    if resolution is None:
+        queryset = WeatherRecord.objects.filter(recorded_at__gte=starts[0])
+        time_field, metrics = 'recorded_at', _raw_metrics()
+    else:
+        queryset = resolution.model.objects.filter(bucket_start__gte=starts[0])
+        time_field, metrics = 'bucket_start', _rollup_metrics()
+    if city_id:
+        queryset = queryset.filter(city_id=city_id)
+
+    rows = (
+        queryset.annotate(bucket=_bucket_start(time_field, bucket, tz, starts))
+        .values('bucket')
+        .annotate(avg_temp=metrics['avg_temperature'],
+                  max_temp=metrics['max_temperature'],
+                  min_temp=metrics['min_temperature'],
+                  avg_humidity=metrics['avg_humidity'],
+                  count=metrics['total_records'])
+        .order_by()
+    )
+    by_start = {_utc(row['bucket']): row for row in rows}
+
+    trends = []
+    for bucket_start in starts:
+        row = by_start.get(_utc(bucket_start), {})
+        trends.append({
+            'start': bucket_start.isoformat(),
+            'avg_temperature': _round(row.get('avg_temp')),
+            'max_temperature': _round(row.get('max_temp')),
+            'min_temperature': _round(row.get('min_temp')),
+            'avg_humidity': _round(row.get('avg_humidity')),
+            'record_count': row.get('count', 0)
+        })
+    return trends
+
+
+def _comparison_aggregates(resolution):
+    """Count, sum, min and max per rollup field, over raw rows or ``resolution``'s rollups."""
+    if resolution is None:
+        return rollups.raw_aggregates()
+    aggregates = {'record_count': Sum('record_count')}
+    for field in rollups.ROLLUP_FIELDS:
+        aggregates[f'{field}_sum'] = Sum(f'{field}_sum')
+        aggregates[f'{field}_min'] = Min(f'{field}_min')
+        aggregates[f'{field}_max'] = Max(f'{field}_max')
+    return aggregates
+
+
+def build_comparison(cities, days, bucket='day', tz=None, now=None):
+    """
+    Statistics and bucketed trends for each of ``cities`` (``(id, name)``
+    pairs) over the last ``days`` days, widened to whole ``bucket``s in
+    ``tz``, as arrays that follow the order of ``cities`` and of ``buckets``.
+    """
+    city_ids = [city_id for city_id, _ in cities]
+    tz = tz or dt_timezone.utc
+    now = now or timezone.now()
+    starts = _bucket_starts(bucket_floor(now - timedelta(days=days), bucket, tz), now, bucket, tz)
+    # Readings dated after the current bucket (clock skew, manual entries)
+    # have no column in the matrix
+    end = next_bucket(starts[-1], bucket, tz)
+    resolution = _trends_source(starts, bucket)
+    if resolution is None:
+        queryset = WeatherRecord.objects.filter(recorded_at__gte=starts[0], recorded_at__lt=end)
+        time_field = 'recorded_at'
+    else:
+        queryset = resolution.model.objects.filter(bucket_start__gte=starts[0],
+                                                   bucket_start__lt=end)
+        time_field = 'bucket_start'
+
+    rows = (
+        queryset.filter(city_id__in=city_ids)
+        .annotate(bucket=_bucket_start(time_field, bucket, tz, starts))
+        .values('city_id', 'bucket')
+        .annotate(**_comparison_aggregates(resolution))
+        .order_by()
+    )
+    city_index = {city_id: i for i, city_id in enumerate(city_ids)}
+    bucket_index = {_utc(start): i for i, start in enumerate(starts)}
+    cells = [[None] * len(starts) for _ in city_ids]
+    for row in rows:
+        cells[city_index[row['city_id']]][bucket_index[_utc(row['bucket'])]] = row
+
+    def mean(row, field):
+        return row[f'{field}_sum'] / row['record_count'] if row else None
+
+    def trend(value):
+        return [[_round(value(row)) if row else None for row in city] for city in cells]
+
+    statistics = {'record_count': [], 'max_temperature': [], 'min_temperature': []}
+    statistics.update({f'avg_{field}': [] for field in rollups.ROLLUP_FIELDS})
+    for city in cells:
+        filled = [row for row in city if row]
+        count = sum(row['record_count'] for row in filled)
+        statistics['record_count'].append(count)
+        statistics['max_temperature'].append(
+            _round(max((row['temperature_max'] for row in filled), default=None)))
+        statistics['min_temperature'].append(
+            _round(min((row['temperature_min'] for row in filled), default=None)))
+        for field in rollups.ROLLUP_FIELDS:
+            total = sum(row[f'{field}_sum'] for row in filled)
+            statistics[f'avg_{field}'].append(_round(total / count) if count else None)
+
+    return {
+        'period': f'Last {days} days',
+        'bucket': bucket,
+        'timezone': str(tz),
+        'city_ids': city_ids,
+        'cities': [name for _, name in cities],
+        'buckets': [start.isoformat() for start in starts],
+        'statistics': statistics,
+        'trends': {
+            'avg_temperature': trend(lambda row: mean(row, 'temperature')),
+            'max_temperature': trend(lambda row: row['temperature_max']),
+            'min_temperature': trend(lambda row: row['temperature_min']),
+            'avg_humidity': trend(lambda row: mean(row, 'humidity')),
+            'record_count': [[row['record_count'] if row else 0 for row in city]
+                             for city in cells],
+        },
+    }
+
+
+def window_start(days, align=None, now=None):
+    """Start of the analytics window build_analytics uses for these arguments."""
+    now = now or timezone.now()
+    if align is None:
+        return now - timedelta(days=days)
+    resolution = rollups.RESOLUTIONS[align]
+    return resolution.floor(now) + resolution.span - timedelta(days=days)
+
+
+def trends_start(days, bucket, tz, align=None, now=None):
+    """Start of the first ``bucket`` listed in ``trends``."""
+    return bucket_floor(window_start(days, align, now), bucket, tz)
+
+
+def build_analytics(days, city_id=None, align=None, now=None, bucket=None, tz=None):
+    """
+    Build the analytics payload for the last ``days`` days.
+
+    With ``align`` set to one of ``rollups.RESOLUTIONS`` the window is snapped
+    to that bucket size (the last ``days`` worth of buckets, including the
+    current one) and every figure is read from the matching rollup table.
+
+    With ``bucket`` set to one of ``BUCKETS``, trends come per calendar
+    bucket in ``tz`` (default UTC) instead of per 24 hours.
+    """
+    now = now or timezone.now()
+    start_date = window_start(days, align, now)
+    if align is None:
+        queryset = WeatherRecord.objects.filter(recorded_at__gte=start_date)
+        time_field, metrics = 'recorded_at', _raw_metrics()
+    else:
+        queryset = rollups.RESOLUTIONS[align].model.objects.filter(bucket_start__gte=start_date)
+        time_field, metrics = 'bucket_start', _rollup_metrics()
+
+    if city_id:
+        queryset = queryset.filter(city_id=city_id)
+
+    stats = queryset.aggregate(**metrics)
+
+    if bucket is None:
+        trends = {'daily_trends': _daily_trends(queryset, time_field, start_date, days, metrics)}
+    else:
+        tz = tz or dt_timezone.utc
+        trends = {
+            'bucket': bucket,
+            'timezone': str(tz),
+            'trends': _bucketed_trends(start_date, now, bucket, tz, city_id),
+        }
+
+    return {
+        'period': f'Last {days} days',
+        'statistics': {
+            'average_temperature': _round(stats['avg_temperature']),
+            'max_temperature': _round(stats['max_temperature']),
+            'min_temperature': _round(stats['min_temperature']),
+            'average_humidity': _round(stats['avg_humidity']),
+            'average_pressure': _round(stats['avg_pressure']),
+            'average_wind_speed': _round(stats['avg_wind_speed']),
+            'total_records': stats['total_records']
+        },
+        **trends,
+        'city_summary': [] if city_id else _city_summary(queryset, metrics)
+    }
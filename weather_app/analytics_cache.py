@@ -0,0 +1,126 @@
+"""
+Cache for analytics payloads.
+
+Entries are keyed on the normalised request parameters, the current time
+bucket and a version number per scope (one city, or all cities). Writing a
+WeatherRecord bumps the versions of its city and of the all-cities scope
+once the write commits, but only when the reading falls inside the oldest
+window cached for that scope, so writes to old history leave current
+dashboards cached.
+"""
+import hashlib
+import json
+import time
+from datetime import timezone as dt_timezone
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils import timezone
+
+from .analytics import build_analytics, trends_start, window_start
+
+ALL_CITIES = 'all'
+
+
+def _cache():
+    return caches[settings.ANALYTICS_CACHE_ALIAS]
+
+
+def _scope(city_id):
+    return ALL_CITIES if city_id is None else str(city_id)
+
+
+def _version(cache, scope):
+    key = f'analytics:version:{scope}'
+    version = cache.get(key)
+    if version is None:
+        # Start from the clock so an evicted counter never reuses a version
+        cache.add(key, time.time_ns(), None)
+        version = cache.get(key)
+    return version
+
+
+def _increment(cache, key, delta=1):
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.add(key, 0, None)
+        cache.incr(key, delta)
+
+
+def get_analytics(days, city_id=None, align=None, bucket=None, tz=None):
+    """
+    Return ``(payload, digest, hit)`` for build_analytics, served from the
+    cache when fresh. ``digest`` is a hash of the payload, usable as an ETag.
+    """
+    cache = _cache()
+    scope = _scope(city_id)
+    now = timezone.now()
+    ttl = settings.ANALYTICS_CACHE_BUCKET_SECONDS
+    time_bucket = int(now.timestamp()) // ttl
+    key = (f'analytics:{scope}:{_version(cache, scope)}:'
+           f'{days}:{align or "raw"}:{bucket or "24h"}:{tz or "UTC"}:{time_bucket}')
+
+    entry = cache.get(key)
+    if entry is not None:
+        _increment(cache, 'analytics:stats:hits')
+        return entry['payload'], entry['digest'], True
+
+    _increment(cache, 'analytics:stats:misses')
+    # Publish the window before computing, so a write that lands meanwhile
+    # bumps the version in ``key`` and the stale result is never read. The
+    # oldest start must also outlive every entry, hence the rewrite and the
+    # longer timeout.
+    if bucket is None:
+        start = window_start(days, align, now)
+    else:
+        start = trends_start(days, bucket, tz or dt_timezone.utc, align, now)
+    oldest_key = f'analytics:oldest:{scope}'
+    oldest = cache.get(oldest_key)
+    cache.set(oldest_key, start if oldest is None else min(start, oldest), 2 * ttl)
+    payload = build_analytics(days, city_id=city_id, align=align, now=now,
+                              bucket=bucket, tz=tz)
+    digest = hashlib.md5(json.dumps(payload, sort_keys=True, default=str).encode()).hexdigest()
+    cache.set(key, {'payload': payload, 'digest': digest}, ttl)
+    return payload, digest, False
+
+
+def invalidate(city_id, recorded_at=None):
+    """
+    Drop cached analytics that may include a reading for ``city_id`` at
+    ``recorded_at`` (or any reading of the city, if not given).
+    """
+    cache = _cache()
+    for scope in (_scope(city_id), ALL_CITIES):
+        oldest_key = f'analytics:oldest:{scope}'
+        oldest = cache.get(oldest_key)
+        if oldest is None:
+            continue  # nothing cached for this scope
+        if recorded_at is not None and recorded_at < oldest:
+            continue  # older than every cached window
+        _increment(cache, f'analytics:version:{scope}')
+        cache.delete(oldest_key)
+        _increment(cache, 'analytics:stats:invalidations')
+
+
+def invalidate_on_commit(city_id, recorded_at=None):
+    """
+    ``invalidate`` once the current transaction commits (at once outside
+    one), so a request in between cannot cache results without the write.
+    """
+    transaction.on_commit(lambda: invalidate(city_id, recorded_at))
+
+
+def stats():
+    cache = _cache()
+    counts = cache.get_many(['analytics:stats:hits', 'analytics:stats:misses',
+                             'analytics:stats:invalidations'])
+    hits = counts.get('analytics:stats:hits', 0)
+    misses = counts.get('analytics:stats:misses', 0)
+    return {
+        'hits': hits,
+        'misses': misses,
+        'hit_rate': round(hits / (hits + misses), 4) if hits + misses else None,
+        'invalidations': counts.get('analytics:stats:invalidations', 0),
+    }
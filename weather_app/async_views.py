@@ -0,0 +1,155 @@
+"""
+Async twins of the provider fetch and analytics endpoints, under
+``/api/async/``.
+
+Served by an ASGI server (``uvicorn weather_project.asgi:application``)
+these wait on OpenWeatherMap on the event loop, so a slow provider ties up
+no worker thread, and hand their database work to the bounded pool in
+weather_app.concurrency. Requests and responses match the DRF endpoints
+they mirror. Under WSGI they still work, one request per thread.
+"""
+import functools
+import json
+
+import httpx
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponseNotAllowed, JsonResponse
+
+from . import analytics_cache, openweather
+from .concurrency import run_sync
+from .conditional import conditional_response, make_etag
+from .models import City
+from .serializers import WeatherRecordSerializer
+from .views import analytics_params, build_comparison, compare_params
+
+
+def provider_session(view):
+    """
+    Under WSGI every async view runs on an event loop of its own that ends
+    with the request, so give it a provider client that is closed with it.
+    ASGI servers keep one loop, and its client, for the whole process.
+    """
+    @functools.wraps(view)
+    async def wrapper(request, *args, **kwargs):
+        if isinstance(request, ASGIRequest):
+            return await view(request, *args, **kwargs)
+        async with openweather.async_client_session():
+            return await view(request, *args, **kwargs)
+    return wrapper
+
+
+def _store(city, data, fetched_at, cached):
+    record, created = openweather.store_current_weather(city, data, fetched_at, cached)
+    return WeatherRecordSerializer(record).data, created
+
+
+@provider_session
+async def fetch_weather(request, pk):
+    """
+    Fetch current weather for one city from OpenWeatherMap and save it
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    city = await run_sync(City.objects.filter(pk=pk).first)
+    if city is None:
+        return JsonResponse({'detail': 'Not found.'}, status=404)
+
+    try:
+        data, fetched_at, cached = await openweather.afetch_current_weather_cached(
+            city.latitude, city.longitude
+        )
+    except (httpx.HTTPError, ValueError) as e:
+        return JsonResponse({
+            'success': False,
+            'error': f'Failed to fetch weather data: {str(e)}'
+        }, status=503)
+
+    record, created = await run_sync(_store, city, data, fetched_at, cached)
+    return JsonResponse({
+        'success': True,
+        'cached': cached,
+        'message': 'Weather data fetched and saved successfully' if created
+        else 'Recent weather data served from cache',
+        'data': record
+    }, status=201 if created else 200)
+
+
+@provider_session
+async def fetch_weather_bulk(request):
+    """
+    Fetch current weather for many cities (``city_ids``, default all) with
+    the provider requests in flight together, then save them in one insert
+    """
+    if request.method != 'POST':
+        return HttpResponseNotAllowed(['POST'])
+    try:
+        body = json.loads(request.body or b'{}')
+    except ValueError:
+        body = None
+    if not isinstance(body, dict):
+        return JsonResponse({
+            'success': False,
+            'error': 'Request body must be a JSON object'
+        }, status=400)
+
+    cities = City.objects.all()
+    city_ids = body.get('city_ids')
+    if city_ids is not None:
+        if not isinstance(city_ids, list) or not all(
+            isinstance(city_id, int) and not isinstance(city_id, bool) for city_id in city_ids
+        ):
+            return JsonResponse({
+                'success': False,
+                'error': 'city_ids must be a list of city IDs'
+            }, status=400)
+        cities = cities.filter(id__in=city_ids)
+
+    results = await openweather.afetch_cities(await run_sync(list, cities))
+    fetched = sum(1 for result in results if result['success'])
+    failed = len(results) - fetched
+    return JsonResponse({
+        'success': failed == 0,
+        'fetched': fetched,
+        'failed': failed,
+        'results': results
+    }, status=201 if fetched or not failed else 503)
+
+
+async def analytics(request):
+    """
+    Get weather analytics and statistics
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        params = analytics_params(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+
+    payload, digest, hit = await run_sync(analytics_cache.get_analytics, **params)
+    response = conditional_response(request, make_etag(request, digest),
+                                    lambda: JsonResponse(payload))
+    response['X-Cache'] = 'HIT' if hit else 'MISS'
+    return response
+
+
+async def compare(request):
+    """
+    Statistics and bucketed trends for several cities side by side
+    """
+    if request.method != 'GET':
+        return HttpResponseNotAllowed(['GET'])
+    try:
+        params = compare_params(request.GET)
+    except ValueError as e:
+        return JsonResponse({'error': str(e)}, status=400)
+    payload, error = await run_sync(build_comparison, **params)
+    if error:
+        return JsonResponse({'error': error}, status=404)
+    return JsonResponse(payload)
+
+
+# Like the DRF views, API clients post without a CSRF token. (Django 4.2's
+# csrf_exempt decorator would turn these into sync views.)
+fetch_weather.csrf_exempt = True
+fetch_weather_bulk.csrf_exempt = True
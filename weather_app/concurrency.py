@@ -0,0 +1,66 @@
+"""
+Running blocking code, mostly the ORM, from async views.
+
+``sync_to_async`` on its own gives each request its own thread for
+thread-sensitive code, so a burst of slow requests opens as many threads,
+and database connections, as there are requests in flight. ``run_sync``
+queues the work on one process-wide pool of WEATHER_ASYNC_DB_WORKERS
+threads instead, which caps both. Each call is handled like a request of
+its own: stale connections are closed before and after it, as Django does
+around every request.
+
+With WEATHER_ASYNC_DB_WORKERS = 0 calls go through Django's default
+thread-sensitive ``sync_to_async`` (which the test client needs to share
+its transaction).
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.db import close_old_connections
+from django.dispatch import receiver
+
+_executor = None
+_executor_lock = threading.Lock()
+
+
+def get_executor():
+    """The shared ORM thread pool, or None when it is disabled."""
+    global _executor
+    if not settings.WEATHER_ASYNC_DB_WORKERS:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(max_workers=settings.WEATHER_ASYNC_DB_WORKERS,
+                                           thread_name_prefix='weather-db')
+        return _executor
+
+
+def _call(func, args, kwargs):
+    close_old_connections()
+    try:
+        return func(*args, **kwargs)
+    finally:
+        close_old_connections()
+
+
+async def run_sync(func, *args, **kwargs):
+    """Await ``func(*args, **kwargs)`` run on the shared ORM thread pool."""
+    executor = get_executor()
+    if executor is None:
+        return await sync_to_async(func)(*args, **kwargs)
+    return await sync_to_async(_call, thread_sensitive=False, executor=executor)(
+        func, args, kwargs
+    )
+
+
+@receiver(setting_changed)
+def reset_executor(setting, **kwargs):
+    global _executor
+    if setting == 'WEATHER_ASYNC_DB_WORKERS':
+        with _executor_lock:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = None
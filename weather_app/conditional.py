@@ -0,0 +1,80 @@
+"""
+Conditional GET for the API.
+
+Validators are built from what a response is made of - the IDs and
+``updated_at`` of the rows on the page, plus the pagination links and
+count - once those rows are loaded but before they are serialized, so a
+matching ``If-None-Match``/``If-Modified-Since`` costs no serialization and
+no extra queries.
+"""
+import hashlib
+
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+
+def make_etag(request, *parts):
+    """Strong ETag over ``parts``, the full query string and the negotiated media type."""
+    key = repr((request.get_full_path(), getattr(request, 'accepted_media_type', None)) + parts)
+    return quote_etag(hashlib.md5(key.encode()).hexdigest())
+
+
+def conditional_response(request, etag, render, last_modified=None):
+    """
+    Return 304 if the client's copy matches ``etag``/``last_modified``,
+    otherwise ``render()`` with the validators set on it.
+    """
+    renderer = getattr(request, 'accepted_renderer', None)
+    if renderer is not None and renderer.format == 'api':
+        return render()  # browsable API pages embed per-user forms and tokens
+    timestamp = int(last_modified.timestamp()) if last_modified else None
+    response = get_conditional_response(request, etag=etag, last_modified=timestamp)
+    if response is None:
+        response = render()
+    if response.status_code in (200, 304):
+        response['ETag'] = etag
+        if timestamp is not None:
+            response['Last-Modified'] = http_date(timestamp)
+    return response
+
+
+class ConditionalGetMixin:
+    """
+    ``list`` and ``retrieve`` for viewsets whose objects describe their own
+    version through ``object_state`` (and optionally ``object_last_modified``).
+    """
+
+    def object_state(self, obj):
+        raise NotImplementedError
+
+    def object_last_modified(self, obj):
+        return None
+
+    def page_etag(self, request, objects, paginated=True):
+        envelope = {}
+        if paginated:
+            envelope = self.paginator.get_paginated_response([]).data
+            envelope.pop('results', None)
+        return make_etag(request, tuple(envelope.items()),
+                         tuple(self.object_state(obj) for obj in objects))
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+        page = self.paginate_queryset(queryset)
+        objects = list(queryset) if page is None else page
+
+        def render():
+            data = self.get_serializer(objects, many=True).data
+            return Response(data) if page is None else self.get_paginated_response(data)
+
+        return conditional_response(request, self.page_etag(request, objects, page is not None),
+                                    render)
+
+    def retrieve(self, request, *args, **kwargs):
+        instance = self.get_object()
+        return conditional_response(
+            request, make_etag(request, self.object_state(instance)),
+            lambda: Response(self.get_serializer(instance).data),
+            last_modified=self.object_last_modified(instance)
+        )
@@ -0,0 +1,93 @@
+"""
+Weather record counts without ``COUNT(*)`` over ``weather_records``.
+
+Every city keeps a ``weather_record_count`` column, adjusted as readings
+are inserted, moved between cities and deleted; the global count is the
+sum over the (small) cities table. ``WEATHER_COUNT_MODE`` picks what
+``record_count`` returns:
+
+* ``maintained`` - the counters (default)
+* ``estimate`` - like ``maintained``, but the unfiltered total comes from
+  the planner statistics in ``pg_class.reltuples`` on PostgreSQL
+* ``exact`` - ``COUNT(*)`` every time
+
+Writes that bypass the model layer (raw SQL) let the counters drift;
+``manage.py recount_weather`` rebuilds them.
+"""
+from collections import Counter
+
+from django.conf import settings
+from django.db import connection
+from django.db.models import Case, Count, F, IntegerField, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce
+
+from .models import City, WeatherRecord
+
+
+def adjust(deltas):
+    """Apply ``{city_id: delta}`` to the per-city counters in one UPDATE."""
+    deltas = {city_id: delta for city_id, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    City.objects.filter(pk__in=deltas).update(weather_record_count=F('weather_record_count') + Case(
+        *[When(pk=city_id, then=Value(delta)) for city_id, delta in deltas.items()],
+        output_field=IntegerField()
+    ))
+
+
+def count_records(records):
+    """``{city_id: n}`` for an iterable of WeatherRecord instances."""
+    return Counter(record.city_id for record in records)
+
+
+def recount(city_ids=None):
+    """Recompute the counters from ``weather_records``; returns cities updated."""
+    per_city = (
+        WeatherRecord.objects.filter(city_id=OuterRef('pk'))
+        .order_by().values('city_id').annotate(n=Count('id')).values('n')
+    )
+    cities = City.objects.all()
+    if city_ids is not None:
+        cities = cities.filter(pk__in=city_ids)
+    return cities.update(weather_record_count=Coalesce(Subquery(per_city), 0))
+
+
+def maintained_count(city_id=None):
+    if city_id is not None:
+        return City.objects.filter(pk=city_id).values_list('weather_record_count', flat=True).first() or 0
+    return City.objects.aggregate(total=Coalesce(Sum('weather_record_count'), 0))['total']
+
+
+def estimated_count():
+    """Row estimate from the planner statistics, or None where unavailable."""
+    if connection.vendor != 'postgresql':
+        return None
+    with connection.cursor() as cursor:
+        # Summed over the partitions when the table is partitioned
+        # (weather_app.partitions); the parent itself has no statistics.
+        cursor.execute(
+            "SELECT reltuples::bigint FROM pg_class WHERE relkind = 'r' AND ("
+            "oid = to_regclass(%s) OR oid IN "
+            "(SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s)))",
+            [WeatherRecord._meta.db_table] * 2
+        )
+        rows = [row[0] for row in cursor.fetchall()]
+    # reltuples is -1 until a table has been vacuumed or analyzed
+    if not rows or any(n < 0 for n in rows):
+        return None
+    return sum(rows)
+
+
+def record_count(city_id=None):
+    """Number of weather records (for ``city_id``) per WEATHER_COUNT_MODE."""
+    mode = settings.WEATHER_COUNT_MODE
+    if mode == 'exact':
+        queryset = WeatherRecord.objects.all()
+        if city_id is not None:
+            queryset = queryset.filter(city_id=city_id)
+        return queryset.count()
+    if mode == 'estimate' and city_id is None:
+        estimate = estimated_count()
+        if estimate is not None:
+            return estimate
+    return maintained_count(city_id)
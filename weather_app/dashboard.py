@@ -0,0 +1,39 @@
+"""
+Snapshot behind the home page: counts plus the latest cities and readings.
+
+The snapshot lives in the default cache for WEATHER_DASHBOARD_TTL seconds
+and is dropped whenever cities or readings are written, so ``/`` reads one
+cache key; rebuilding it takes the record count from weather_app.counts.
+"""
+from django.conf import settings
+from django.core.cache import cache
+
+from . import counts
+from .models import City, WeatherRecord
+
+SNAPSHOT_KEY = 'dashboard:snapshot'
+
+
+def build_snapshot():
+    recent_weather = WeatherRecord.objects.select_related('city').order_by('-recorded_at')[:5]
+    return {
+        'city_count': City.objects.count(),
+        'weather_count': counts.record_count(),
+        'recent_cities': list(City.objects.values_list('name', 'country')[:5]),
+        'recent_weather': [
+            (record.city.name, record.temperature, record.description)
+            for record in recent_weather
+        ],
+    }
+
+
+def get_snapshot():
+    snapshot = cache.get(SNAPSHOT_KEY)
+    if snapshot is None:
+        snapshot = build_snapshot()
+        cache.set(SNAPSHOT_KEY, snapshot, settings.WEATHER_DASHBOARD_TTL)
+    return snapshot
+
+
+def invalidate():
+    cache.delete(SNAPSHOT_KEY)
@@ -0,0 +1,226 @@
+"""
+Streaming exports of weather records.
+
+Rows are read with ``values_list(...).iterator()`` (a server-side cursor on
+PostgreSQL) and written straight into a StreamingHttpResponse, so memory
+stays flat however many rows match and the first bytes go out right away.
+
+Arrow IPC and Parquet exports need the optional ``pyarrow`` package. They
+are built column by column from ``values_list`` batches, with city name and
+country as dictionary-encoded columns.
+"""
+import csv
+import io
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.http import StreamingHttpResponse
+
+from .models import City
+
+try:
+    import pyarrow
+    import pyarrow.compute
+    import pyarrow.parquet
+except ImportError:
+    pyarrow = None
+
+EXPORT_FIELDS = [
+    ('id', 'id'),
+    ('city', 'city_id'),
+    ('city_name', 'city__name'),
+    ('temperature', 'temperature'),
+    ('feels_like', 'feels_like'),
+    ('humidity', 'humidity'),
+    ('pressure', 'pressure'),
+    ('wind_speed', 'wind_speed'),
+    ('description', 'description'),
+    ('recorded_at', 'recorded_at'),
+    ('created_at', 'created_at'),
+]
+EXPORT_COLUMNS = [name for name, _ in EXPORT_FIELDS]
+
+# Rows buffered into each chunk handed to the WSGI server.
+FLUSH_EVERY = 500
+
+
+def _rows(queryset):
+    chunk_size = settings.WEATHER_EXPORT_CHUNK_SIZE
+    return queryset.values_list(*[lookup for _, lookup in EXPORT_FIELDS]).iterator(
+        chunk_size=chunk_size
+    )
+
+
+class _Echo:
+    """File-like object whose write() hands the line back to csv.writer."""
+
+    def write(self, value):
+        return value
+
+
+def _stream_csv(queryset):
+    writer = csv.writer(_Echo())
+    yield writer.writerow(EXPORT_COLUMNS)
+    lines = []
+    for row in _rows(queryset):
+        lines.append(writer.writerow(
+            [value.isoformat() if hasattr(value, 'isoformat') else value for value in row]
+        ))
+        if len(lines) >= FLUSH_EVERY:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+def _stream_ndjson(queryset):
+    encoder = DjangoJSONEncoder()
+    lines = []
+    for row in _rows(queryset):
+        lines.append(encoder.encode(dict(zip(EXPORT_COLUMNS, row))) + '\n')
+        if len(lines) >= FLUSH_EVERY:
+            yield ''.join(lines)
+            lines = []
+    if lines:
+        yield ''.join(lines)
+
+
+ARROW_COLUMNS = [
+    'id', 'city', 'temperature', 'feels_like', 'humidity', 'pressure',
+    'wind_speed', 'description', 'recorded_at', 'created_at',
+]
+
+
+def _arrow_schema():
+    timestamp = pyarrow.timestamp('us', tz='UTC')
+    return pyarrow.schema([
+        ('id', pyarrow.int64()),
+        ('city', pyarrow.int64()),
+        ('city_name', pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+        ('city_country', pyarrow.dictionary(pyarrow.int32(), pyarrow.string())),
+        ('temperature', pyarrow.float64()),
+        ('feels_like', pyarrow.float64()),
+        ('humidity', pyarrow.int32()),
+        ('pressure', pyarrow.int32()),
+        ('wind_speed', pyarrow.float64()),
+        ('description', pyarrow.string()),
+        ('recorded_at', timestamp),
+        ('created_at', timestamp),
+    ])
+
+
+def _arrow_batches(queryset, schema):
+    """
+    Yield RecordBatches of WEATHER_ARROW_BATCH_SIZE rows. Each batch of
+    ``values_list`` tuples is transposed into columns; city name/country are
+    dictionary indices looked up against one City query.
+    """
+    city_ids, names, countries = [], [], []
+    for city_id, name, country in City.objects.values_list('id', 'name', 'country'):
+        city_ids.append(city_id)
+        names.append(name)
+        countries.append(country)
+    country_dictionary = sorted(set(countries))
+    country_index = {country: i for i, country in enumerate(country_dictionary)}
+    city_ids = pyarrow.array(city_ids, pyarrow.int64())
+    names = pyarrow.array(names, pyarrow.string())
+    city_country_indices = pyarrow.array([country_index[c] for c in countries], pyarrow.int32())
+    country_dictionary = pyarrow.array(country_dictionary, pyarrow.string())
+
+    batch_size = settings.WEATHER_ARROW_BATCH_SIZE
+    rows = queryset.values_list(*ARROW_COLUMNS).iterator(chunk_size=min(batch_size, 10000))
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) < batch_size:
+            continue
+        yield _record_batch(batch, schema, city_ids, names, city_country_indices,
+                            country_dictionary)
+        batch = []
+    if batch:
+        yield _record_batch(batch, schema, city_ids, names, city_country_indices,
+                            country_dictionary)
+
+
+def _record_batch(rows, schema, city_ids, names, city_country_indices, country_dictionary):
+    columns = dict(zip(ARROW_COLUMNS, zip(*rows)))
+    city = pyarrow.array(columns['city'], pyarrow.int64())
+    city_index = pyarrow.compute.index_in(city, value_set=city_ids).cast(pyarrow.int32())
+    arrays = {
+        'city': city,
+        'city_name': pyarrow.DictionaryArray.from_arrays(city_index, names),
+        'city_country': pyarrow.DictionaryArray.from_arrays(
+            pyarrow.compute.take(city_country_indices, city_index), country_dictionary
+        ),
+    }
+    for field in schema:
+        if field.name not in arrays:
+            arrays[field.name] = pyarrow.array(columns[field.name], field.type)
+    return pyarrow.record_batch([arrays[field.name] for field in schema], schema=schema)
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that buffers bytes until drained into the response."""
+
+    def __init__(self):
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def _stream_arrow_file(queryset, open_writer):
+    schema = _arrow_schema()
+    sink = _ChunkSink()
+    writer = open_writer(sink, schema)
+    for batch in _arrow_batches(queryset, schema):
+        writer.write_batch(batch)
+        yield sink.drain()
+    writer.close()
+    yield sink.drain()
+
+
+def _stream_arrow(queryset):
+    return _stream_arrow_file(queryset, pyarrow.ipc.new_stream)
+
+
+def _stream_parquet(queryset):
+    return _stream_arrow_file(queryset, pyarrow.parquet.ParquetWriter)
+
+
+STREAMERS = {
+    'ndjson': (_stream_ndjson, 'application/x-ndjson'),
+    'csv': (_stream_csv, 'text/csv'),
+    'arrow': (_stream_arrow, 'application/vnd.apache.arrow.stream'),
+    'parquet': (_stream_parquet, 'application/vnd.apache.parquet'),
+}
+COLUMNAR_OUTPUTS = ('arrow', 'parquet')
+
+
+def unavailable_reason(output):
+    """Why ``output`` cannot be produced here, or None if it can."""
+    if output in COLUMNAR_OUTPUTS and pyarrow is None:
+        return f'{output} export requires the pyarrow package'
+    return None
+
+
+def export_response(queryset, output):
+    """Stream ``queryset`` as ``output`` (one of STREAMERS)."""
+    stream, content_type = STREAMERS[output]
+    response = StreamingHttpResponse(stream(queryset), content_type=content_type)
+    response['Content-Disposition'] = f'attachment; filename="weather_records.{output}"'
+    return response
@@ -0,0 +1,196 @@
+import asyncio
+import json
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import httpx
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from weather_app.models import City
+
+TARGETS = {
+    # target: (method, WSGI path, ASGI path)
+    'fetch': ('POST', '/api/cities/{city}/fetch_weather/',
+              '/api/async/cities/{city}/fetch_weather/'),
+    'analytics': ('GET', '/api/weather-records/analytics/?city_id={city}',
+                  '/api/async/weather-records/analytics/?city_id={city}'),
+}
+
+
+class SlowProviderHandler(BaseHTTPRequestHandler):
+    """OpenWeatherMap stand-in answering every request after ``server.delay`` seconds."""
+
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        params = parse_qs(urlparse(self.path).query)
+        time.sleep(self.server.delay)
+        latitude = float(params.get('lat', ['0'])[0])
+        body = json.dumps({
+            'id': None,
+            'main': {'temp': latitude, 'feels_like': latitude, 'humidity': 50, 'pressure': 1010},
+            'wind': {'speed': 2.0},
+            'weather': [{'description': 'benchmark'}],
+        }).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def _percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] if values else None
+
+
+class Command(BaseCommand):
+    help = ('Load-test the sync (gunicorn, WSGI) and async (uvicorn, ASGI) endpoints '
+            'against a provider stub with a fixed delay, on the configured database')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', choices=TARGETS, default='fetch',
+                            help='fetch: POST fetch_weather; analytics: GET analytics')
+        parser.add_argument('--servers', choices=['wsgi', 'asgi', 'both'], default='both')
+        parser.add_argument('--requests', type=int, default=300,
+                            help='Requests sent to each server')
+        parser.add_argument('--concurrency', type=int, default=100,
+                            help='Requests in flight at once')
+        parser.add_argument('--delay', type=float, default=1.0,
+                            help='Seconds the provider stub takes per request')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Server processes')
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Threads per gunicorn worker')
+        parser.add_argument('--cities', type=int, default=50,
+                            help='Benchmark cities the requests are spread over')
+
+    def handle(self, *args, **options):
+        if options['requests'] < 1 or options['concurrency'] < 1 or options['cities'] < 1:
+            raise CommandError('--requests, --concurrency and --cities must be positive')
+
+        provider = ThreadingHTTPServer(('127.0.0.1', 0), SlowProviderHandler)
+        provider.daemon_threads = True
+        provider.delay = options['delay']
+        threading.Thread(target=provider.serve_forever, daemon=True).start()
+
+        # Distinct coordinates, so every fetch reaches the provider
+        cities = [
+            City.objects.create(name=f'Benchmark city {i} ({os.getpid()})', country='Benchmark',
+                                latitude=i / 100, longitude=0.0)
+            for i in range(options['cities'])
+        ]
+        try:
+            servers = ['wsgi', 'asgi'] if options['servers'] == 'both' else [options['servers']]
+            results = [
+                self.run_server(server, [city.id for city in cities],
+                                f'http://127.0.0.1:{provider.server_port}', options)
+                for server in servers
+            ]
+        finally:
+            City.objects.filter(id__in=[city.id for city in cities]).delete()
+            provider.shutdown()
+
+        self.stdout.write(
+            f"{options['requests']} requests, {options['concurrency']} concurrent, "
+            f"provider delay {options['delay']}s, target {options['target']}"
+        )
+        self.stdout.write(f"{'server':<8}{'req/s':>9}{'p50 ms':>10}{'p95 ms':>10}"
+                          f"{'p99 ms':>10}{'errors':>8}")
+        for server, result in zip(servers, results):
+            self.stdout.write(
+                f"{server:<8}{result['throughput']:>9.1f}{result['p50']:>10.0f}"
+                f"{result['p95']:>10.0f}{result['p99']:>10.0f}{result['errors']:>8}"
+            )
+
+    def run_server(self, server, city_ids, provider_url, options):
+        port = _free_port()
+        if server == 'wsgi':
+            command = [sys.executable, '-m', 'gunicorn', 'weather_project.wsgi:application',
+                       '--bind', f'127.0.0.1:{port}', '--workers', str(options['workers']),
+                       '--threads', str(options['threads']), '--log-level', 'warning']
+        else:
+            command = [sys.executable, '-m', 'uvicorn', 'weather_project.asgi:application',
+                       '--host', '127.0.0.1', '--port', str(port),
+                       '--workers', str(options['workers']), '--log-level', 'warning']
+        # Plain HTTP on localhost: DEBUG skips the production HTTPS redirect
+        env = dict(
+            os.environ,
+            DEBUG='True',
+            OPENWEATHER_API_URL=provider_url,
+            OPENWEATHER_CACHE_BACKEND='none',
+            OPENWEATHER_MAX_RETRIES='0',
+            OPENWEATHER_TIMEOUT=str(options['delay'] + 30),
+        )
+        self.stderr.write(f'Starting {server} server on port {port}')
+        process = subprocess.Popen(command, cwd=settings.BASE_DIR, env=env)
+        try:
+            base_url = f'http://127.0.0.1:{port}'
+            self.wait_until_up(base_url, process)
+            return asyncio.run(self.load(base_url, server, city_ids, options))
+        finally:
+            process.terminate()
+            process.wait(timeout=30)
+
+    def wait_until_up(self, base_url, process, timeout=30):
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise CommandError(f'Server exited with status {process.returncode}')
+            try:
+                httpx.get(f'{base_url}/api/', timeout=1)
+                return
+            except httpx.TransportError:
+                time.sleep(0.2)
+        raise CommandError(f'Server did not start within {timeout}s')
+
+    async def load(self, base_url, server, city_ids, options):
+        method, wsgi_path, asgi_path = TARGETS[options['target']]
+        path = wsgi_path if server == 'wsgi' else asgi_path
+        semaphore = asyncio.Semaphore(options['concurrency'])
+        latencies, errors = [], 0
+        limits = httpx.Limits(max_connections=options['concurrency'])
+
+        async with httpx.AsyncClient(base_url=base_url, limits=limits,
+                                     timeout=options['delay'] * options['requests'] + 60) as client:
+            async def send(i):
+                nonlocal errors
+                async with semaphore:
+                    started = time.monotonic()
+                    try:
+                        response = await client.request(
+                            method, path.format(city=city_ids[i % len(city_ids)])
+                        )
+                        failed = not response.is_success
+                    except httpx.HTTPError:
+                        failed = True
+                    latencies.append(time.monotonic() - started)
+                    errors += failed
+
+            started = time.monotonic()
+            await asyncio.gather(*(send(i) for i in range(options['requests'])))
+            elapsed = time.monotonic() - started
+
+        return {
+            'throughput': options['requests'] / elapsed,
+            'p50': _percentile(latencies, 0.5) * 1000,
+            'p95': _percentile(latencies, 0.95) * 1000,
+            'p99': _percentile(latencies, 0.99) * 1000,
+            'errors': errors,
+        }
@@ -0,0 +1,38 @@
+from django.core.management.base import BaseCommand
+
+from weather_app.models import City
+from weather_app.openweather import fetch_cities, get_client
+
+
+class Command(BaseCommand):
+    help = 'Fetch current weather for all (or selected) cities concurrently'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--city-id', type=int, action='append', dest='city_ids',
+                            help='Only fetch this city (repeatable)')
+        parser.add_argument('--workers', type=int,
+                            help='Concurrent HTTP workers (default: OPENWEATHER_FETCH_WORKERS)')
+        parser.add_argument('--rate', type=float,
+                            help='Max requests per second (default: OPENWEATHER_RATE_LIMIT)')
+
+    def handle(self, *args, **options):
+        cities = City.objects.all()
+        if options['city_ids']:
+            cities = cities.filter(id__in=options['city_ids'])
+
+        results = fetch_cities(cities, workers=options['workers'], rate=options['rate'])
+        for result in results:
+            if result['success']:
+                self.stdout.write(f"{result['city_name']}: {result['temperature']}°C")
+            else:
+                self.stderr.write(f"{result['city_name']}: {result['error']}")
+
+        fetched = sum(1 for result in results if result['success'])
+        stats = get_client().stats.snapshot()
+        self.stdout.write(
+            f"Provider: {stats['requests']} requests, {stats['retries']} retries, "
+            f"{stats['failures']} failures, avg latency {stats['avg_latency_ms']} ms"
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Fetched {fetched} of {len(results)} cities'
+        ))
@@ -0,0 +1,173 @@
+import csv
+import io
+import json
+import time
+from collections import Counter
+from datetime import timezone as dt_timezone
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from weather_app import analytics_cache, counts, dashboard, rollups
+from weather_app.models import City, WeatherRecord
+
+COLUMNS = ['city_id', 'temperature', 'feels_like', 'humidity', 'pressure',
+           'wind_speed', 'description', 'recorded_at', 'created_at', 'updated_at']
+MAX_REPORTED_ERRORS = 20
+
+
+class Command(BaseCommand):
+    help = ('Load historical weather readings from a CSV or NDJSON file. Uses '
+            'PostgreSQL COPY when available, chunked bulk_create otherwise.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV (with header) or NDJSON file')
+        parser.add_argument('--format', choices=['csv', 'ndjson'],
+                            help='Input format (default: from the file extension)')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Rows held in memory and written per transaction')
+        parser.add_argument('--no-copy', action='store_true',
+                            help='Use bulk_create even on PostgreSQL')
+        parser.add_argument('--skip-rollups', action='store_true',
+                            help='Do not fold the loaded rows into the rollups')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        fmt = options['format'] or ('ndjson' if path.endswith(('.ndjson', '.jsonl')) else 'csv')
+        chunk_size = options['chunk_size']
+        use_copy = not options['no_copy'] and self.supports_copy()
+        write_chunk = self.copy_chunk if use_copy else self.bulk_create_chunk
+
+        # Built once; every row resolves its city with a dict lookup.
+        self.city_ids = dict(City.objects.values_list('name', 'id'))
+        self.loaded_at = timezone.now()
+        self.skipped = 0
+        self.errors = []
+        loaded = 0
+
+        started = time.monotonic()
+        try:
+            with open(path, newline='', encoding='utf-8') as source:
+                chunk = []
+                for line_number, raw in self.read_rows(source, fmt):
+                    row = self.convert(line_number, raw)
+                    if row is None:
+                        continue
+                    chunk.append(row)
+                    if len(chunk) >= chunk_size:
+                        self.load_chunk(write_chunk, chunk, options['skip_rollups'])
+                        loaded += len(chunk)
+                        chunk = []
+                if chunk:
+                    self.load_chunk(write_chunk, chunk, options['skip_rollups'])
+                    loaded += len(chunk)
+        except OSError as e:
+            raise CommandError(f'Cannot read {path}: {e}')
+        elapsed = time.monotonic() - started
+
+        for error in self.errors:
+            self.stderr.write(error)
+
+        rate = loaded / elapsed if elapsed else loaded
+        self.stdout.write(self.style.SUCCESS(
+            f"Loaded {loaded} rows ({self.skipped} skipped) in {elapsed:.2f}s "
+            f"- {rate:,.0f} rows/s via {'COPY' if use_copy else 'bulk_create'}"
+        ))
+
+    def supports_copy(self):
+        if connection.vendor != 'postgresql':
+            return False
+        with connection.cursor() as cursor:
+            return hasattr(cursor.cursor, 'copy_expert')
+
+    def read_rows(self, source, fmt):
+        if fmt == 'csv':
+            reader = csv.DictReader(source)
+            for row in reader:
+                yield reader.line_num, row
+            return
+        for line_number, line in enumerate(source, start=1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                yield line_number, json.loads(line)
+            except ValueError as e:
+                yield line_number, e
+
+    def convert(self, line_number, raw):
+        """Return a tuple in COLUMNS order, or None if the row is skipped."""
+        if isinstance(raw, Exception):
+            return self.skip(line_number, f'invalid JSON ({raw})')
+        if not isinstance(raw, dict):
+            return self.skip(line_number, 'expected an object')
+        city_id = self.city_ids.get(raw.get('city'))
+        if city_id is None:
+            return self.skip(line_number, f"unknown city {raw.get('city')!r}")
+        try:
+            recorded_at = parse_datetime(str(raw['recorded_at']))
+            if recorded_at is None:
+                raise ValueError(f"invalid recorded_at {raw['recorded_at']!r}")
+            if timezone.is_naive(recorded_at):
+                recorded_at = timezone.make_aware(recorded_at, dt_timezone.utc)
+            return (
+                city_id,
+                float(raw['temperature']),
+                float(raw['feels_like']),
+                int(raw['humidity']),
+                int(raw['pressure']),
+                float(raw['wind_speed']),
+                str(raw['description'])[:200],
+                recorded_at,
+                self.loaded_at,
+                self.loaded_at,
+            )
+        except (KeyError, TypeError, ValueError) as e:
+            return self.skip(line_number, f'{type(e).__name__}: {e}')
+
+    def skip(self, line_number, reason):
+        self.skipped += 1
+        if len(self.errors) < MAX_REPORTED_ERRORS:
+            self.errors.append(f'Row {line_number}: {reason}')
+        return None
+
+    def load_chunk(self, write_chunk, chunk, skip_rollups):
+        """
+        Write ``chunk`` and, in the same transaction, bring the record
+        counters and rollups up to date with it, so an interrupted load
+        leaves every committed chunk fully accounted for.
+        """
+        with transaction.atomic():
+            write_chunk(chunk)
+            counts.adjust(Counter(row[0] for row in chunk))
+            if not skip_rollups:
+                rollups.apply_records([WeatherRecord(**dict(zip(COLUMNS, row))) for row in chunk])
+            earliest = {}
+            for row in chunk:
+                earliest[row[0]] = min(earliest.get(row[0], row[7]), row[7])
+            for city_id, recorded_at in earliest.items():
+                analytics_cache.invalidate_on_commit(city_id, recorded_at)
+            transaction.on_commit(dashboard.invalidate)
+
+    def copy_chunk(self, chunk):
+        buffer = io.StringIO()
+        # COPY reads an unquoted empty field as NULL: quote every value so an
+        # empty description stays an empty string
+        writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+        for row in chunk:
+            writer.writerow(row[:7] + tuple(value.isoformat() for value in row[7:]))
+        buffer.seek(0)
+        with connection.cursor() as cursor:
+            cursor.copy_expert(
+                f"COPY {WeatherRecord._meta.db_table} ({', '.join(COLUMNS)}) "
+                f"FROM STDIN WITH (FORMAT csv)",
+                buffer
+            )
+
+    def bulk_create_chunk(self, chunk):
+        WeatherRecord.objects.bulk_create(
+            [WeatherRecord(**dict(zip(COLUMNS, row))) for row in chunk],
+            batch_size=1000
+        )
@@ -0,0 +1,66 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from weather_app import analytics_cache, counts, dashboard, partitions
+
+
+class Command(BaseCommand):
+    help = ('Maintain monthly PostgreSQL partitions of weather_records: create '
+            'the coming months and drop months past the retention period')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--convert', action='store_true',
+                            help='Partition the table first if it is still a plain table')
+        parser.add_argument('--ahead', type=int, default=settings.WEATHER_PARTITION_MONTHS_AHEAD,
+                            help='Months after the current one to pre-create')
+        parser.add_argument('--retain-months', type=int,
+                            default=settings.WEATHER_PARTITION_RETENTION_MONTHS,
+                            help='Drop partitions older than this many whole months (0 keeps all)')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioning needs PostgreSQL')
+        if not partitions.is_partitioned(connection):
+            if not options['convert']:
+                raise CommandError('weather_records is not partitioned; pass --convert '
+                                   'or set WEATHER_PARTITIONING=True before migrating')
+            with transaction.atomic():
+                partitions.convert(connection, months_ahead=options['ahead'])
+            self.stdout.write('Converted weather_records to monthly partitions')
+
+        current = partitions.month_start(timezone.now())
+        with transaction.atomic():
+            created = partitions.ensure_partitions(
+                connection, current, partitions.add_months(current, options['ahead'])
+            )
+        for name in created:
+            self.stdout.write(f'Created {name}')
+
+        dropped = 0
+        if options['retain_months'] > 0:
+            cutoff = partitions.add_months(current, -options['retain_months'])
+            for month, name in partitions.expired_partitions(connection, cutoff):
+                with transaction.atomic():
+                    per_city = partitions.partition_city_counts(connection, name)
+                    partitions.drop_partition(connection, name)
+                    self.forget(per_city, partitions.add_months(month, 1))
+                dropped += 1
+                self.stdout.write(f'Dropped {name} ({sum(per_city.values())} readings)')
+            with transaction.atomic():
+                per_city = partitions.expire_default_partition(connection, cutoff)
+                self.forget(per_city, cutoff)
+            if per_city:
+                self.stdout.write(f'Deleted {sum(per_city.values())} expired readings '
+                                  f'from {partitions.DEFAULT_PARTITION}')
+            dashboard.invalidate()
+
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(created)} partitions created, {dropped} dropped'
+        ))
+
+    def forget(self, per_city, recorded_before):
+        counts.adjust({city_id: -n for city_id, n in per_city.items()})
+        for city_id in per_city:
+            analytics_cache.invalidate(city_id, recorded_before)
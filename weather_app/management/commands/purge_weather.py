@@ -0,0 +1,52 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from weather_app import counts, retention
+from weather_app.models import WeatherRecord
+
+
+class Command(BaseCommand):
+    help = ('Downsample raw weather readings older than the retention period into '
+            'the hourly/daily rollups, then delete them in small batches')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.WEATHER_RAW_RETENTION_DAYS,
+                            help='Keep raw readings for this many days')
+        parser.add_argument('--batch-size', type=int, default=5000,
+                            help='Rows deleted per transaction')
+        parser.add_argument('--pause', type=float, default=0.0,
+                            help='Seconds to sleep between batches')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Only report how many readings would be removed')
+
+    def handle(self, *args, **options):
+        if options['days'] <= 0:
+            raise CommandError('--days must be positive')
+        cutoff = retention.retention_cutoff(options['days'])
+        expired = WeatherRecord.objects.filter(recorded_at__lt=cutoff)
+
+        if options['dry_run']:
+            self.stdout.write(f'{expired.count()} raw readings recorded before '
+                              f'{cutoff.isoformat()} would be removed')
+            return
+
+        written = retention.downsample(cutoff)
+        for resolution, rows in written.items():
+            self.stdout.write(f'{resolution}: {rows} rollup rows written')
+
+        size_before = retention.table_bytes()
+        rows_before = counts.record_count()
+        deleted, batches = retention.purge(cutoff, options['batch_size'], options['pause'])
+        total = sum(deleted.values())
+
+        if size_before is None:
+            reclaimed = 'n/a on this database'
+        else:
+            # Space is freed for reuse by (auto)vacuum rather than returned
+            # to the OS, so report the deleted rows' share of the table.
+            per_row = size_before / rows_before if rows_before else 0
+            reclaimed = f'~{total * per_row / 1024 ** 2:,.1f} MB'
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {total} raw readings recorded before {cutoff.isoformat()} '
+            f'in {batches} batches; reclaimed {reclaimed}'
+        ))
@@ -0,0 +1,28 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from weather_app.rollups import rebuild_rollups
+
+
+class Command(BaseCommand):
+    help = 'Rebuild hourly and daily weather rollups from raw weather records'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int,
+                            help='Only rebuild the last N days (default: everything)')
+        parser.add_argument('--city-id', type=int, action='append', dest='city_ids',
+                            help='Only rebuild this city (repeatable)')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        start = None
+        if options['days'] is not None:
+            start = timezone.now() - timedelta(days=options['days'])
+
+        written = rebuild_rollups(start=start, city_ids=options['city_ids'],
+                                  batch_size=options['batch_size'])
+        for resolution, count in written.items():
+            self.stdout.write(f'{resolution}: {count} rollup rows written')
+        self.stdout.write(self.style.SUCCESS('Rollups rebuilt'))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from weather_app import counts, dashboard
+
+
+class Command(BaseCommand):
+    help = 'Recompute the maintained per-city weather record counters'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--city-id', type=int, action='append', dest='city_ids',
+                            help='Only recount this city (repeatable)')
+
+    def handle(self, *args, **options):
+        updated = counts.recount(options['city_ids'])
+        dashboard.invalidate()
+        self.stdout.write(self.style.SUCCESS(
+            f'Recounted {updated} cities: {counts.maintained_count()} weather records'
+        ))
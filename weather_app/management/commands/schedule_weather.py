@@ -0,0 +1,80 @@
+import logging
+import signal
+import threading
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from weather_app.scheduler import FetchScheduler
+
+logger = logging.getLogger(__name__)
+
+# Seconds to wait after a failed batch, so a lasting outage (e.g. the
+# database going away) is not retried in a tight loop
+ERROR_PAUSE = 5
+
+
+class Command(BaseCommand):
+    help = ('Keep fetching current weather for every city on its own refresh interval '
+            '(or, with --once, fetch the cities that are due and exit)')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true',
+                            help='Fetch every city that is due now, then exit (for cron)')
+        parser.add_argument('--batch-size', type=int,
+                            help='Cities fetched per batch (default: WEATHER_SCHEDULER_BATCH_SIZE)')
+        parser.add_argument('--workers', type=int,
+                            help='Concurrent HTTP workers (default: OPENWEATHER_FETCH_WORKERS)')
+        parser.add_argument('--rate', type=float,
+                            help='Max requests per second (default: OPENWEATHER_RATE_LIMIT)')
+        parser.add_argument('--reload', type=float, default=60,
+                            help='Seconds between re-reading the cities table (default: 60)')
+
+    def handle(self, *args, **options):
+        scheduler = FetchScheduler(batch_size=options['batch_size'],
+                                   workers=options['workers'], rate=options['rate'])
+        if options['once']:
+            scheduler.load()
+            fetched = total = 0
+            while results := scheduler.run_due():
+                fetched, total = fetched + self.report(results), total + len(results)
+            self.stdout.write(self.style.SUCCESS(f'Fetched {fetched} of {total} due cities'))
+            return
+
+        stop = threading.Event()
+        signal.signal(signal.SIGTERM, lambda *args: stop.set())
+        scheduler.load(initial=True)
+        self.stdout.write(f'Scheduling {len(scheduler.heap)} cities')
+        reload_at = time.monotonic() + options['reload']
+        try:
+            while not stop.is_set():
+                # Like a request: don't hold on to stale connections between batches
+                close_old_connections()
+                try:
+                    if time.monotonic() >= reload_at:
+                        scheduler.load()
+                        reload_at = time.monotonic() + options['reload']
+                    results = scheduler.run_due()
+                except Exception:
+                    logger.exception('Scheduled fetch failed')
+                    stop.wait(ERROR_PAUSE)
+                    continue
+                if results:
+                    fetched = self.report(results)
+                    self.stdout.write(f'Fetched {fetched} of {len(results)} due cities')
+                    continue
+                wait = reload_at - time.monotonic()
+                due = scheduler.seconds_until_due()
+                if due is not None:
+                    wait = min(wait, due)
+                stop.wait(max(wait, 0))
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS('Scheduler stopped'))
+
+    def report(self, results):
+        for result in results:
+            if not result['success']:
+                self.stderr.write(f"{result['city_name']}: {result['error']}")
+        return sum(1 for result in results if result['success'])
@@ -0,0 +1,79 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:14
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyWeatherRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField()),
+                ('record_count', models.IntegerField(default=0)),
+                ('temperature_sum', models.FloatField(default=0)),
+                ('temperature_min', models.FloatField()),
+                ('temperature_max', models.FloatField()),
+                ('humidity_sum', models.FloatField(default=0)),
+                ('humidity_min', models.IntegerField()),
+                ('humidity_max', models.IntegerField()),
+                ('pressure_sum', models.FloatField(default=0)),
+                ('pressure_min', models.IntegerField()),
+                ('pressure_max', models.IntegerField()),
+                ('wind_speed_sum', models.FloatField(default=0)),
+                ('wind_speed_min', models.FloatField()),
+                ('wind_speed_max', models.FloatField()),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='weather_app.city')),
+            ],
+            options={
+                'db_table': 'weather_rollups_daily',
+                'ordering': ['-bucket_start'],
+                'abstract': False,
+            },
+        ),
+        migrations.CreateModel(
+            name='HourlyWeatherRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket_start', models.DateTimeField()),
+                ('record_count', models.IntegerField(default=0)),
+                ('temperature_sum', models.FloatField(default=0)),
+                ('temperature_min', models.FloatField()),
+                ('temperature_max', models.FloatField()),
+                ('humidity_sum', models.FloatField(default=0)),
+                ('humidity_min', models.IntegerField()),
+                ('humidity_max', models.IntegerField()),
+                ('pressure_sum', models.FloatField(default=0)),
+                ('pressure_min', models.IntegerField()),
+                ('pressure_max', models.IntegerField()),
+                ('wind_speed_sum', models.FloatField(default=0)),
+                ('wind_speed_min', models.FloatField()),
+                ('wind_speed_max', models.FloatField()),
+                ('city', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='weather_app.city')),
+            ],
+            options={
+                'db_table': 'weather_rollups_hourly',
+                'ordering': ['-bucket_start'],
+                'abstract': False,
+                'indexes': [models.Index(fields=['bucket_start'], name='weather_rol_bucket__b52ed4_idx')],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='hourlyweatherrollup',
+            constraint=models.UniqueConstraint(fields=('city', 'bucket_start'), name='unique_hourly_rollup'),
+        ),
+        migrations.AddIndex(
+            model_name='dailyweatherrollup',
+            index=models.Index(fields=['bucket_start'], name='weather_rol_bucket__3638a4_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyweatherrollup',
+            constraint=models.UniqueConstraint(fields=('city', 'bucket_start'), name='unique_daily_rollup'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-17 04:17
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0002_weather_rollups'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='openweather_id',
+            field=models.IntegerField(blank=True, db_index=True, help_text='OpenWeatherMap city ID, used to batch lookups', null=True),
+        ),
+    ]
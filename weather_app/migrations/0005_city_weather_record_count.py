@@ -0,0 +1,31 @@
+# Generated by Django 4.2.7 on 2026-10-17 10:03
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def backfill_counts(apps, schema_editor):
+    City = apps.get_model('weather_app', 'City')
+    WeatherRecord = apps.get_model('weather_app', 'WeatherRecord')
+    per_city = (
+        WeatherRecord.objects.filter(city_id=OuterRef('pk'))
+        .order_by().values('city_id').annotate(n=Count('id')).values('n')
+    )
+    City.objects.update(weather_record_count=Coalesce(Subquery(per_city), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0004_weatherrecord_updated_at'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='weather_record_count',
+            field=models.IntegerField(default=0, editable=False, help_text='Maintained number of weather records (see weather_app.counts)'),
+        ),
+        migrations.RunPython(backfill_counts, migrations.RunPython.noop),
+    ]
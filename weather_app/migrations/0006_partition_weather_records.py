@@ -0,0 +1,24 @@
+from django.conf import settings
+from django.db import migrations
+
+from weather_app import partitions
+
+
+def partition_weather_records(apps, schema_editor):
+    # Opt-in, PostgreSQL only; elsewhere weather_records stays a plain table.
+    connection = schema_editor.connection
+    if not settings.WEATHER_PARTITIONING or connection.vendor != 'postgresql':
+        return
+    if not partitions.is_partitioned(connection):
+        partitions.convert(connection, months_ahead=settings.WEATHER_PARTITION_MONTHS_AHEAD)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0005_city_weather_record_count'),
+    ]
+
+    operations = [
+        migrations.RunPython(partition_weather_records, migrations.RunPython.noop, elidable=False),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.7 on 2026-10-17 05:01
+
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('weather_app', '0006_partition_weather_records'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='city',
+            name='fetch_failures',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Consecutive failed scheduled fetches'),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='next_fetch_at',
+            field=models.DateTimeField(blank=True, editable=False, help_text='When the scheduler fetches this city next (see weather_app.scheduler)', null=True),
+        ),
+        migrations.AddField(
+            model_name='city',
+            name='refresh_interval',
+            field=models.PositiveIntegerField(blank=True, help_text='Seconds between scheduled fetches; empty uses WEATHER_REFRESH_INTERVAL', null=True, validators=[django.core.validators.MinValueValidator(60)]),
+        ),
+    ]
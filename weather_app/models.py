@@ -1,6 +1,9 @@
 from django.db import models
 
+from django.core.validators import MinValueValidator
 from django.db import models
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
 from django.utils import timezone
 
 class City(models.Model):
@@ -8,6 +11,26 @@ class City(models.Model):
     country = models.CharField(max_length=100)
     latitude = models.FloatField()
     longitude = models.FloatField()
+    openweather_id = models.IntegerField(
+        null=True, blank=True, db_index=True,
+        help_text="OpenWeatherMap city ID, used to batch lookups"
+    )
+    weather_record_count = models.IntegerField(
+        default=0, editable=False,
+        help_text="Maintained number of weather records (see weather_app.counts)"
+    )
+    refresh_interval = models.PositiveIntegerField(
+        null=True, blank=True, validators=[MinValueValidator(60)],
+        help_text="Seconds between scheduled fetches; empty uses WEATHER_REFRESH_INTERVAL"
+    )
+    next_fetch_at = models.DateTimeField(
+        null=True, blank=True, editable=False,
+        help_text="When the scheduler fetches this city next (see weather_app.scheduler)"
+    )
+    fetch_failures = models.PositiveIntegerField(
+        default=0, editable=False,
+        help_text="Consecutive failed scheduled fetches"
+    )
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
@@ -20,6 +43,36 @@ class City(models.Model):
         return f"{self.name}, {self.country}"
 
 
+class WeatherRecordQuerySet(models.QuerySet):
+    def bulk_ingest(self, records, batch_size=None):
+        """
+        bulk_create ``records`` and send ``records_ingested`` so rollups
+        stay current (bulk_create does not send post_save).
+        """
+        from .signals import records_ingested
+
+        created = self.bulk_create(records, batch_size=batch_size)
+        if created:
+            records_ingested.send(sender=self.model, records=created)
+        return created
+
+    def latest_per_city(self, city_ids, limit):
+        """
+        The newest ``limit`` records of each city in ``city_ids``, fetched
+        with one ROW_NUMBER() OVER (PARTITION BY city_id ...) query.
+        """
+        return (
+            self.filter(city_id__in=city_ids)
+            .annotate(row_number=Window(
+                RowNumber(),
+                partition_by=[F('city_id')],
+                order_by=[F('recorded_at').desc(), F('id').desc()],
+            ))
+            .filter(row_number__lte=limit)
+            .order_by('city_id', 'row_number')
+        )
+
+
 class WeatherRecord(models.Model):
     city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='weather_records')
     temperature = models.FloatField(help_text="Temperature in Celsius")
@@ -30,6 +83,9 @@ class WeatherRecord(models.Model):
     description = models.CharField(max_length=200)
     recorded_at = models.DateTimeField(default=timezone.now)
     created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    objects = WeatherRecordQuerySet.as_manager()
 
     class Meta:
         db_table = 'weather_records'
@@ -41,3 +97,53 @@ class WeatherRecord(models.Model):
 
     def __str__(self):
         return f"{self.city.name} - {self.temperature}°C at {self.recorded_at}"
+
+
+class WeatherRollup(models.Model):
+    """Pre-aggregated readings for one city over one time bucket."""
+    city = models.ForeignKey(City, on_delete=models.CASCADE, related_name='+')
+    bucket_start = models.DateTimeField()
+    record_count = models.IntegerField(default=0)
+    temperature_sum = models.FloatField(default=0)
+    temperature_min = models.FloatField()
+    temperature_max = models.FloatField()
+    humidity_sum = models.FloatField(default=0)
+    humidity_min = models.IntegerField()
+    humidity_max = models.IntegerField()
+    pressure_sum = models.FloatField(default=0)
+    pressure_min = models.IntegerField()
+    pressure_max = models.IntegerField()
+    wind_speed_sum = models.FloatField(default=0)
+    wind_speed_min = models.FloatField()
+    wind_speed_max = models.FloatField()
+
+    class Meta:
+        abstract = True
+        ordering = ['-bucket_start']
+
+    def __str__(self):
+        return f"{self.city_id} - {self.record_count} readings from {self.bucket_start}"
+
+
+class HourlyWeatherRollup(WeatherRollup):
+    class Meta(WeatherRollup.Meta):
+        db_table = 'weather_rollups_hourly'
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'bucket_start'],
+                                    name='unique_hourly_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['bucket_start']),
+        ]
+
+
+class DailyWeatherRollup(WeatherRollup):
+    class Meta(WeatherRollup.Meta):
+        db_table = 'weather_rollups_daily'
+        constraints = [
+            models.UniqueConstraint(fields=['city', 'bucket_start'],
+                                    name='unique_daily_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['bucket_start']),
+        ]
@@ -0,0 +1,639 @@
+"""
+OpenWeatherMap integration: fetching current weather for one or many cities
+and turning the responses into WeatherRecord rows.
+
+Every fetch has an ``a``-prefixed coroutine twin for the async views. Those
+use an ``httpx.AsyncClient``, so one process can wait on hundreds of slow
+provider calls without a thread each, and leave database work to
+``weather_app.concurrency.run_sync``.
+"""
+import asyncio
+import random
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from email.utils import parsedate_to_datetime
+from functools import lru_cache
+
+import httpx
+import requests
+from django.conf import settings
+from django.core.cache import caches
+from django.core.signals import setting_changed
+from django.dispatch import receiver
+from django.utils import timezone
+from requests.adapters import HTTPAdapter
+
+from .concurrency import run_sync
+from .models import City, WeatherRecord
+
+
+class RateLimiter:
+    """Spaces calls at least ``1 / rate`` seconds apart across threads."""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0.0
+        self._lock = threading.Lock()
+        self._next_slot = 0.0
+
+    def _reserve(self):
+        """Claim the next slot; returns seconds to wait for it."""
+        if not self.interval:
+            return 0.0
+        with self._lock:
+            now = time.monotonic()
+            slot = max(self._next_slot, now)
+            self._next_slot = slot + self.interval
+        return slot - now
+
+    def wait(self):
+        delay = self._reserve()
+        if delay > 0:
+            time.sleep(delay)
+
+    async def await_slot(self):
+        delay = self._reserve()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+# The provider rejects group requests with more IDs than this.
+GROUP_SIZE_LIMIT = 20
+
+
+class ClientStats:
+    """Thread-safe request, retry, failure and latency counters."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+
+    def record_request(self, latency):
+        with self._lock:
+            self.requests += 1
+            self.total_latency += latency
+            self.max_latency = max(self.max_latency, latency)
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                'requests': self.requests,
+                'retries': self.retries,
+                'failures': self.failures,
+                'avg_latency_ms': round(self.total_latency / self.requests * 1000, 2)
+                if self.requests else None,
+                'max_latency_ms': round(self.max_latency * 1000, 2),
+            }
+
+
+class BaseOpenWeatherClient:
+    """
+    Settings, counters and retry policy shared by the sync and async
+    clients: 429 and 5xx responses and connection errors are retried with
+    exponential backoff and full jitter, honouring ``Retry-After`` when the
+    provider sends one.
+    """
+    RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+
+    def __init__(self, base_url, api_key, pool_size=10, max_retries=3,
+                 backoff=0.5, max_backoff=30.0, timeout=10, stats=None):
+        self.base_url = base_url.rstrip('/')
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.stats = stats or ClientStats()
+
+    def request_args(self, endpoint, params):
+        return f'{self.base_url}/{endpoint}', dict(params, appid=self.api_key, units='metric')
+
+    def retry_delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after:
+            try:
+                delay = float(retry_after)
+            except ValueError:
+                try:
+                    delay = (parsedate_to_datetime(retry_after) - timezone.now()).total_seconds()
+                except (TypeError, ValueError):
+                    delay = None
+            if delay is not None:
+                return min(max(delay, 0.0), self.max_backoff)
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+
+class OpenWeatherClient(BaseOpenWeatherClient):
+    """OpenWeatherMap client over a pooled ``requests.Session``."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=self.pool_size, pool_maxsize=self.pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, endpoint, params):
+        """GET ``endpoint`` and return the decoded JSON body."""
+        url, params = self.request_args(endpoint, params)
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            response, error = None, None
+            try:
+                response = self.session.get(url, params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            self.stats.record_request(time.monotonic() - started)
+
+            retryable = error is not None or response.status_code in self.RETRY_STATUSES
+            if not retryable or attempt == self.max_retries:
+                break
+            self.stats.record_retry()
+            time.sleep(self.retry_delay(attempt, response))
+
+        if error is not None:
+            self.stats.record_failure()
+            raise error
+        try:
+            response.raise_for_status()
+        except requests.HTTPError:
+            self.stats.record_failure()
+            raise
+        return response.json()
+
+
+class AsyncOpenWeatherClient(BaseOpenWeatherClient):
+    """
+    OpenWeatherMap client over an ``httpx.AsyncClient`` keeping up to
+    ``pool_size`` connections open. Bound to the event loop it is first
+    used on; see ``get_async_client``.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.client = httpx.AsyncClient(
+            timeout=self.timeout,
+            limits=httpx.Limits(max_connections=self.pool_size,
+                                max_keepalive_connections=self.pool_size),
+        )
+
+    async def get(self, endpoint, params):
+        """GET ``endpoint`` and return the decoded JSON body."""
+        url, params = self.request_args(endpoint, params)
+        for attempt in range(self.max_retries + 1):
+            started = time.monotonic()
+            response, error = None, None
+            try:
+                response = await self.client.get(url, params=params)
+            except httpx.TransportError as e:
+                error = e
+            self.stats.record_request(time.monotonic() - started)
+
+            retryable = error is not None or response.status_code in self.RETRY_STATUSES
+            if not retryable or attempt == self.max_retries:
+                break
+            self.stats.record_retry()
+            await asyncio.sleep(self.retry_delay(attempt, response))
+
+        if error is not None:
+            self.stats.record_failure()
+            raise error
+        try:
+            response.raise_for_status()
+        except httpx.HTTPStatusError:
+            self.stats.record_failure()
+            raise
+        return response.json()
+
+    async def aclose(self):
+        await self.client.aclose()
+
+
+def _client_options():
+    return dict(
+        pool_size=settings.OPENWEATHER_POOL_SIZE,
+        max_retries=settings.OPENWEATHER_MAX_RETRIES,
+        backoff=settings.OPENWEATHER_BACKOFF,
+        max_backoff=settings.OPENWEATHER_MAX_BACKOFF,
+        timeout=settings.OPENWEATHER_TIMEOUT,
+    )
+
+
+@lru_cache(maxsize=None)
+def get_client():
+    """Return the process-wide client, built from settings on first use."""
+    return OpenWeatherClient(
+        settings.OPENWEATHER_API_URL,
+        settings.OPENWEATHER_API_KEY,
+        **_client_options(),
+    )
+
+
+# Bumped when OPENWEATHER_* settings change, to retire existing async clients
+_async_generation = 0
+
+# Client of the innermost async_client_session, if any
+_session_client = ContextVar('openweather_session_client', default=None)
+
+# Shared by every async client in the process, which come and go with loops
+# and sessions
+async_stats = ClientStats()
+
+
+def _new_async_client():
+    return AsyncOpenWeatherClient(
+        settings.OPENWEATHER_API_URL,
+        settings.OPENWEATHER_API_KEY,
+        stats=async_stats,
+        **dict(_client_options(), pool_size=settings.OPENWEATHER_ASYNC_POOL_SIZE),
+    )
+
+
+def client_stats():
+    """Request counters of this process's sync and async provider clients."""
+    return {'sync': get_client().stats.snapshot(), 'async': async_stats.snapshot()}
+
+
+def get_async_client():
+    """
+    Return the async client of the current async_client_session or, outside
+    one, of the running event loop, built on first use.
+
+    Pooled connections belong to the loop they were opened on, so the
+    loop's client is stored on the loop itself: one per process under an
+    ASGI server, where the loop lives as long as the process.
+    """
+    client = _session_client.get()
+    if client is not None:
+        return client
+    loop = asyncio.get_running_loop()
+    generation, client = getattr(loop, '_openweather_client', (None, None))
+    if generation != _async_generation:
+        client = _new_async_client()
+        loop._openweather_client = (_async_generation, client)
+    return client
+
+
+@asynccontextmanager
+async def async_client_session():
+    """
+    Serve get_async_client() inside the block from a client of its own,
+    closed on exit. For event loops that end with the block, such as the
+    one each async view runs on under WSGI, which would otherwise be left
+    holding an unclosed client and its sockets.
+    """
+    client = _new_async_client()
+    token = _session_client.set(client)
+    try:
+        yield client
+    finally:
+        _session_client.reset(token)
+        await client.aclose()
+
+
+class MemoryResponseCache:
+    """Per-process TTL cache with least-recently-used eviction."""
+
+    def __init__(self, ttl, max_entries):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    # In memory, so nothing to wait for
+    async def aget(self, key):
+        return self.get(key)
+
+    async def aset(self, key, value):
+        self.set(key, value)
+
+
+class DjangoResponseCache:
+    """TTL cache on a Django cache alias, shared between worker processes."""
+
+    def __init__(self, ttl, alias):
+        self.ttl = ttl
+        self.cache = caches[alias]
+
+    def get(self, key):
+        return self.cache.get(key)
+
+    def set(self, key, value):
+        self.cache.set(key, value, self.ttl)
+
+    async def aget(self, key):
+        return await self.cache.aget(key)
+
+    async def aset(self, key, value):
+        await self.cache.aset(key, value, self.ttl)
+
+
+@lru_cache(maxsize=None)
+def get_response_cache():
+    """Return the configured provider response cache, or None if disabled."""
+    backend = settings.OPENWEATHER_CACHE_BACKEND
+    if backend == 'memory':
+        return MemoryResponseCache(settings.OPENWEATHER_CACHE_TTL,
+                                   settings.OPENWEATHER_CACHE_MAX_ENTRIES)
+    if backend == 'django':
+        return DjangoResponseCache(settings.OPENWEATHER_CACHE_TTL,
+                                   settings.OPENWEATHER_CACHE_ALIAS)
+    return None
+
+
+@receiver(setting_changed)
+def reset_client(setting, **kwargs):
+    global _async_generation
+    if setting.startswith('OPENWEATHER_'):
+        get_client.cache_clear()
+        get_response_cache.cache_clear()
+        _async_generation += 1
+
+
+def fetch_current_weather(latitude, longitude):
+    """Return the provider's current-weather payload for a coordinate pair."""
+    return get_client().get('weather', {'lat': latitude, 'lon': longitude})
+
+
+def fetch_current_weather_cached(latitude, longitude):
+    """
+    Like fetch_current_weather, but served from the response cache while a
+    response for the same rounded coordinates is fresh.
+    Returns ``(payload, fetched_at, cached)``.
+    """
+    response_cache = get_response_cache()
+    key = _response_cache_key(latitude, longitude)
+    if response_cache is not None:
+        entry = response_cache.get(key)
+        if entry is not None:
+            return entry['data'], entry['fetched_at'], True
+
+    data = fetch_current_weather(latitude, longitude)
+    fetched_at = timezone.now()
+    if response_cache is not None:
+        response_cache.set(key, {'data': data, 'fetched_at': fetched_at})
+    return data, fetched_at, False
+
+
+async def afetch_current_weather(latitude, longitude):
+    return await get_async_client().get('weather', {'lat': latitude, 'lon': longitude})
+
+
+def _response_cache_key(latitude, longitude):
+    precision = settings.OPENWEATHER_CACHE_PRECISION
+    return f'openweather:weather:{latitude:.{precision}f}:{longitude:.{precision}f}'
+
+
+async def afetch_current_weather_cached(latitude, longitude):
+    """Coroutine version of fetch_current_weather_cached."""
+    response_cache = get_response_cache()
+    key = _response_cache_key(latitude, longitude)
+    if response_cache is not None:
+        entry = await response_cache.aget(key)
+        if entry is not None:
+            return entry['data'], entry['fetched_at'], True
+
+    data = await afetch_current_weather(latitude, longitude)
+    fetched_at = timezone.now()
+    if response_cache is not None:
+        await response_cache.aset(key, {'data': data, 'fetched_at': fetched_at})
+    return data, fetched_at, False
+
+
+def fetch_group(openweather_ids):
+    """
+    Return current-weather payloads for up to GROUP_SIZE_LIMIT provider city
+    IDs in one request, keyed by provider ID.
+    """
+    data = get_client().get('group', {'id': ','.join(str(i) for i in openweather_ids)})
+    return _group_payloads(data)
+
+
+async def afetch_group(openweather_ids):
+    data = await get_async_client().get('group', {'id': ','.join(str(i) for i in openweather_ids)})
+    return _group_payloads(data)
+
+
+def _group_payloads(data):
+    """
+    Key a group response's items by provider ID. Items without one are
+    skipped (their cities count as missing from the response); a response
+    that is not shaped like a group at all raises ValueError.
+    """
+    items = data.get('list', []) if isinstance(data, dict) else None
+    if not isinstance(items, list):
+        raise ValueError('malformed group response')
+    return {item['id']: item for item in items
+            if isinstance(item, dict) and item.get('id') is not None}
+
+
+def remember_openweather_id(city, data):
+    """
+    Store the provider city ID from a coordinate lookup on ``city`` so later
+    fetches can be batched. Returns True if the ID changed (unsaved).
+    """
+    openweather_id = data.get('id') or None
+    if openweather_id is None or openweather_id == city.openweather_id:
+        return False
+    city.openweather_id = openweather_id
+    return True
+
+
+def record_from_payload(city, data, recorded_at=None):
+    """Build an unsaved WeatherRecord from a current-weather payload."""
+    return WeatherRecord(
+        city=city,
+        temperature=data['main']['temp'],
+        feels_like=data['main']['feels_like'],
+        humidity=data['main']['humidity'],
+        pressure=data['main']['pressure'],
+        wind_speed=data['wind']['speed'],
+        description=data['weather'][0]['description'],
+        recorded_at=recorded_at or timezone.now()
+    )
+
+
+def store_current_weather(city, data, fetched_at, cached):
+    """
+    Save the reading in a current-weather payload for ``city``, unless it
+    came from the response cache and was saved already. Learns the city's
+    provider ID. Returns ``(record, created)``.
+    """
+    # A cached response already produced a record for this city unless the
+    # city moved or the record was removed since.
+    record = None
+    if cached:
+        record = city.weather_records.filter(recorded_at=fetched_at).first()
+    created = record is None
+    if created:
+        record = record_from_payload(city, data, fetched_at)
+        record.save()
+    if remember_openweather_id(city, data):
+        city.save(update_fields=['openweather_id'])
+    return record, created
+
+
+def _batches(cities):
+    """
+    Pack cities with a known provider ID into group requests; the rest need
+    one coordinate lookup each.
+    """
+    size = max(1, min(settings.OPENWEATHER_GROUP_SIZE, GROUP_SIZE_LIMIT))
+    known = [city for city in cities if city.openweather_id]
+    batches = [known[i:i + size] for i in range(0, len(known), size)]
+    batches.extend([city] for city in cities if not city.openweather_id)
+    return batches
+
+
+def _batch_outcomes(batch, payloads, learned):
+    """
+    ``{city_id: (unsaved record, None) | (None, error)}`` for one batch's
+    ``{city_id: payload}``; cities whose provider ID was learned from a
+    coordinate lookup are appended to ``learned``.
+    """
+    grouped = bool(batch[0].openweather_id)
+    outcomes = {}
+    for city in batch:
+        data = payloads[city.id]
+        if data is None:
+            outcomes[city.id] = (None, 'Failed to fetch weather data: city missing from response')
+            continue
+        try:
+            outcomes[city.id] = (record_from_payload(city, data), None)
+        except (KeyError, IndexError, TypeError) as e:
+            outcomes[city.id] = (None, f'Failed to fetch weather data: malformed response ({e!r})')
+            continue
+        if not grouped and remember_openweather_id(city, data):
+            learned.append(city)
+    return outcomes
+
+
+def _failed_outcomes(batch, error):
+    return {city.id: (None, f'Failed to fetch weather data: {error}') for city in batch}
+
+
+def _save_outcomes(outcomes, learned):
+    WeatherRecord.objects.bulk_ingest([record for record, _ in outcomes.values() if record])
+    if learned:
+        City.objects.bulk_update(learned, ['openweather_id'])
+
+
+def _results(cities, outcomes):
+    results = []
+    for city in cities:
+        record, error = outcomes[city.id]
+        result = {'city_id': city.id, 'city_name': city.name, 'success': record is not None}
+        if record is not None:
+            result['record_id'] = record.id
+            result['temperature'] = record.temperature
+        else:
+            result['error'] = error
+        results.append(result)
+    return results
+
+
+def fetch_cities(cities, workers=None, rate=None):
+    """
+    Fetch current weather for many cities and save every successful reading
+    with a single bulk insert.
+
+    Cities with a provider ID are looked up in groups of up to
+    GROUP_SIZE_LIMIT per request; the others by coordinates, learning their
+    provider ID for next time. Requests run on a bounded thread pool and are
+    throttled to ``rate`` per second; database writes stay on the calling
+    thread. Returns one result dict per city, in input order.
+    """
+    cities = list(cities)
+    batches = _batches(cities)
+    workers = workers or settings.OPENWEATHER_FETCH_WORKERS
+    limiter = RateLimiter(settings.OPENWEATHER_RATE_LIMIT if rate is None else rate)
+    learned = []
+
+    def fetch(batch):
+        limiter.wait()
+        try:
+            if batch[0].openweather_id:
+                payloads = fetch_group([city.openweather_id for city in batch])
+                payloads = {city.id: payloads.get(city.openweather_id) for city in batch}
+            else:
+                payloads = {batch[0].id: fetch_current_weather(batch[0].latitude,
+                                                               batch[0].longitude)}
+        except (requests.RequestException, ValueError) as e:
+            return _failed_outcomes(batch, e)
+        return _batch_outcomes(batch, payloads, learned)
+
+    outcomes = {}
+    with ThreadPoolExecutor(max_workers=max(1, min(workers, len(batches) or 1))) as executor:
+        for batch_outcomes in executor.map(fetch, batches):
+            outcomes.update(batch_outcomes)
+
+    _save_outcomes(outcomes, learned)
+    return _results(cities, outcomes)
+
+
+async def afetch_cities(cities, concurrency=None, rate=None):
+    """
+    Coroutine version of fetch_cities for a list of cities: up to
+    ``concurrency`` provider requests in flight on the event loop instead
+    of one thread each, then one bulk insert through ``run_sync``.
+    """
+    batches = _batches(cities)
+    semaphore = asyncio.Semaphore(concurrency or settings.OPENWEATHER_ASYNC_CONCURRENCY)
+    limiter = RateLimiter(settings.OPENWEATHER_RATE_LIMIT if rate is None else rate)
+    learned = []
+
+    async def fetch(batch):
+        async with semaphore:
+            await limiter.await_slot()
+            try:
+                if batch[0].openweather_id:
+                    payloads = await afetch_group([city.openweather_id for city in batch])
+                    payloads = {city.id: payloads.get(city.openweather_id) for city in batch}
+                else:
+                    payloads = {batch[0].id: await afetch_current_weather(batch[0].latitude,
+                                                                          batch[0].longitude)}
+            except (httpx.HTTPError, ValueError) as e:
+                return _failed_outcomes(batch, e)
+        return _batch_outcomes(batch, payloads, learned)
+
+    outcomes = {}
+    for batch_outcomes in await asyncio.gather(*(fetch(batch) for batch in batches)):
+        outcomes.update(batch_outcomes)
+
+    await run_sync(_save_outcomes, outcomes, learned)
+    return _results(cities, outcomes)
@@ -0,0 +1,201 @@
+"""
+Pagination for weather records.
+
+``/api/weather-records/`` keeps page-number pagination by default. Clients
+that just scroll can ask for ``?count=false`` to skip the ``COUNT(*)``, or
+``?pagination=cursor`` for keyset pagination over ``(-recorded_at, -id)``,
+which seeks straight to the next page instead of scanning an ``OFFSET``.
+"""
+import base64
+from collections import OrderedDict
+from functools import partial
+
+from django.core.paginator import EmptyPage, Paginator as DjangoPaginator
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination, PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+
+class HintedPaginator(DjangoPaginator):
+    """
+    Paginator that trusts a precomputed ``count`` (maintained or estimated)
+    instead of running ``COUNT(*)``. If a requested page lies past the
+    hinted end, it falls back to the exact count before giving up.
+    """
+
+    def __init__(self, object_list, per_page, count=None, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        if count is not None:
+            self.count = count
+
+    def validate_number(self, number):
+        try:
+            return super().validate_number(number)
+        except EmptyPage:
+            if 'count' not in self.__dict__:
+                raise
+            del self.count
+            self.__dict__.pop('num_pages', None)
+            return super().validate_number(number)
+
+
+class HintedPageNumberPagination(PageNumberPagination):
+    """Page numbers whose total comes from ``view.get_count_hint()`` when available."""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        hint = view.get_count_hint() if hasattr(view, 'get_count_hint') else None
+        self.django_paginator_class = partial(HintedPaginator, count=hint)
+        return super().paginate_queryset(queryset, request, view)
+
+
+class UncountedPageNumberPagination(PageNumberPagination):
+    """Page numbers without the total count; one extra row reveals a next page."""
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        try:
+            self.page_number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound('Invalid page.')
+        if self.page_number < 1:
+            raise NotFound('Invalid page.')
+
+        offset = (self.page_number - 1) * page_size
+        rows = list(queryset[offset:offset + page_size + 1])
+        self.has_next = len(rows) > page_size
+        return rows[:page_size]
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if not self.has_next:
+            return None
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.page_query_param, self.page_number + 1)
+
+    def get_previous_link(self):
+        if self.page_number == 1:
+            return None
+        url = self.request.build_absolute_uri()
+        if self.page_number == 2:
+            return remove_query_param(url, self.page_query_param)
+        return replace_query_param(url, self.page_query_param, self.page_number - 1)
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination over ``(-recorded_at, -id)``. The cursor holds the
+    boundary row's key and the direction, so every page is an index seek.
+    """
+    cursor_query_param = 'cursor'
+    display_page_controls = False
+
+    def __init__(self, page_size):
+        self.page_size = page_size
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        cursor = self.decode_cursor(request)
+        self.reverse = bool(cursor and cursor[0])
+
+        if cursor is None:
+            queryset = queryset.order_by('-recorded_at', '-id')
+        elif self.reverse:
+            _, recorded_at, pk = cursor
+            queryset = queryset.filter(
+                Q(recorded_at__gt=recorded_at) | Q(recorded_at=recorded_at, id__gt=pk)
+            ).order_by('recorded_at', 'id')
+        else:
+            _, recorded_at, pk = cursor
+            queryset = queryset.filter(
+                Q(recorded_at__lt=recorded_at) | Q(recorded_at=recorded_at, id__lt=pk)
+            ).order_by('-recorded_at', '-id')
+
+        rows = list(queryset[:self.page_size + 1])
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if self.reverse:
+            rows.reverse()
+            self.has_next, self.has_previous = True, has_more
+        else:
+            self.has_next, self.has_previous = has_more, cursor is not None
+        self.rows = rows
+        return rows
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_next_link(self):
+        if not self.has_next or not self.rows:
+            return None
+        return self.encode_cursor(False, self.rows[-1])
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.rows:
+            return None
+        return self.encode_cursor(True, self.rows[0])
+
+    def encode_cursor(self, reverse, record):
+        token = f'{int(reverse)}|{record.recorded_at.isoformat()}|{record.id}'
+        encoded = base64.urlsafe_b64encode(token.encode()).decode()
+        url = self.request.build_absolute_uri()
+        return replace_query_param(url, self.cursor_query_param, encoded)
+
+    def decode_cursor(self, request):
+        encoded = request.query_params.get(self.cursor_query_param)
+        if not encoded:
+            return None
+        try:
+            reverse, recorded_at, pk = base64.urlsafe_b64decode(encoded.encode()).decode().split('|')
+            recorded_at = parse_datetime(recorded_at)
+            if recorded_at is None or reverse not in ('0', '1'):
+                raise ValueError
+            return reverse == '1', recorded_at, int(pk)
+        except (TypeError, ValueError, UnicodeDecodeError):
+            raise NotFound('Invalid cursor')
+
+
+class WeatherRecordPagination(BasePagination):
+    """
+    Chooses the pagination style per request: ``?pagination=cursor`` (or a
+    ``cursor`` parameter) for keyset pages, ``?count=false`` for page numbers
+    without a total count, and counted page numbers otherwise (with the
+    total from weather_app.counts where the filters allow).
+    """
+
+    def __init__(self):
+        self.delegate = HintedPageNumberPagination()
+
+    def paginate_queryset(self, queryset, request, view=None):
+        params = request.query_params
+        if params.get('pagination') == 'cursor' or KeysetPagination.cursor_query_param in params:
+            self.delegate = KeysetPagination(self.delegate.page_size)
+        elif params.get('count', '').lower() in ('false', '0', 'no'):
+            self.delegate = UncountedPageNumberPagination()
+        return self.delegate.paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        return self.delegate.get_paginated_response(data)
+
+    @property
+    def display_page_controls(self):
+        return self.delegate.display_page_controls
+
+    def get_results(self, data):
+        return self.delegate.get_results(data)
+
+    def to_html(self):
+        return self.delegate.to_html()
@@ -0,0 +1,191 @@
+"""
+Optional PostgreSQL declarative partitioning of ``weather_records``.
+
+With WEATHER_PARTITIONING enabled, migration 0006 turns the table into one
+partitioned by range on ``recorded_at``, one partition per UTC month
+(``weather_records_y2026m10``) plus a default partition for readings
+outside every month created so far. The ORM keeps querying
+``weather_records``; filters on ``recorded_at`` let PostgreSQL prune the
+scan to the matching months. ``manage.py partition_weather`` pre-creates
+future months and drops expired ones.
+
+A partitioned table's primary key must include the partition key, so the
+database key becomes ``(id, recorded_at)``; ``id`` still comes from one
+sequence and stays unique.
+
+Everything here is raw SQL against ``weather_records`` so migrations can
+use it.
+"""
+import re
+from datetime import datetime, timezone as dt_timezone
+
+TABLE = 'weather_records'
+DEFAULT_PARTITION = f'{TABLE}_default'
+PARTITION_NAME = re.compile(rf'^{TABLE}_y(\d{{4}})m(\d{{2}})$')
+
+
+def month_start(value):
+    value = value.astimezone(dt_timezone.utc)
+    return datetime(value.year, value.month, 1, tzinfo=dt_timezone.utc)
+
+
+def add_months(month, count):
+    index = month.year * 12 + month.month - 1 + count
+    return datetime(index // 12, index % 12 + 1, 1, tzinfo=dt_timezone.utc)
+
+
+def partition_name(month):
+    return f'{TABLE}_y{month.year}m{month.month:02d}'
+
+
+def is_partitioned(connection):
+    if connection.vendor != 'postgresql':
+        return False
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)',
+                       [TABLE])
+        return cursor.fetchone() is not None
+
+
+def monthly_partitions(connection):
+    """``[(month, name)]`` of the existing monthly partitions, oldest first."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            'SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid '
+            'WHERE i.inhparent = to_regclass(%s)', [TABLE]
+        )
+        names = [row[0] for row in cursor.fetchall()]
+    partitions = []
+    for name in names:
+        match = PARTITION_NAME.match(name)
+        if match:
+            month = datetime(int(match[1]), int(match[2]), 1, tzinfo=dt_timezone.utc)
+            partitions.append((month, name))
+    return sorted(partitions)
+
+
+def create_partition(cursor, month):
+    """
+    Create the partition for ``month``. Rows already sitting in the default
+    partition for that month are moved into it.
+    """
+    name, lower, upper = partition_name(month), month, add_months(month, 1)
+    cursor.execute(
+        f'SELECT EXISTS (SELECT 1 FROM {DEFAULT_PARTITION} '
+        f'WHERE recorded_at >= %s AND recorded_at < %s)', [lower, upper]
+    )
+    if not cursor.fetchone()[0]:
+        cursor.execute(
+            f'CREATE TABLE IF NOT EXISTS {name} PARTITION OF {TABLE} '
+            f'FOR VALUES FROM (%s) TO (%s)', [lower, upper]
+        )
+        return
+    cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {DEFAULT_PARTITION}')
+    cursor.execute(f'CREATE TABLE {name} PARTITION OF {TABLE} FOR VALUES FROM (%s) TO (%s)',
+                   [lower, upper])
+    cursor.execute(
+        f'WITH moved AS (DELETE FROM {DEFAULT_PARTITION} '
+        f'WHERE recorded_at >= %s AND recorded_at < %s RETURNING *) '
+        f'INSERT INTO {TABLE} SELECT * FROM moved', [lower, upper]
+    )
+    cursor.execute(f'ALTER TABLE {TABLE} ATTACH PARTITION {DEFAULT_PARTITION} DEFAULT')
+
+
+def ensure_partitions(connection, first_month, last_month):
+    """Create any missing monthly partitions in ``[first_month, last_month]``."""
+    existing = {name for _, name in monthly_partitions(connection)}
+    created = []
+    month = month_start(first_month)
+    with connection.cursor() as cursor:
+        while month <= last_month:
+            if partition_name(month) not in existing:
+                create_partition(cursor, month)
+                created.append(partition_name(month))
+            month = add_months(month, 1)
+    return created
+
+
+def expired_partitions(connection, cutoff):
+    """Monthly partitions whose whole month lies before ``cutoff``."""
+    return [(month, name) for month, name in monthly_partitions(connection)
+            if add_months(month, 1) <= cutoff]
+
+
+def partition_city_counts(connection, name):
+    with connection.cursor() as cursor:
+        cursor.execute(f'SELECT city_id, COUNT(*) FROM {name} GROUP BY city_id')
+        return dict(cursor.fetchall())
+
+
+def expire_default_partition(connection, cutoff):
+    """Delete default-partition rows recorded before ``cutoff``; returns ``{city_id: n}``."""
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'WITH expired AS (DELETE FROM {DEFAULT_PARTITION} WHERE recorded_at < %s '
+            f'RETURNING city_id) SELECT city_id, COUNT(*) FROM expired GROUP BY city_id',
+            [cutoff]
+        )
+        return dict(cursor.fetchall())
+
+
+def drop_partition(connection, name):
+    with connection.cursor() as cursor:
+        cursor.execute(f'ALTER TABLE {TABLE} DETACH PARTITION {name}')
+        cursor.execute(f'DROP TABLE {name}')
+
+
+def convert(connection, months_ahead=3):
+    """
+    Rebuild ``weather_records`` as a partitioned table with the same
+    columns, defaults, indexes and constraints, copying every row.
+    """
+    legacy = f'{TABLE}_unpartitioned'
+    with connection.cursor() as cursor:
+        # Deferred foreign key checks from earlier writes in this
+        # transaction would otherwise block dropping the old table.
+        cursor.execute('SET CONSTRAINTS ALL IMMEDIATE')
+        cursor.execute(
+            "SELECT indexname, indexdef FROM pg_indexes WHERE tablename = %s "
+            "AND indexname <> %s", [TABLE, f'{TABLE}_pkey']
+        )
+        indexes = cursor.fetchall()
+        cursor.execute(
+            "SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint "
+            "WHERE conrelid = to_regclass(%s) AND contype IN ('f', 'c')", [TABLE]
+        )
+        constraints = cursor.fetchall()
+        cursor.execute(f'SELECT MIN(recorded_at), MAX(recorded_at), MAX(id) FROM {TABLE}')
+        first, last, max_id = cursor.fetchone()
+
+        cursor.execute(f'ALTER TABLE {TABLE} RENAME TO {legacy}')
+        cursor.execute(
+            f'CREATE TABLE {TABLE} (LIKE {legacy} INCLUDING DEFAULTS) '
+            f'PARTITION BY RANGE (recorded_at)'
+        )
+        cursor.execute(f'CREATE TABLE {DEFAULT_PARTITION} PARTITION OF {TABLE} DEFAULT')
+
+        now = datetime.now(dt_timezone.utc)
+        month = month_start(first or now)
+        last_month = add_months(month_start(max(last or now, now)), months_ahead)
+        while month <= last_month:
+            cursor.execute(
+                f'CREATE TABLE {partition_name(month)} PARTITION OF {TABLE} '
+                f'FOR VALUES FROM (%s) TO (%s)', [month, add_months(month, 1)]
+            )
+            month = add_months(month, 1)
+
+        cursor.execute(f'INSERT INTO {TABLE} SELECT * FROM {legacy}')
+        # Dropping the old table frees its key, index, constraint and
+        # identity sequence names for the new table.
+        cursor.execute(f'DROP TABLE {legacy}')
+        cursor.execute(f'ALTER TABLE {TABLE} ADD PRIMARY KEY (id, recorded_at)')
+
+        sequence = f'{TABLE}_id_seq'
+        cursor.execute(f'CREATE SEQUENCE {sequence} OWNED BY {TABLE}.id')
+        cursor.execute('SELECT setval(%s, %s, false)', [sequence, (max_id or 0) + 1])
+        cursor.execute(f"ALTER TABLE {TABLE} ALTER COLUMN id SET DEFAULT nextval('{sequence}')")
+
+        for name, definition in constraints:
+            cursor.execute(f'ALTER TABLE {TABLE} ADD CONSTRAINT {name} {definition}')
+        for name, definition in indexes:
+            cursor.execute(definition)  # captured before the rename, so ON weather_records
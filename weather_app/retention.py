@@ -0,0 +1,84 @@
+"""
+Retention of raw weather readings.
+
+Readings older than WEATHER_RAW_RETENTION_DAYS are first folded into the
+hourly and daily rollups, which keep them queryable through
+``analytics?align=hour|day``, and then deleted in short batches. Each batch
+is its own transaction and only locks the rows it deletes, so writers
+and readers carry on while a purge runs.
+"""
+import time
+from collections import Counter
+from datetime import timedelta
+
+from django.db import connection, transaction
+from django.utils import timezone
+
+from . import analytics_cache, counts, dashboard
+from .models import WeatherRecord
+from .rollups import day_bucket, reconcile_rollups
+
+
+def retention_cutoff(days, now=None):
+    """Start of the UTC day ``days`` ago; purges never split a rollup bucket."""
+    return day_bucket((now or timezone.now()) - timedelta(days=days))
+
+
+def table_bytes():
+    """On-disk size of weather_records (and its partitions), or None if unknown."""
+    if connection.vendor != 'postgresql':
+        return None
+    table = WeatherRecord._meta.db_table
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT COALESCE(SUM(pg_total_relation_size(oid)), 0) FROM pg_class "
+            "WHERE oid = to_regclass(%s) OR oid IN "
+            "(SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(%s))",
+            [table, table]
+        )
+        return int(cursor.fetchone()[0])
+
+
+def downsample(cutoff):
+    """
+    Fold the raw readings still held before ``cutoff`` into the rollups,
+    leaving the buckets of readings purged earlier as they are.
+    Returns rollup rows written per resolution.
+    """
+    return reconcile_rollups(cutoff)
+
+
+def purge(cutoff, batch_size=5000, pause=0.0):
+    """
+    Delete raw readings recorded before ``cutoff``, ``batch_size`` rows per
+    transaction, sleeping ``pause`` seconds between batches. Each batch
+    adjusts the record counters in its transaction and invalidates the
+    cached analytics and dashboard once it commits.
+    Returns ``(deleted per city, batches)``.
+    """
+    expired = WeatherRecord.objects.filter(recorded_at__lt=cutoff).order_by()
+    deleted = Counter()
+    batches = 0
+    while True:
+        with transaction.atomic():
+            rows = list(expired.values_list('id', 'city_id')[:batch_size])
+            if not rows:
+                break
+            # Raw DELETE: the readings live on in the rollups, which the
+            # post_delete receivers would recompute without them
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    f"DELETE FROM {WeatherRecord._meta.db_table} WHERE id IN "
+                    f"({', '.join(['%s'] * len(rows))})",
+                    [pk for pk, _ in rows]
+                )
+            batch = Counter(city_id for _, city_id in rows)
+            counts.adjust({city_id: -n for city_id, n in batch.items()})
+            for city_id in batch:
+                analytics_cache.invalidate_on_commit(city_id, cutoff)
+            transaction.on_commit(dashboard.invalidate)
+        deleted.update(batch)
+        batches += 1
+        if pause and len(rows) == batch_size:
+            time.sleep(pause)
+    return deleted, batches
@@ -0,0 +1,255 @@
+"""
+Hourly and daily rollups of weather readings.
+
+Rollup rows hold count/sum/min/max per city and bucket so analytics over
+aligned windows can read a few pre-aggregated rows instead of rescanning
+``weather_records``. Buckets are UTC hours and UTC days.
+"""
+from collections import defaultdict, namedtuple
+from datetime import timedelta, timezone as dt_timezone
+
+from django.db import connection, transaction
+from django.db.models import Count, F, FloatField, Max, Min, Sum
+from django.db.models.functions import Cast, Greatest, Least, TruncDay, TruncHour
+
+from .models import WeatherRecord, HourlyWeatherRollup, DailyWeatherRollup
+
+ROLLUP_FIELDS = ('temperature', 'humidity', 'pressure', 'wind_speed')
+
+
+def hour_bucket(value):
+    return value.astimezone(dt_timezone.utc).replace(minute=0, second=0, microsecond=0)
+
+
+def day_bucket(value):
+    return hour_bucket(value).replace(hour=0)
+
+
+Resolution = namedtuple('Resolution', 'name model floor span trunc')
+
+HOURLY = Resolution('hour', HourlyWeatherRollup, hour_bucket, timedelta(hours=1), TruncHour)
+DAILY = Resolution('day', DailyWeatherRollup, day_bucket, timedelta(days=1), TruncDay)
+RESOLUTIONS = {resolution.name: resolution for resolution in (HOURLY, DAILY)}
+
+
+def _summarise(records):
+    totals = {'record_count': len(records)}
+    for field in ROLLUP_FIELDS:
+        values = [getattr(record, field) for record in records]
+        totals[f'{field}_sum'] = float(sum(values))
+        totals[f'{field}_min'] = min(values)
+        totals[f'{field}_max'] = max(values)
+    return totals
+
+
+def _merge(model, city_id, bucket_start, totals):
+    with transaction.atomic():
+        rollup, created = model.objects.get_or_create(
+            city_id=city_id, bucket_start=bucket_start, defaults=totals
+        )
+        if created:
+            return
+        updates = {'record_count': F('record_count') + totals['record_count']}
+        for field in ROLLUP_FIELDS:
+            updates[f'{field}_sum'] = F(f'{field}_sum') + totals[f'{field}_sum']
+            updates[f'{field}_min'] = Least(f'{field}_min', totals[f'{field}_min'])
+            updates[f'{field}_max'] = Greatest(f'{field}_max', totals[f'{field}_max'])
+        model.objects.filter(pk=rollup.pk).update(**updates)
+
+
+# Scalar two-argument min/max per backend, for the upsert
+_LEAST_GREATEST = {'postgresql': ('LEAST', 'GREATEST'), 'sqlite': ('MIN', 'MAX')}
+
+
+def _upsert(model, buckets):
+    """
+    Add ``{(city_id, bucket_start): totals}`` to ``model``'s rollups with
+    INSERT ... ON CONFLICT DO UPDATE, one statement per chunk.
+    """
+    least, greatest = _LEAST_GREATEST[connection.vendor]
+    qn = connection.ops.quote_name
+    table = qn(model._meta.db_table)
+    fields = ['record_count'] + [f'{field}_{part}' for field in ROLLUP_FIELDS
+                                 for part in ('sum', 'min', 'max')]
+    columns = ['city_id', 'bucket_start'] + fields
+    updates = []
+    for name in fields:
+        if name.endswith('_min') or name.endswith('_max'):
+            function = least if name.endswith('_min') else greatest
+            value = f'{function}({table}.{qn(name)}, EXCLUDED.{qn(name)})'
+        else:
+            value = f'{table}.{qn(name)} + EXCLUDED.{qn(name)}'
+        updates.append(f'{qn(name)} = {value}')
+    row_sql = f"({', '.join(['%s'] * len(columns))})"
+    chunk_size = (connection.features.max_query_params or 10000) // len(columns)
+
+    keys = sorted(buckets)
+    with connection.cursor() as cursor:
+        for i in range(0, len(keys), chunk_size):
+            chunk = keys[i:i + chunk_size]
+            params = []
+            for city_id, bucket_start in chunk:
+                totals = buckets[(city_id, bucket_start)]
+                params += [city_id, connection.ops.adapt_datetimefield_value(bucket_start)]
+                params += [totals[name] for name in fields]
+            cursor.execute(
+                f"INSERT INTO {table} ({', '.join(qn(c) for c in columns)}) "
+                f"VALUES {', '.join([row_sql] * len(chunk))} "
+                f"ON CONFLICT (city_id, bucket_start) DO UPDATE SET {', '.join(updates)}",
+                params,
+            )
+
+
+def apply_records(records):
+    """
+    Fold newly created weather records into the hourly and daily rollups:
+    one upsert per resolution on PostgreSQL and SQLite, buckets in key
+    order so concurrent ingests lock rows in the same order.
+    """
+    with transaction.atomic():
+        for resolution in RESOLUTIONS.values():
+            groups = defaultdict(list)
+            for record in records:
+                groups[(record.city_id, resolution.floor(record.recorded_at))].append(record)
+            buckets = {key: _summarise(rows) for key, rows in groups.items()}
+            if connection.vendor in _LEAST_GREATEST:
+                _upsert(resolution.model, buckets)
+                continue
+            for (city_id, bucket_start) in sorted(buckets):
+                _merge(resolution.model, city_id, bucket_start, buckets[(city_id, bucket_start)])
+
+
+def raw_aggregates():
+    """Rollup columns (count and per-field sum/min/max) as aggregates over raw rows."""
+    aggregates = {'record_count': Count('id')}
+    for field in ROLLUP_FIELDS:
+        aggregates[f'{field}_sum'] = Sum(Cast(field, FloatField()))
+        aggregates[f'{field}_min'] = Min(field)
+        aggregates[f'{field}_max'] = Max(field)
+    return aggregates
+
+
+def refresh_buckets(city_id, timestamps):
+    """Recompute the buckets containing ``timestamps`` for one city from raw rows."""
+    for resolution in RESOLUTIONS.values():
+        for bucket_start in {resolution.floor(ts) for ts in timestamps}:
+            totals = WeatherRecord.objects.filter(
+                city_id=city_id,
+                recorded_at__gte=bucket_start,
+                recorded_at__lt=bucket_start + resolution.span,
+            ).aggregate(**raw_aggregates())
+            if totals['record_count']:
+                resolution.model.objects.update_or_create(
+                    city_id=city_id, bucket_start=bucket_start, defaults=totals
+                )
+            else:
+                resolution.model.objects.filter(
+                    city_id=city_id, bucket_start=bucket_start
+                ).delete()
+
+
+def rebuild_rollups(start=None, end=None, city_ids=None, batch_size=1000):
+    """
+    Recompute rollups from raw readings, optionally limited to a time range
+    and a set of cities. The range is widened to whole buckets.
+    Returns the number of rollup rows written per resolution.
+
+    Buckets before the earliest raw reading are left alone: they are all
+    that remains of readings removed by ``manage.py purge_weather``.
+    """
+    earliest = WeatherRecord.objects.aggregate(earliest=Min('recorded_at'))['earliest']
+    if earliest is None:
+        return {name: 0 for name in RESOLUTIONS}
+    if start is None or start < earliest:
+        start = earliest
+    written = {}
+    for resolution in RESOLUTIONS.values():
+        bucket_start = resolution.floor(start)
+        records = WeatherRecord.objects.filter(recorded_at__gte=bucket_start)
+        rollups = resolution.model.objects.filter(bucket_start__gte=bucket_start)
+        if end is not None:
+            bucket_end = resolution.floor(end) + resolution.span
+            records = records.filter(recorded_at__lt=bucket_end)
+            rollups = rollups.filter(bucket_start__lt=bucket_end)
+        if city_ids is not None:
+            records = records.filter(city_id__in=city_ids)
+            rollups = rollups.filter(city_id__in=city_ids)
+
+        rows = (
+            records.annotate(bucket=resolution.trunc('recorded_at', tzinfo=dt_timezone.utc))
+            .values('city_id', 'bucket')
+            .annotate(**raw_aggregates())
+            .order_by()
+        )
+        count = 0
+        with transaction.atomic():
+            rollups.delete()
+            batch = []
+            for row in rows.iterator(chunk_size=batch_size):
+                row['bucket_start'] = row.pop('bucket')
+                batch.append(resolution.model(**row))
+                if len(batch) >= batch_size:
+                    resolution.model.objects.bulk_create(batch)
+                    count += len(batch)
+                    batch = []
+            resolution.model.objects.bulk_create(batch)
+            count += len(batch)
+        written[resolution.name] = count
+    return written
+
+
+
+def reconcile_rollups(end, batch_size=1000):
+    """
+    Bring the buckets before ``end`` in line with the raw readings still
+    held there, without losing history. A bucket is (re)written from raw
+    rows only when they are at least as many as it counts; a bucket
+    counting more is all that remains of purged readings and is left as
+    it is, and buckets with no raw rows left are never deleted.
+    Returns the number of rollup rows written per resolution.
+    """
+    earliest = (WeatherRecord.objects.filter(recorded_at__lt=end)
+                .aggregate(earliest=Min('recorded_at'))['earliest'])
+    written = {name: 0 for name in RESOLUTIONS}
+    if earliest is None:
+        return written
+    fields = list(raw_aggregates())
+    for resolution in RESOLUTIONS.values():
+        rows = (
+            WeatherRecord.objects
+            .filter(recorded_at__gte=resolution.floor(earliest), recorded_at__lt=end)
+            .annotate(bucket=resolution.trunc('recorded_at', tzinfo=dt_timezone.utc))
+            .values('city_id', 'bucket')
+            .annotate(**raw_aggregates())
+            .order_by('city_id', 'bucket')
+        )
+        batch = []
+        for row in rows.iterator(chunk_size=batch_size):
+            batch.append(row)
+            if len(batch) >= batch_size:
+                written[resolution.name] += _reconcile_batch(resolution.model, batch, fields)
+                batch = []
+        if batch:
+            written[resolution.name] += _reconcile_batch(resolution.model, batch, fields)
+    return written
+
+
+def _reconcile_batch(model, rows, fields):
+    with transaction.atomic():
+        counted = {
+            (city_id, bucket_start): count
+            for city_id, bucket_start, count in model.objects.select_for_update().filter(
+                city_id__in={row['city_id'] for row in rows},
+                bucket_start__in={row['bucket'] for row in rows},
+            ).values_list('city_id', 'bucket_start', 'record_count')
+        }
+        stale = [
+            model(city_id=row['city_id'], bucket_start=row['bucket'],
+                  **{field: row[field] for field in fields})
+            for row in rows
+            if counted.get((row['city_id'], row['bucket']), 0) <= row['record_count']
+        ]
+        model.objects.bulk_create(stale, update_conflicts=True,
+                                  unique_fields=['city', 'bucket_start'],
+                                  update_fields=fields)
+    return len(stale)
@@ -0,0 +1,125 @@
+"""
+Background fetches on a per-city schedule, without a task queue.
+
+FetchScheduler keeps every city in a min-heap keyed on its next due time
+(``City.next_fetch_at``). Each tick pops the cities that are due, up to
+``batch_size``, fetches them together through ``fetch_cities`` (grouped
+provider requests on a bounded, rate-limited thread pool) and pushes them
+back:
+
+* after a success, ``refresh_interval`` (default WEATHER_REFRESH_INTERVAL)
+  from now, give or take ``jitter`` of it, so cities added together drift
+  apart instead of coming due in lockstep;
+* after ``n`` failures in a row, the interval times ``2 ** n``, at most
+  ``max_backoff`` seconds.
+
+Cities never scheduled, and on start-up cities that fell due while the
+scheduler was down, are spread over the next ``spread`` seconds (or their
+interval, if shorter) rather than fetched all at once. Due times and
+failure counts live on City, so a restart resumes the schedule; ``load``
+rebuilds the heap from the table to pick up added, removed and
+re-configured cities.
+"""
+import heapq
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import City
+from .openweather import fetch_cities
+
+logger = logging.getLogger(__name__)
+
+
+class FetchScheduler:
+    def __init__(self, batch_size=None, workers=None, rate=None, jitter=None,
+                 spread=None, max_backoff=None, clock=timezone.now, rng=None):
+        self.batch_size = batch_size or settings.WEATHER_SCHEDULER_BATCH_SIZE
+        self.workers = workers
+        self.rate = rate
+        self.jitter = settings.WEATHER_SCHEDULER_JITTER if jitter is None else jitter
+        self.spread = settings.WEATHER_SCHEDULER_SPREAD if spread is None else spread
+        self.max_backoff = max_backoff or settings.WEATHER_SCHEDULER_MAX_BACKOFF
+        self.clock = clock
+        self.rng = rng or random.Random()
+        self.heap = []
+
+    @staticmethod
+    def interval(city):
+        return city.refresh_interval or settings.WEATHER_REFRESH_INTERVAL
+
+    def load(self, initial=False):
+        """
+        Rebuild the heap from the cities table. Unscheduled cities, and with
+        ``initial`` overdue ones, get a due time spread over the next
+        ``spread`` seconds, saved back to the table.
+        """
+        now = self.clock()
+        heap, spread_out = [], []
+        for city in City.objects.only('id', 'refresh_interval', 'next_fetch_at'):
+            if city.next_fetch_at is None or (initial and city.next_fetch_at < now):
+                window = min(self.spread, self.interval(city))
+                city.next_fetch_at = now + timedelta(seconds=self.rng.uniform(0, window))
+                spread_out.append(city)
+            heap.append((city.next_fetch_at, city.id))
+        heapq.heapify(heap)
+        self.heap = heap
+        City.objects.bulk_update(spread_out, ['next_fetch_at'], batch_size=1000)
+
+    def pop_due(self, now):
+        """Remove and return the IDs of up to ``batch_size`` cities due at ``now``."""
+        city_ids = []
+        while self.heap and self.heap[0][0] <= now and len(city_ids) < self.batch_size:
+            city_ids.append(heapq.heappop(self.heap)[1])
+        return city_ids
+
+    def seconds_until_due(self):
+        """Seconds until the next city is due, or None when there are none."""
+        if not self.heap:
+            return None
+        return max(0.0, (self.heap[0][0] - self.clock()).total_seconds())
+
+    def next_delay(self, city):
+        """Seconds until ``city`` is due again, given its ``fetch_failures``."""
+        delay = self.interval(city)
+        if city.fetch_failures:
+            delay = min(delay * 2 ** min(city.fetch_failures, 32), max(delay, self.max_backoff))
+        return delay * self.rng.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def run_due(self):
+        """
+        Fetch one batch of due cities and reschedule them. Returns the
+        ``fetch_cities`` results (empty when nothing was due). A batch whose
+        fetch raises counts as failed for every city in it.
+        """
+        now = self.clock()
+        city_ids = self.pop_due(now)
+        if not city_ids:
+            return []
+        try:
+            # Cities deleted since they were queued drop out here
+            cities = list(City.objects.filter(id__in=city_ids))
+        except Exception:
+            for city_id in city_ids:
+                heapq.heappush(self.heap, (now, city_id))
+            raise
+        try:
+            results = fetch_cities(cities, workers=self.workers, rate=self.rate)
+        except Exception as e:
+            logger.exception('Fetching a batch of %d cities failed', len(cities))
+            results = [
+                {'city_id': city.id, 'city_name': city.name, 'success': False,
+                 'error': f'Failed to fetch weather data: {e!r}'}
+                for city in cities
+            ]
+
+        now = self.clock()
+        for city, result in zip(cities, results):
+            city.fetch_failures = 0 if result['success'] else city.fetch_failures + 1
+            city.next_fetch_at = now + timedelta(seconds=self.next_delay(city))
+            heapq.heappush(self.heap, (city.next_fetch_at, city.id))
+        City.objects.bulk_update(cities, ['next_fetch_at', 'fetch_failures'])
+        return results
@@ -8,11 +8,18 @@ class CitySerializer(serializers.ModelSerializer):
     class Meta:
         model = City
         fields = ['id', 'name', 'country', 'latitude', 'longitude', 
-                  'created_at', 'updated_at', 'weather_records_count']
+                  'openweather_id', 'refresh_interval', 'next_fetch_at',
+                  'fetch_failures', 'created_at', 'updated_at',
+                  'weather_records_count']
         read_only_fields = ['created_at', 'updated_at']
 
     def get_weather_records_count(self, obj):
-        return obj.weather_records.count()
+        # Annotated by CityViewSet.get_queryset when WEATHER_COUNT_MODE is
+        # 'exact'; otherwise the counter maintained by weather_app.counts.
+        count = getattr(obj, 'num_weather_records', None)
+        if count is None:
+            count = obj.weather_record_count
+        return count
 
 
 class WeatherRecordSerializer(serializers.ModelSerializer):
@@ -33,14 +40,32 @@ class WeatherRecordCreateSerializer(serializers.ModelSerializer):
                   'pressure', 'wind_speed', 'description', 'recorded_at']
 
 
+class WeatherRecordBulkSerializer(serializers.ModelSerializer):
+    """
+    Validates one row of a bulk upload. ``city`` is a plain ID here; the
+    view checks all IDs with a single query instead of one per row.
+    """
+    city = serializers.IntegerField(min_value=1)
+
+    class Meta:
+        model = WeatherRecord
+        fields = ['city', 'temperature', 'feels_like', 'humidity', 
+                  'pressure', 'wind_speed', 'description', 'recorded_at']
+
+
 class CityDetailSerializer(serializers.ModelSerializer):
     recent_weather = serializers.SerializerMethodField()
 
     class Meta:
         model = City
         fields = ['id', 'name', 'country', 'latitude', 'longitude', 
-                  'created_at', 'updated_at', 'recent_weather']
+                  'openweather_id', 'refresh_interval', 'next_fetch_at',
+                  'fetch_failures', 'created_at', 'updated_at',
+                  'recent_weather']
 
     def get_recent_weather(self, obj):
-        recent_records = obj.weather_records.all()[:5]
+        # Attached in bulk by CityViewSet.attach_recent_weather
+        recent_records = getattr(obj, 'recent_weather_records', None)
+        if recent_records is None:
+            recent_records = obj.weather_records.select_related('city')[:5]
         return WeatherRecordSerializer(recent_records, many=True).data
\ No newline at end of file
@@ -0,0 +1,113 @@
+from django.db.models.signals import post_delete, post_save, pre_save
+from django.dispatch import Signal, receiver
+
+from . import analytics_cache, counts, dashboard, rollups
+from .models import City, WeatherRecord
+
+# Sent with ``records=[...]`` after WeatherRecord rows are written with
+# bulk_create, which does not send post_save.
+records_ingested = Signal()
+
+
+@receiver(pre_save, sender=WeatherRecord)
+def remember_rollup_bucket(sender, instance, raw=False, **kwargs):
+    if raw or instance.pk is None:
+        return
+    instance._previous_bucket = (
+        WeatherRecord.objects.filter(pk=instance.pk)
+        .values_list('city_id', 'recorded_at').first()
+    )
+
+
+@receiver(post_save, sender=WeatherRecord)
+def update_rollups_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        rollups.apply_records([instance])
+        return
+    previous = getattr(instance, '_previous_bucket', None)
+    if previous and previous != (instance.city_id, instance.recorded_at):
+        city_id, recorded_at = previous
+        rollups.refresh_buckets(city_id, [recorded_at])
+    rollups.refresh_buckets(instance.city_id, [instance.recorded_at])
+
+
+@receiver(records_ingested, sender=WeatherRecord)
+def update_rollups_on_ingest(sender, records, **kwargs):
+    rollups.apply_records(records)
+
+
+@receiver(post_save, sender=WeatherRecord)
+def update_counts_on_save(sender, instance, created, raw=False, **kwargs):
+    if raw:
+        return
+    if created:
+        counts.adjust({instance.city_id: 1})
+        return
+    previous = getattr(instance, '_previous_bucket', None)
+    if previous and previous[0] != instance.city_id:
+        counts.adjust({previous[0]: -1, instance.city_id: 1})
+
+
+@receiver(records_ingested, sender=WeatherRecord)
+def update_counts_on_ingest(sender, records, **kwargs):
+    counts.adjust(counts.count_records(records))
+
+
+@receiver(post_save, sender=WeatherRecord)
+def invalidate_analytics_on_save(sender, instance, raw=False, **kwargs):
+    if raw:
+        return
+    previous = getattr(instance, '_previous_bucket', None)
+    if previous:
+        analytics_cache.invalidate_on_commit(*previous)
+    analytics_cache.invalidate_on_commit(instance.city_id, instance.recorded_at)
+
+
+@receiver(records_ingested, sender=WeatherRecord)
+def invalidate_analytics_on_ingest(sender, records, **kwargs):
+    earliest = {}
+    for record in records:
+        if record.city_id not in earliest or record.recorded_at < earliest[record.city_id]:
+            earliest[record.city_id] = record.recorded_at
+    for city_id, recorded_at in earliest.items():
+        analytics_cache.invalidate_on_commit(city_id, recorded_at)
+
+
+def _deleted_with_city(origin):
+    """True when a record delete cascades from deleting its city, whose
+    rollups and counter go with it."""
+    return isinstance(origin, City) or getattr(origin, 'model', None) is City
+
+
+@receiver(post_delete, sender=WeatherRecord)
+def update_rollups_on_delete(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_city(origin):
+        rollups.refresh_buckets(instance.city_id, [instance.recorded_at])
+
+
+@receiver(post_delete, sender=WeatherRecord)
+def update_counts_on_delete(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_city(origin):
+        counts.adjust({instance.city_id: -1})
+
+
+@receiver(post_delete, sender=WeatherRecord)
+def invalidate_analytics_on_delete(sender, instance, origin=None, **kwargs):
+    if not _deleted_with_city(origin):
+        analytics_cache.invalidate_on_commit(instance.city_id, instance.recorded_at)
+
+
+@receiver(post_delete, sender=City)
+def invalidate_analytics_on_city_delete(sender, instance, **kwargs):
+    analytics_cache.invalidate_on_commit(instance.pk)
+
+
+@receiver(post_save, sender=City)
+@receiver(post_delete, sender=City)
+@receiver(post_save, sender=WeatherRecord)
+@receiver(post_delete, sender=WeatherRecord)
+@receiver(records_ingested, sender=WeatherRecord)
+def invalidate_dashboard(sender, **kwargs):
+    dashboard.invalidate()
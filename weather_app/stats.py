@@ -0,0 +1,244 @@
+"""
+Distribution and moving-average statistics behind
+``GET /api/weather-records/statistics/``.
+
+For every city with readings in the window this reports the mean, sample
+standard deviation and the 50th/90th/99th percentiles of one field, plus
+its trailing 24 hour and 7 day moving averages taken at the last reading
+of each UTC day.
+
+On PostgreSQL both are computed in the database, with ``percentile_cont``
+and window functions over time-range frames, and only one row per city and
+per city-day comes back. Elsewhere the readings are streamed with ``values_list`` into
+NumPy arrays (the optional ``numpy`` package) and every figure is computed
+with array operations over all cities at once.
+"""
+from datetime import datetime, timedelta
+from itertools import islice
+
+from django.db import connection
+from django.utils import timezone
+
+from .models import City, WeatherRecord
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+STAT_FIELDS = ('temperature', 'feels_like', 'humidity', 'pressure', 'wind_speed')
+PERCENTILES = (0.5, 0.9, 0.99)
+MOVING_WINDOWS = (('moving_average_24h', timedelta(hours=24)),
+                  ('moving_average_7d', timedelta(days=7)))
+ENGINES = ('database', 'numpy')
+
+# Rows converted into arrays at a time by the NumPy engine.
+CHUNK_SIZE = 10000
+
+_DAY = 86400
+
+
+def _round(value, digits=2):
+    return round(float(value), digits) if value is not None else None
+
+
+def default_engine():
+    return 'database' if connection.vendor == 'postgresql' else 'numpy'
+
+
+def unavailable_reason(engine):
+    """Why ``engine`` cannot run here, or None if it can."""
+    if engine == 'database' and connection.vendor != 'postgresql':
+        return 'the database engine requires PostgreSQL'
+    if engine == 'numpy' and numpy is None:
+        return 'statistics on this database require the numpy package'
+    return None
+
+
+def _database_statistics(field, start, city_id):
+    """``({city_id: distribution}, {city_id: [daily moving averages]})`` in two queries."""
+    table = WeatherRecord._meta.db_table
+    value = f'{field}::double precision'
+    city_filter = 'AND city_id = %(city_id)s' if city_id else ''
+    frames = ', '.join(
+        f"{name} AS (PARTITION BY city_id ORDER BY recorded_at "
+        f"RANGE BETWEEN INTERVAL '{int(span.total_seconds())} seconds' PRECEDING AND CURRENT ROW)"
+        for name, span in MOVING_WINDOWS
+    )
+    params = {
+        'start': start,
+        'scan_start': start - max(span for _, span in MOVING_WINDOWS),
+        'city_id': city_id,
+        'percentiles': list(PERCENTILES),
+    }
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'SELECT city_id, COUNT(*), AVG({value}), STDDEV_SAMP({value}), '
+            f'percentile_cont(%(percentiles)s::double precision[]) WITHIN GROUP (ORDER BY {value}) '
+            f'FROM {table} WHERE recorded_at >= %(start)s {city_filter} GROUP BY city_id',
+            params
+        )
+        distributions = {
+            row[0]: {'count': row[1], 'mean': row[2], 'stddev': row[3],
+                     'percentiles': row[4]}
+            for row in cursor.fetchall()
+        }
+        # Readings from up to 7 days before the window feed the moving
+        # averages of its first days. Readings sharing a timestamp are
+        # folded together first; each moving average is then the running
+        # total at the reading minus the running total just before its
+        # frame, as first_value() over a range frame costs O(1) per row
+        # where AVG(double precision) would re-add the whole frame.
+        averages = ', '.join(
+            f'(total - first_value(total - reading_sum) OVER {name}) / '
+            f'(readings - first_value(readings - reading_count) OVER {name}) AS {name}'
+            for name, _ in MOVING_WINDOWS
+        )
+        cursor.execute(
+            f'SELECT DISTINCT ON (city_id, day) city_id, day, '
+            f'{", ".join(name for name, _ in MOVING_WINDOWS)} FROM ('
+            f'SELECT city_id, recorded_at, day, {averages} FROM ('
+            f'SELECT city_id, recorded_at, reading_sum, reading_count, '
+            f'(recorded_at AT TIME ZONE \'UTC\')::date AS day, '
+            f'SUM(reading_sum) OVER running AS total, SUM(reading_count) OVER running AS readings '
+            f'FROM (SELECT city_id, recorded_at, SUM({value}) AS reading_sum, '
+            f'COUNT(*) AS reading_count FROM {table} '
+            f'WHERE recorded_at >= %(scan_start)s {city_filter} GROUP BY city_id, recorded_at) grouped '
+            f'WINDOW running AS (PARTITION BY city_id ORDER BY recorded_at ROWS UNBOUNDED PRECEDING)'
+            f') totals WINDOW {frames}) averaged '
+            f'WHERE recorded_at >= %(start)s ORDER BY city_id, day, recorded_at DESC',
+            params
+        )
+        daily = {}
+        for city, day, *averages in cursor.fetchall():
+            daily.setdefault(city, []).append((day, *averages))
+    return distributions, daily
+
+
+def _load_arrays(field, scan_start, city_id):
+    """``(city_ids, epoch seconds, values)`` arrays of every reading since ``scan_start``."""
+    queryset = WeatherRecord.objects.filter(recorded_at__gte=scan_start).order_by()
+    if city_id:
+        queryset = queryset.filter(city_id=city_id)
+    rows = queryset.values_list('city_id', 'recorded_at', field).iterator(chunk_size=CHUNK_SIZE)
+    cities, times, values = [], [], []
+    while chunk := list(islice(rows, CHUNK_SIZE)):
+        chunk_cities, chunk_times, chunk_values = zip(*chunk)
+        cities.append(numpy.array(chunk_cities, dtype=numpy.int64))
+        times.append(numpy.fromiter(map(datetime.timestamp, chunk_times),
+                                    dtype=numpy.float64, count=len(chunk_times)))
+        values.append(numpy.array(chunk_values, dtype=numpy.float64))
+    if not cities:
+        empty = numpy.empty(0)
+        return empty.astype(numpy.int64), empty, empty
+    return numpy.concatenate(cities), numpy.concatenate(times), numpy.concatenate(values)
+
+
+def _numpy_distributions(cities, values):
+    if not len(values):
+        return {}
+    order = numpy.lexsort((values, cities))
+    cities, values = cities[order], values[order]
+    ids, first, counts = numpy.unique(cities, return_index=True, return_counts=True)
+    means = numpy.add.reduceat(values, first) / counts
+    deviations = values - numpy.repeat(means, counts)
+    with numpy.errstate(invalid='ignore', divide='ignore'):
+        stddevs = numpy.sqrt(numpy.add.reduceat(deviations * deviations, first) / (counts - 1))
+    # Linear interpolation between closest ranks, as percentile_cont does.
+    percentiles = []
+    for fraction in PERCENTILES:
+        position = first + fraction * (counts - 1)
+        lower = numpy.floor(position).astype(numpy.int64)
+        upper = numpy.ceil(position).astype(numpy.int64)
+        percentiles.append(values[lower] + (values[upper] - values[lower]) * (position - lower))
+    return {
+        int(city): {
+            'count': int(counts[i]),
+            'mean': means[i],
+            'stddev': stddevs[i] if counts[i] > 1 else None,
+            'percentiles': [column[i] for column in percentiles],
+        }
+        for i, city in enumerate(ids)
+    }
+
+
+def _numpy_daily(cities, times, values, start_ts):
+    order = numpy.lexsort((times, cities))
+    cities, times, values = cities[order], times[order], values[order]
+    _, ranks = numpy.unique(cities, return_inverse=True)
+    # One sorted key for every city: cities are laid out further apart than
+    # the longest window, so a window never reaches into the previous city.
+    offsets = times - times.min()
+    spacing = offsets.max() + max(span for _, span in MOVING_WINDOWS).total_seconds() + 1
+    keys = ranks * spacing + offsets
+
+    days = numpy.floor_divide(times, _DAY)
+    last_of_day = numpy.ones(len(keys), dtype=bool)
+    last_of_day[:-1] = (ranks[1:] != ranks[:-1]) | (days[1:] != days[:-1])
+    samples = numpy.flatnonzero(last_of_day & (times >= start_ts))
+
+    cumulative = numpy.concatenate(([0.0], numpy.cumsum(values)))
+    upper = numpy.searchsorted(keys, keys[samples], side='right')
+    averages = []
+    for _, span in MOVING_WINDOWS:
+        lower = numpy.searchsorted(keys, keys[samples] - span.total_seconds(), side='left')
+        averages.append((cumulative[upper] - cumulative[lower]) / (upper - lower))
+
+    daily = {}
+    sample_days = (days[samples] * _DAY).astype('datetime64[s]').astype('datetime64[D]').tolist()
+    for i, index in enumerate(samples):
+        daily.setdefault(int(cities[index]), []).append(
+            (sample_days[i], *(column[i] for column in averages))
+        )
+    return daily
+
+
+def _numpy_statistics(field, start, city_id):
+    scan_start = start - max(span for _, span in MOVING_WINDOWS)
+    cities, times, values = _load_arrays(field, scan_start, city_id)
+    if not len(cities):
+        return {}, {}
+    in_window = times >= start.timestamp()
+    distributions = _numpy_distributions(cities[in_window], values[in_window])
+    return distributions, _numpy_daily(cities, times, values, start.timestamp())
+
+
+def build_statistics(days, field='temperature', city_id=None, engine=None, now=None):
+    """
+    Per-city distribution and moving averages of ``field`` over the last
+    ``days`` days, computed by ``engine`` (see ``default_engine``).
+    """
+    engine = engine or default_engine()
+    start = (now or timezone.now()) - timedelta(days=days)
+    compute = _database_statistics if engine == 'database' else _numpy_statistics
+    distributions, daily = compute(field, start, city_id)
+
+    names = dict(City.objects.filter(pk__in=distributions).values_list('id', 'name'))
+    cities = []
+    for city in sorted(distributions, key=lambda pk: names.get(pk, '')):
+        distribution = distributions[city]
+        samples = [
+            dict(date=day.strftime('%Y-%m-%d'),
+                 **{name: _round(avg) for (name, _), avg in zip(MOVING_WINDOWS, averages)})
+            for day, *averages in daily.get(city, [])
+        ]
+        entry = {
+            'city_id': city,
+            'city_name': names.get(city),
+            'count': distribution['count'],
+            'mean': _round(distribution['mean']),
+            'stddev': _round(distribution['stddev']),
+        }
+        for fraction, value in zip(PERCENTILES, distribution['percentiles']):
+            entry[f'p{round(fraction * 100)}'] = _round(value)
+        for name, _ in MOVING_WINDOWS:
+            entry[name] = samples[-1][name] if samples else None
+        entry['daily'] = samples
+        cities.append(entry)
+
+    return {
+        'period': f'Last {days} days',
+        'field': field,
+        'engine': engine,
+        'cities': cities,
+    }
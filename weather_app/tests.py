@@ -3,7 +3,39 @@ from django.test import TestCase
 from rest_framework.test import APITestCase
 from rest_framework import status
 from django.utils import timezone
-from weather_app.models import City, WeatherRecord
+from django.core.cache import cache, caches
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
+from datetime import datetime, timedelta, timezone as dt_timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock, skipUnless
+from urllib.parse import parse_qs, urlparse
+from zoneinfo import ZoneInfo
+import asyncio
+import csv
+import json
+import math
+import os
+import random
+import signal
+import tempfile
+import threading
+import time
+import httpx
+import requests
+from asgiref.sync import async_to_sync
+from weather_app import exports, openweather, partitions, retention, stats
+from weather_app.analytics import build_analytics, build_comparison
+from weather_app.concurrency import run_sync
+from weather_app.management.commands.load_weather import Command as LoadWeatherCommand
+from weather_app.rollups import day_bucket
+from weather_app.scheduler import FetchScheduler
+from weather_app.models import (
+    City, WeatherRecord, HourlyWeatherRollup, DailyWeatherRollup
+)
 
 
 
@@ -36,12 +68,57 @@ class CityAPITestCase(APITestCase):
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(len(response.data['results']), 1)
 
+    def test_list_cities_record_counts(self):
+        """Test record counts do not cost a query per city"""
+        for i in range(5):
+            city = City.objects.create(name=f'City {i}', country='India',
+                                       latitude=10.0 + i, longitude=70.0)
+            for _ in range(i):
+                WeatherRecord.objects.create(
+                    city=city, temperature=25, feels_like=26, humidity=60,
+                    pressure=1008, wind_speed=4, description='Haze'
+                )
+        with self.assertNumQueries(2):
+            response = self.client.get('/api/cities/')
+        counts = {c['name']: c['weather_records_count'] for c in response.data['results']}
+        self.assertEqual(counts, {'City 0': 0, 'City 1': 1, 'City 2': 2,
+                                  'City 3': 3, 'City 4': 4, 'Mumbai': 0})
+
     def test_get_city_detail(self):
         """Test retrieving a specific city"""
         response = self.client.get(f'/api/cities/{self.city.id}/')
         self.assertEqual(response.status_code, status.HTTP_200_OK)
         self.assertEqual(response.data['name'], 'Mumbai')
 
+    def test_latest_readings_per_city(self):
+        """Test latest readings for a page of cities come from one query"""
+        now = timezone.now()
+        for i in range(8):
+            city = City.objects.create(name=f'City {i}', country='India',
+                                       latitude=10.0 + i, longitude=70.0)
+            for minutes in range(i):
+                WeatherRecord.objects.create(
+                    city=city, temperature=minutes, feels_like=26, humidity=60,
+                    pressure=1008, wind_speed=4, description='Haze',
+                    recorded_at=now - timedelta(minutes=minutes)
+                )
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/cities/latest/?readings=3')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        cities = {c['name']: c for c in response.data['results']}
+        self.assertEqual(len(cities), 9)
+        self.assertEqual(
+            [r['temperature'] for r in cities['City 7']['recent_weather']], [0, 1, 2]
+        )
+        self.assertEqual(cities['City 7']['recent_weather'][0]['city_name'], 'City 7')
+        self.assertEqual(len(cities['City 1']['recent_weather']), 1)
+        self.assertEqual(cities['Mumbai']['recent_weather'], [])
+
+        city = City.objects.get(name='City 7')
+        with self.assertNumQueries(2):
+            response = self.client.get(f'/api/cities/{city.id}/')
+        self.assertEqual(len(response.data['recent_weather']), 5)
+
     def test_update_city(self):
         """Test updating a city"""
         data = {'name': 'Mumbai City', 'country': 'India', 
@@ -61,6 +138,7 @@ class CityAPITestCase(APITestCase):
 
 class WeatherRecordAPITestCase(APITestCase):
     def setUp(self):
+        caches['analytics'].clear()
         self.city = City.objects.create(
             name='London',
             country='UK',
@@ -120,8 +198,1680 @@ class WeatherRecordAPITestCase(APITestCase):
         self.assertIn('daily_trends', response.data)
         self.assertEqual(response.data['statistics']['total_records'], 5)
 
+    def test_analytics_daily_trends(self):
+        """Test daily trends are bucketed into 24h windows with gaps filled"""
+        now = timezone.now()
+        fields = {k: v for k, v in self.weather_data.items()
+                  if k not in ('city', 'temperature', 'recorded_at')}
+        for hours_ago, temperature in [(1, 10), (2, 20), (50, 30)]:
+            WeatherRecord.objects.create(
+                city=self.city, temperature=temperature,
+                recorded_at=now - timedelta(hours=hours_ago), **fields
+            )
+
+        with self.assertNumQueries(2):
+            response = self.client.get(
+                f'/api/weather-records/analytics/?days=3&city_id={self.city.id}'
+            )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        trends = response.data['daily_trends']
+        self.assertEqual(len(trends), 3)
+        self.assertEqual([day['avg_temperature'] for day in trends],
+                         [30.0, None, 15.0])
+        self.assertIsNone(trends[1]['avg_humidity'])
+
+    def test_analytics_city_summary_query_count(self):
+        """Test city summary does not issue queries per city"""
+        fields = {k: v for k, v in self.weather_data.items() if k != 'city'}
+        WeatherRecord.objects.create(city=self.city, **fields)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/weather-records/analytics/')
+        self.assertEqual(len(response.data['city_summary']), 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            for i in range(5):
+                city = City.objects.create(name=f'City {i}', country='UK',
+                                           latitude=50.0 + i, longitude=0.0)
+                WeatherRecord.objects.create(city=city, **fields)
+            City.objects.create(name='Empty', country='UK',
+                                latitude=49.0, longitude=0.0)
+        with self.assertNumQueries(3):
+            response = self.client.get('/api/weather-records/analytics/')
+
+        summary = response.data['city_summary']
+        self.assertEqual(len(summary), 6)
+        self.assertEqual(summary[0]['city_name'], 'City 0')
+        self.assertEqual(summary[-1], {
+            'city_name': 'London', 'country': 'UK',
+            'avg_temperature': 15.5, 'record_count': 1
+        })
+
+
+class RollupTestCase(APITestCase):
+    def setUp(self):
+        caches['analytics'].clear()
+        self.city = City.objects.create(
+            name='Oslo', country='Norway', latitude=59.91, longitude=10.75
+        )
+        self.hour = timezone.now().replace(minute=0, second=0, microsecond=0)
+
+    def create_record(self, temperature, recorded_at):
+        return self.client.post('/api/weather-records/', {
+            'city': self.city.id, 'temperature': temperature,
+            'feels_like': temperature, 'humidity': 80, 'pressure': 1000,
+            'wind_speed': 3.0, 'description': 'Clear', 'recorded_at': recorded_at
+        }, format='json')
+
+    def test_rollups_maintained_on_create(self):
+        """Test hourly and daily rollups are updated as records are created"""
+        self.create_record(4.0, self.hour + timedelta(minutes=5))
+        self.create_record(10.0, self.hour + timedelta(minutes=35))
+
+        hourly = HourlyWeatherRollup.objects.get(city=self.city)
+        self.assertEqual(hourly.bucket_start, self.hour)
+        self.assertEqual(hourly.record_count, 2)
+        self.assertEqual(hourly.temperature_sum, 14.0)
+        self.assertEqual(hourly.temperature_min, 4.0)
+        self.assertEqual(hourly.temperature_max, 10.0)
+        self.assertEqual(DailyWeatherRollup.objects.get(city=self.city).record_count, 2)
+
+    def test_delete_refreshes_rollups(self):
+        """Test deleting a record through the API recomputes its buckets"""
+        self.create_record(4.0, self.hour + timedelta(minutes=5))
+        self.create_record(10.0, self.hour + timedelta(minutes=35))
+        record = WeatherRecord.objects.get(temperature=4.0)
+        response = self.client.delete(f'/api/weather-records/{record.id}/')
+        self.assertEqual(response.status_code, status.HTTP_204_NO_CONTENT)
+
+        hourly = HourlyWeatherRollup.objects.get(city=self.city)
+        self.assertEqual(hourly.record_count, 1)
+        self.assertEqual(hourly.temperature_min, 10.0)
+
+    def test_queryset_delete_refreshes_rollups_and_counts(self):
+        """Test deletes outside the API keep rollups and counters current"""
+        self.create_record(4.0, self.hour + timedelta(minutes=5))
+        self.create_record(10.0, self.hour + timedelta(minutes=35))
+        WeatherRecord.objects.filter(temperature=4.0).delete()
+
+        self.city.refresh_from_db()
+        self.assertEqual(self.city.weather_record_count, 1)
+        self.assertEqual(DailyWeatherRollup.objects.get(city=self.city).temperature_min, 10.0)
+
+        self.city.delete()
+        self.assertFalse(HourlyWeatherRollup.objects.exists())
+
+    def test_aligned_analytics_match_raw(self):
+        """Test analytics served from rollups agree with the raw path"""
+        for hours_ago, temperature in [(0, 12.0), (3, 8.0), (30, 2.0)]:
+            self.create_record(temperature, self.hour - timedelta(hours=hours_ago))
+
+        raw = self.client.get('/api/weather-records/analytics/?days=3').data
+        for align in ('hour', 'day'):
+            aligned = self.client.get(
+                f'/api/weather-records/analytics/?days=3&align={align}'
+            ).data
+            self.assertEqual(aligned['statistics'], raw['statistics'])
+            self.assertEqual(aligned['city_summary'], raw['city_summary'])
+            self.assertEqual(len(aligned['daily_trends']), 3)
+
+        response = self.client.get('/api/weather-records/analytics/?align=week')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_purge_keeps_downsampled_history(self):
+        """Test purging old raw readings keeps them in the rollups"""
+        old_hour = self.hour - timedelta(days=40)
+        self.create_record(2.0, old_hour + timedelta(minutes=10))
+        self.create_record(6.0, old_hour + timedelta(minutes=20))
+        self.create_record(9.0, self.hour)
+        HourlyWeatherRollup.objects.filter(bucket_start=old_hour).delete()  # stale rollup
+
+        out = StringIO()
+        call_command('purge_weather', '--days=30', '--batch-size=1', stdout=out)
+        self.assertIn('Deleted 2 raw readings', out.getvalue())
+        self.assertIn('in 2 batches', out.getvalue())
+        self.assertEqual(list(WeatherRecord.objects.values_list('temperature', flat=True)), [9.0])
+        self.city.refresh_from_db()
+        self.assertEqual(self.city.weather_record_count, 1)
+
+        call_command('rebuild_rollups', stdout=StringIO())
+        old = HourlyWeatherRollup.objects.get(bucket_start=old_hour)
+        self.assertEqual((old.record_count, old.temperature_min, old.temperature_max), (2, 2.0, 6.0))
+        self.assertEqual(DailyWeatherRollup.objects.get(
+            bucket_start=old_hour.replace(hour=0)).record_count, 2)
+
+    def test_interrupted_purge_keeps_counts(self):
+        """Test every committed purge batch has already adjusted the counter"""
+        for minutes in (10, 20, 30):
+            self.create_record(2.0, self.hour - timedelta(days=40, minutes=minutes))
+        cutoff = retention.retention_cutoff(30)
+
+        with mock.patch('weather_app.retention.time.sleep',
+                        side_effect=[None, DatabaseError('connection lost')]), \
+                self.assertRaises(DatabaseError):
+            retention.purge(cutoff, batch_size=1, pause=1)
+
+        self.city.refresh_from_db()
+        self.assertEqual(WeatherRecord.objects.count(), 1)
+        self.assertEqual(self.city.weather_record_count, 1)
+
+    def test_repeated_purge_keeps_purged_buckets(self):
+        """Test a purge after a backdated insert keeps the earlier purges' rollups"""
+        old_hour = self.hour.replace(hour=12) - timedelta(days=40)
+        for days_ago, temperature in [(0, 2.0), (1, 4.0), (2, 6.0)]:
+            self.create_record(temperature, old_hour - timedelta(days=days_ago))
+        call_command('purge_weather', '--days=30', stdout=StringIO())
+        self.assertEqual(DailyWeatherRollup.objects.count(), 3)
+
+        # A late reading for a purged bucket, and one for a new bucket
+        self.create_record(8.0, old_hour + timedelta(minutes=10))
+        self.create_record(1.0, old_hour - timedelta(days=3))
+        # A stale bucket: the downsample must rewrite it from its raw rows
+        DailyWeatherRollup.objects.filter(bucket_start=day_bucket(old_hour - timedelta(days=3))).delete()
+        out = StringIO()
+        call_command('purge_weather', '--days=30', stdout=out)
+        self.assertIn('Deleted 2 raw readings', out.getvalue())
+
+        daily = dict(DailyWeatherRollup.objects.values_list('bucket_start', 'record_count'))
+        self.assertEqual(daily, {
+            day_bucket(old_hour - timedelta(days=days_ago)): count
+            for days_ago, count in [(0, 2), (1, 1), (2, 1), (3, 1)]
+        })
+        merged = HourlyWeatherRollup.objects.get(bucket_start=old_hour)
+        self.assertEqual((merged.temperature_min, merged.temperature_max), (2.0, 8.0))
+
+    def test_ingest_upserts_rollups(self):
+        """Test bulk ingests merge into rollups with a fixed number of queries"""
+        cities = [self.city] + [
+            City.objects.create(name=f'City {i}', country='Norway', latitude=60.0 + i,
+                                longitude=10.0)
+            for i in range(99)
+        ]
+
+        def ingest(rows):
+            WeatherRecord.objects.bulk_ingest([
+                WeatherRecord(city=cities[i % len(cities)], temperature=float(i % 17),
+                              feels_like=0.0, humidity=i % 100, pressure=1000 + i % 7,
+                              wind_speed=float(i % 5), description='Clear',
+                              recorded_at=self.hour - timedelta(minutes=7 * i))
+                for i in range(rows)
+            ])
+
+        ingest(10)
+        with CaptureQueriesContext(connection) as small:
+            ingest(20)
+        with CaptureQueriesContext(connection) as large:
+            ingest(400)  # overlaps the buckets written above
+        # One upsert per resolution, which SQLite splits at its 999 parameters
+        upserts = [q for q in large if 'weather_rollups' in q['sql']]
+        self.assertLessEqual(len(upserts), 2 * math.ceil(400 / (999 // 15)))
+        # Everything else (counters, savepoints) does not grow with the batch
+        self.assertEqual(len([q for q in large if not q['sql'].startswith('INSERT')]),
+                         len([q for q in small if not q['sql'].startswith('INSERT')]))
+
+        def snapshot():
+            return {
+                model: sorted(tuple(row.values()) for row in model.objects.values(
+                    'city_id', 'bucket_start', 'record_count', 'temperature_sum',
+                    'temperature_min', 'temperature_max', 'humidity_min', 'pressure_max'))
+                for model in (HourlyWeatherRollup, DailyWeatherRollup)
+            }
+
+        merged = snapshot()
+        call_command('rebuild_rollups', stdout=StringIO())
+        self.assertEqual(merged, snapshot())
+
+    def test_rebuild_rollups_command(self):
+        """Test rollups can be rebuilt from raw records"""
+        for minutes in (5, 65, 125):
+            self.create_record(5.0, self.hour - timedelta(minutes=minutes))
+        expected = list(HourlyWeatherRollup.objects.values().order_by('bucket_start'))
+        HourlyWeatherRollup.objects.all().delete()
+        DailyWeatherRollup.objects.all().delete()
+
+        call_command('rebuild_rollups', stdout=StringIO())
+
+        rebuilt = list(HourlyWeatherRollup.objects.values().order_by('bucket_start'))
+        for row in expected + rebuilt:
+            row.pop('id')
+        self.assertEqual(rebuilt, expected)
+        self.assertEqual(sum(DailyWeatherRollup.objects.values_list('record_count', flat=True)), 3)
+
+
+class BucketedTrendsTestCase(APITestCase):
+    def setUp(self):
+        caches['analytics'].clear()
+        self.city = City.objects.create(
+            name='Boston', country='USA', latitude=42.36, longitude=-71.06
+        )
+        # US clocks went forward on 8 March 2026
+        self.now = datetime(2026, 3, 10, 15, 30, tzinfo=dt_timezone.utc)
+        self.readings = [datetime(2026, 3, day, hour, 10, tzinfo=dt_timezone.utc)
+                         for day, hour in [(7, 3), (7, 6), (8, 2), (9, 4), (10, 3), (10, 14)]]
+        WeatherRecord.objects.bulk_ingest([
+            WeatherRecord(city=self.city, temperature=float(i), feels_like=0, humidity=50,
+                          pressure=1000, wind_speed=1.0, description='Clear', recorded_at=when)
+            for i, when in enumerate(self.readings)
+        ])
+
+    def trends(self, bucket, tz, days=3):
+        payload = build_analytics(days, bucket=bucket, tz=tz, now=self.now)
+        return [(row['start'], row['record_count']) for row in payload['trends']]
+
+    def test_calendar_days_in_time_zone(self):
+        """Test day buckets follow local midnights across a DST change"""
+        self.assertEqual(self.trends('day', ZoneInfo('America/New_York')), [
+            ('2026-03-07T00:00:00-05:00', 2),
+            ('2026-03-08T00:00:00-05:00', 0),
+            ('2026-03-09T00:00:00-04:00', 2),
+            ('2026-03-10T00:00:00-04:00', 1),
+        ])
+        self.assertEqual(self.trends('day', dt_timezone.utc), [
+            ('2026-03-07T00:00:00+00:00', 2),
+            ('2026-03-08T00:00:00+00:00', 1),
+            ('2026-03-09T00:00:00+00:00', 1),
+            ('2026-03-10T00:00:00+00:00', 2),
+        ])
+
+    def test_weeks_and_months(self):
+        """Test week buckets start on Mondays and month buckets on the 1st"""
+        self.assertEqual(self.trends('week', dt_timezone.utc, days=7), [
+            ('2026-03-02T00:00:00+00:00', 3),
+            ('2026-03-09T00:00:00+00:00', 3),
+        ])
+        self.assertEqual(self.trends('month', ZoneInfo('Europe/Oslo'), days=40), [
+            ('2026-01-01T00:00:00+01:00', 0),
+            ('2026-02-01T00:00:00+01:00', 0),
+            ('2026-03-01T00:00:00+01:00', 6),
+        ])
+
+    def test_trends_served_from_rollups(self):
+        """Test whole-hour zones read rollups and other zones raw rows"""
+        # A raw DELETE bypasses the signals, so only raw rows go
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {WeatherRecord._meta.db_table}')
+        with self.assertNumQueries(3):
+            self.assertEqual(sum(n for _, n in self.trends('hour', ZoneInfo('America/New_York'))), 4)
+        self.assertEqual(sum(n for _, n in self.trends('month', dt_timezone.utc)), 6)
+        self.assertEqual(sum(n for _, n in self.trends('day', ZoneInfo('Asia/Kolkata'))), 0)
+
+    def test_repeated_hour_when_clocks_go_back(self):
+        """Test the two 01:00 hours of a fall-back day are separate buckets"""
+        # US clocks went back at 06:00 UTC on 2 November 2025
+        WeatherRecord.objects.bulk_ingest([
+            WeatherRecord(city=self.city, temperature=temperature, feels_like=0, humidity=50,
+                          pressure=1000, wind_speed=1.0, description='Clear',
+                          recorded_at=datetime(2025, 11, 2, hour, 30, tzinfo=dt_timezone.utc))
+            for hour, temperature in [(5, 1.0), (6, 3.0)]
+        ])
+        self.now = datetime(2025, 11, 2, 7, 30, tzinfo=dt_timezone.utc)
+        tz = ZoneInfo('America/New_York')
+        self.assertEqual(self.trends('hour', tz, days=1)[-4:], [
+            ('2025-11-02T00:00:00-04:00', 0),
+            ('2025-11-02T01:00:00-04:00', 1),
+            ('2025-11-02T01:00:00-05:00', 1),
+            ('2025-11-02T02:00:00-05:00', 0),
+        ])
+        # Raw rows, bucketed on the half hour
+        self.assertEqual(self.trends('hour', ZoneInfo('Asia/Kolkata'), days=1)[-3:], [
+            ('2025-11-02T11:00:00+05:30', 1),
+            ('2025-11-02T12:00:00+05:30', 1),
+            ('2025-11-02T13:00:00+05:30', 0),
+        ])
+
+        payload = build_comparison([(self.city.id, 'Boston')], 1, bucket='hour', tz=tz,
+                                   now=self.now)
+        self.assertEqual(payload['buckets'][-3:], ['2025-11-02T01:00:00-04:00',
+                                                   '2025-11-02T01:00:00-05:00',
+                                                   '2025-11-02T02:00:00-05:00'])
+        self.assertEqual(payload['trends']['avg_temperature'][0][-3:], [1.0, 3.0, None])
+
+    def test_comparison_matrix(self):
+        """Test comparisons lay out cities by buckets from rollups and raw rows alike"""
+        other = City.objects.create(name='Denver', country='USA',
+                                    latitude=39.74, longitude=-104.99)
+        WeatherRecord.objects.create(
+            city=other, temperature=-3.0, feels_like=-6.0, humidity=30, pressure=1015,
+            wind_speed=6.0, description='Snow', recorded_at=self.now - timedelta(hours=1)
+        )
+        cities = [(other.id, 'Denver'), (self.city.id, 'Boston')]
+        payload = build_comparison(cities, 3, tz=dt_timezone.utc, now=self.now)
+        self.assertEqual(payload['cities'], ['Denver', 'Boston'])
+        self.assertEqual(payload['buckets'][0], '2026-03-07T00:00:00+00:00')
+        self.assertEqual(payload['trends']['record_count'], [[0, 0, 0, 1], [2, 1, 1, 2]])
+        self.assertEqual(payload['trends']['avg_temperature'][1], [0.5, 2.0, 3.0, 4.5])
+        self.assertEqual(payload['trends']['avg_temperature'][0], [None, None, None, -3.0])
+        self.assertEqual(payload['statistics']['record_count'], [1, 6])
+        self.assertEqual(payload['statistics']['avg_temperature'], [-3.0, 2.5])
+        self.assertEqual(payload['statistics']['max_temperature'], [-3.0, 5.0])
+
+        raw = build_comparison(cities, 3, tz=ZoneInfo('Asia/Kolkata'), now=self.now)
+        self.assertEqual(raw['statistics'], payload['statistics'])
+
+    def test_compare_endpoint(self):
+        """Test the compare endpoint answers in two queries and validates its input"""
+        url = f'/api/weather-records/compare/?city_ids={self.city.id}&bucket=hour&days=1'
+        with self.assertNumQueries(2):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['trends']['record_count'][0]),
+                         len(response.data['buckets']))
+
+        for query in ['', 'city_ids=a', f'city_ids={self.city.id}&bucket=year',
+                      f'city_ids={self.city.id}&days=0',
+                      f'city_ids={self.city.id}&days=9999999']:
+            response = self.client.get(f'/api/weather-records/compare/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+        response = self.client.get(f'/api/weather-records/compare/?city_ids={self.city.id},999')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        with override_settings(WEATHER_COMPARE_MAX_CITIES=1):
+            response = self.client.get(f'/api/weather-records/compare/?city_ids=1,2')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_compare_ignores_future_readings(self):
+        """Test readings dated after the current bucket are left out of the comparison"""
+        later = [self.now + timedelta(days=2), timezone.now() + timedelta(days=2)]
+        WeatherRecord.objects.bulk_ingest([
+            WeatherRecord(city=self.city, temperature=99.0, feels_like=0, humidity=50,
+                          pressure=1000, wind_speed=1.0, description='Clear', recorded_at=when)
+            for when in later
+        ])
+        cities = [(self.city.id, 'Boston')]
+        # Hour buckets start the window at 15:00 on the 7th
+        for bucket, tz, count in [('day', None, 6), ('hour', None, 4),
+                                  ('day', ZoneInfo('Asia/Kolkata'), 6)]:
+            payload = build_comparison(cities, 3, bucket=bucket, tz=tz, now=self.now)
+            self.assertEqual(payload['statistics']['record_count'], [count], (bucket, tz))
+            self.assertEqual(payload['statistics']['max_temperature'], [5.0], (bucket, tz))
+
+        response = self.client.get(f'/api/weather-records/compare/?city_ids={self.city.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        with override_settings(WEATHER_ASYNC_DB_WORKERS=0):
+            response = self.client.get(
+                f'/api/async/weather-records/compare/?city_ids={self.city.id}')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+    def test_bucket_parameters(self):
+        """Test the analytics endpoint validates bucket and tz"""
+        response = self.client.get('/api/weather-records/analytics/?bucket=week&tz=Asia/Tokyo')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['bucket'], response.data['timezone']),
+                         ('week', 'Asia/Tokyo'))
+        self.assertNotIn('daily_trends', response.data)
+        self.assertTrue(response.data['trends'][0]['start'].endswith('T00:00:00+09:00'))
+
+        for query in ['bucket=year', 'bucket=day&tz=Mars/Olympus', 'bucket=day&tz=America',
+                      'bucket=day&days=-2', 'bucket=hour&days=0', 'days=9999999']:
+            response = self.client.get(f'/api/weather-records/analytics/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+
+class HomePageTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.addCleanup(cache.clear)
+
+    def test_home_served_from_snapshot(self):
+        """Test the home page is rebuilt after writes and cached in between"""
+        city = City.objects.create(name='<b>Bergen</b>', country='Norway',
+                                   latitude=60.39, longitude=5.32)
+        WeatherRecord.objects.create(city=city, temperature=7.5, feels_like=5.0,
+                                     humidity=90, pressure=1002, wind_speed=8.0,
+                                     description='Rain & wind')
+        response = self.client.get('/')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertContains(response, '&lt;b&gt;Bergen&lt;/b&gt;: 7.5°C - Rain &amp; wind')
+        self.assertNotContains(response, '<b>Bergen</b>')
+        self.assertContains(response, 'http://testserver/api/cities/1/fetch_weather/')
+        with self.assertNumQueries(0):
+            self.client.get('/')
+
+        City.objects.create(name='Oslo', country='Norway', latitude=59.91, longitude=10.75)
+        self.assertContains(self.client.get('/'), 'Oslo, Norway')
+
+
+class AnalyticsCacheTestCase(APITestCase):
+    def setUp(self):
+        caches['analytics'].clear()
+        self.city = City.objects.create(
+            name='Quito', country='Ecuador', latitude=-0.18, longitude=-78.47
+        )
+        self.url = f'/api/weather-records/analytics/?city_id={self.city.id}&days=2'
+
+    def create_record(self, temperature, recorded_at):
+        return WeatherRecord.objects.create(
+            city=self.city, temperature=temperature, feels_like=temperature,
+            humidity=60, pressure=1020, wind_speed=2.0, description='Clear',
+            recorded_at=recorded_at
+        )
+
+    def test_repeated_requests_are_cached(self):
+        """Test identical analytics requests are served from the cache"""
+        self.create_record(10.0, timezone.now())
+        first = self.client.get(self.url)
+        with self.assertNumQueries(0):
+            second = self.client.get(self.url)
+        self.assertEqual((first['X-Cache'], second['X-Cache']), ('MISS', 'HIT'))
+        self.assertEqual(second.data, first.data)
+
+        stats = self.client.get('/api/weather-records/analytics/cache/').data
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+    def test_writes_in_window_invalidate(self):
+        """Test creating, updating and deleting readings in the window invalidates"""
+        record = self.create_record(10.0, timezone.now())
+        self.client.get(self.url)
+        self.client.get('/api/weather-records/analytics/')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.create_record(20.0, timezone.now())
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['statistics']['total_records'], 2)
+        response = self.client.get('/api/weather-records/analytics/')
+        self.assertEqual(response.data['statistics']['total_records'], 2)
+
+        record.temperature = 40.0
+        with self.captureOnCommitCallbacks(execute=True):
+            record.save()
+        self.assertEqual(self.client.get(self.url).data['statistics']['max_temperature'], 40.0)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(f'/api/weather-records/{record.id}/')
+        self.assertEqual(self.client.get(self.url).data['statistics']['total_records'], 1)
+
+    def test_invalidation_waits_for_commit(self):
+        """Test a write only invalidates once its transaction commits"""
+        self.client.get(self.url)
+        with self.captureOnCommitCallbacks(execute=True):
+            WeatherRecord.objects.bulk_ingest([WeatherRecord(
+                city=self.city, temperature=12.0, feels_like=12.0, humidity=60,
+                pressure=1020, wind_speed=2.0, description='Clear',
+                recorded_at=timezone.now()
+            )])
+            # A request before the commit must not cache under the new version
+            self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+        response = self.client.get(self.url)
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertEqual(response.data['statistics']['total_records'], 1)
+
+    def test_writes_outside_window_keep_cache(self):
+        """Test readings older than every cached window leave entries cached"""
+        self.client.get(self.url)
+        self.create_record(5.0, timezone.now() - timedelta(days=30))
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+
+        other = City.objects.create(name='Lima', country='Peru',
+                                    latitude=-12.05, longitude=-77.04)
+        WeatherRecord.objects.bulk_ingest([WeatherRecord(
+            city=other, temperature=18.0, feels_like=18.0, humidity=70,
+            pressure=1010, wind_speed=4.0, description='Mist',
+            recorded_at=timezone.now()
+        )])
+        self.assertEqual(self.client.get(self.url)['X-Cache'], 'HIT')
+
+    def test_invalid_params(self):
+        """Test non-integer analytics parameters are rejected"""
+        response = self.client.get('/api/weather-records/analytics/?city_id=abc')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class StatisticsTestCase(APITestCase):
+    def setUp(self):
+        self.now = timezone.now()
+        self.cities = [
+            City.objects.create(name=name, country='Chile', latitude=lat, longitude=-70.6)
+            for name, lat in [('Santiago', -33.45), ('Arica', -18.48)]
+        ]
+        records = []
+        for step, city in enumerate(self.cities, start=1):
+            # Every 5 hours for 12 days, with an irregular temperature
+            for i in range(int(12 * 24 / 5)):
+                records.append(WeatherRecord(
+                    city=city, temperature=((i * 7 * step) % 23) - 4.5, feels_like=0,
+                    humidity=50 + i % 40, pressure=1000 + i % 30, wind_speed=3.0,
+                    description='Clear', recorded_at=self.now - timedelta(hours=5 * i)
+                ))
+        WeatherRecord.objects.bulk_ingest(records)
+
+    def expected(self, city, days, field='temperature'):
+        """Brute-force figures for ``city`` straight from the rows."""
+        start = self.now - timedelta(days=days)
+        readings = sorted(WeatherRecord.objects.filter(city=city)
+                          .values_list('recorded_at', field))
+        values = sorted(float(value) for when, value in readings if when >= start)
+        mean = sum(values) / len(values)
+
+        def percentile(fraction):
+            position = fraction * (len(values) - 1)
+            lower, upper = math.floor(position), math.ceil(position)
+            return values[lower] + (values[upper] - values[lower]) * (position - lower)
+
+        def moving(at, span):
+            window = [value for when, value in readings if at - span <= when <= at]
+            return round(sum(window) / len(window), 2)
+
+        last_of_day = {}
+        for when, _ in readings:
+            if when >= start:
+                last_of_day[when.astimezone(dt_timezone.utc).date()] = when
+        return {
+            'count': len(values),
+            'mean': round(mean, 2),
+            'stddev': round(math.sqrt(sum((v - mean) ** 2 for v in values)
+                                      / (len(values) - 1)), 2),
+            'p50': round(percentile(0.5), 2),
+            'p90': round(percentile(0.9), 2),
+            'p99': round(percentile(0.99), 2),
+            'daily': [
+                {'date': day.strftime('%Y-%m-%d'),
+                 'moving_average_24h': moving(at, timedelta(hours=24)),
+                 'moving_average_7d': moving(at, timedelta(days=7))}
+                for day, at in sorted(last_of_day.items())
+            ],
+        }
+
+    def assert_matches_rows(self, payload, days, field='temperature'):
+        self.assertEqual([city['city_name'] for city in payload['cities']], ['Arica', 'Santiago'])
+        for entry in payload['cities']:
+            city = City.objects.get(pk=entry['city_id'])
+            expected = self.expected(city, days, field)
+            for key, value in expected.items():
+                self.assertEqual(entry[key], value, key)
+            self.assertEqual(entry['moving_average_7d'],
+                             expected['daily'][-1]['moving_average_7d'])
+
+    @skipUnless(stats.numpy, 'numpy is not installed')
+    def test_numpy_engine(self):
+        """Test the NumPy engine matches figures computed from the rows"""
+        for days, field in [(3, 'temperature'), (5, 'humidity')]:
+            payload = stats.build_statistics(days, field=field, engine='numpy', now=self.now)
+            self.assertEqual(payload['engine'], 'numpy')
+            self.assert_matches_rows(payload, days, field)
+
+    @skipUnless(connection.vendor == 'postgresql', 'the database engine needs PostgreSQL')
+    def test_database_engine(self):
+        """Test the PostgreSQL engine matches figures computed from the rows"""
+        with self.assertNumQueries(3):
+            payload = stats.build_statistics(3, engine='database', now=self.now)
+        self.assert_matches_rows(payload, 3)
+
+    @skipUnless(stats.numpy, 'numpy is not installed')
+    def test_statistics_endpoint(self):
+        """Test the statistics endpoint filters by city and validates its parameters"""
+        city = self.cities[0]
+        response = self.client.get(
+            f'/api/weather-records/statistics/?city_id={city.id}&days=2&field=pressure'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['field'], 'pressure')
+        self.assertEqual([entry['city_id'] for entry in response.data['cities']], [city.id])
+        self.assertEqual(response.data['cities'][0]['daily'],
+                         self.expected(city, 2, 'pressure')['daily'])
+
+        for query in ['field=description', 'days=0', 'days=x', 'days=9999999',
+                      'engine=pandas']:
+            response = self.client.get(f'/api/weather-records/statistics/?{query}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, query)
+
+    def test_statistics_without_numpy(self):
+        """Test the fallback engine reports a missing numpy install"""
+        with mock.patch.object(stats, 'numpy', None):
+            response = self.client.get('/api/weather-records/statistics/?engine=numpy')
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+        self.assertIn('numpy', response.data['error'])
+
+
+class ConditionalGetTestCase(APITestCase):
+    def setUp(self):
+        caches['analytics'].clear()
+        self.city = City.objects.create(
+            name='Perth', country='Australia', latitude=-31.95, longitude=115.86
+        )
+        self.records = [
+            WeatherRecord.objects.create(
+                city=self.city, temperature=20.0 + i, feels_like=20.0, humidity=40,
+                pressure=1015, wind_speed=6.0, description='Sunny',
+                recorded_at=timezone.now() - timedelta(hours=i)
+            )
+            for i in range(3)
+        ]
+
+    def assertRevalidates(self, url):
+        first = self.client.get(url)
+        self.assertEqual(first.status_code, status.HTTP_200_OK)
+        second = self.client.get(url, HTTP_IF_NONE_MATCH=first['ETag'])
+        self.assertEqual(second.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(second.content, b'')
+        return first['ETag']
+
+    def test_unchanged_resources_answer_304(self):
+        """Test list, detail and analytics endpoints honour If-None-Match"""
+        for url in ['/api/cities/', f'/api/cities/{self.city.id}/',
+                    '/api/cities/latest/', '/api/weather-records/',
+                    '/api/weather-records/?pagination=cursor',
+                    f'/api/weather-records/{self.records[0].id}/',
+                    '/api/weather-records/analytics/']:
+            with self.subTest(url=url):
+                self.assertRevalidates(url)
+
+    def test_changes_produce_new_etag(self):
+        """Test updates and deletes change the validators"""
+        url = '/api/weather-records/'
+        etag = self.assertRevalidates(url)
+        self.records[1].temperature = 30.0
+        self.records[1].save()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        etag = response['ETag']
+        self.client.delete(f'/api/weather-records/{self.records[2].id}/')
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['count'], 2)
+
+    def test_if_modified_since_on_record(self):
+        """Test single records carry Last-Modified and honour If-Modified-Since"""
+        url = f'/api/weather-records/{self.records[0].id}/'
+        response = self.client.get(url)
+        response = self.client.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, status.HTTP_304_NOT_MODIFIED)
+
+
+class WeatherRecordPaginationTestCase(APITestCase):
+    def setUp(self):
+        city = City.objects.create(name='Lagos', country='Nigeria',
+                                   latitude=6.52, longitude=3.38)
+        now = timezone.now()
+        # Pairs of records share a timestamp to exercise the id tie-breaker
+        WeatherRecord.objects.bulk_ingest([
+            WeatherRecord(city=city, temperature=i, feels_like=i, humidity=70,
+                          pressure=1010, wind_speed=2, description='Humid',
+                          recorded_at=now - timedelta(minutes=i // 2))
+            for i in range(25)
+        ])
+        self.expected = list(
+            WeatherRecord.objects.order_by('-recorded_at', '-id').values_list('id', flat=True)
+        )
+
+    def test_cursor_pagination(self):
+        """Test keyset pages walk every record once, forwards and back"""
+        url, seen, pages = '/api/weather-records/?pagination=cursor', [], []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            pages.append(response.data)
+            seen.extend(r['id'] for r in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(seen, self.expected)
+        self.assertEqual(len(pages), 3)
+        self.assertIsNone(pages[0]['previous'])
+
+        response = self.client.get(pages[2]['previous'])
+        self.assertEqual([r['id'] for r in response.data['results']], self.expected[10:20])
+        response = self.client.get(response.data['previous'])
+        self.assertEqual([r['id'] for r in response.data['results']], self.expected[:10])
+        self.assertIsNone(response.data['previous'])
+
+    def test_cursor_pagination_skips_count(self):
+        """Test keyset pages run a single query without COUNT(*)"""
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/api/weather-records/?pagination=cursor')
+        self.assertEqual(len(queries), 1)
+        self.assertNotIn('COUNT', queries[0]['sql'])
+
+        response = self.client.get('/api/weather-records/?cursor=garbage')
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_number_without_count(self):
+        """Test count=false keeps page numbers but drops the total"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get('/api/weather-records/?count=false&page=3')
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertIsNone(response.data['next'])
+        self.assertIn('page=2', response.data['previous'])
+        self.assertEqual(len(queries), 1)
+
+        response = self.client.get('/api/weather-records/')
+        self.assertEqual(response.data['count'], 25)
+
+
+class RecordCountTestCase(APITestCase):
+    def setUp(self):
+        self.city = City.objects.create(name='Accra', country='Ghana',
+                                        latitude=5.6, longitude=-0.19)
+        self.other = City.objects.create(name='Kumasi', country='Ghana',
+                                         latitude=6.69, longitude=-1.62)
+
+    def make_record(self, city, **fields):
+        return WeatherRecord(city=city, temperature=28.0, feels_like=31.0, humidity=80,
+                             pressure=1009, wind_speed=3.0, description='Humid', **fields)
+
+    def counters(self):
+        return dict(City.objects.values_list('name', 'weather_record_count'))
+
+    def test_counters_follow_writes(self):
+        """Test per-city counters track inserts, moves and deletes"""
+        record = self.make_record(self.city)
+        record.save()
+        WeatherRecord.objects.bulk_ingest([self.make_record(self.other) for _ in range(3)])
+        self.assertEqual(self.counters(), {'Accra': 1, 'Kumasi': 3})
+
+        record.city = self.other
+        record.save()
+        self.assertEqual(self.counters(), {'Accra': 0, 'Kumasi': 4})
+
+        self.client.delete(f'/api/weather-records/{record.id}/')
+        self.assertEqual(self.counters(), {'Accra': 0, 'Kumasi': 3})
+        self.assertEqual(self.client.get('/api/cities/').data['results'][1]['weather_records_count'], 3)
+
+        WeatherRecord.objects.filter(city=self.other).delete()  # bypasses the counters
+        out = StringIO()
+        call_command('recount_weather', stdout=out)
+        self.assertEqual(self.counters(), {'Accra': 0, 'Kumasi': 0})
+        self.assertIn('0 weather records', out.getvalue())
+
+    def test_paginator_uses_maintained_count(self):
+        """Test unfiltered and per-city pages skip COUNT(*)"""
+        WeatherRecord.objects.bulk_ingest([self.make_record(self.city) for _ in range(12)])
+        for url in ['/api/weather-records/', f'/api/weather-records/?city_id={self.city.id}']:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.client.get(url)
+            self.assertEqual(response.data['count'], 12)
+            self.assertFalse(any('COUNT(' in q['sql'] for q in queries))
+
+        # A stale counter still lets clients reach every real page
+        City.objects.update(weather_record_count=5)
+        response = self.client.get('/api/weather-records/?page=2')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(len(response.data['results']), 2)
+
+    @override_settings(WEATHER_COUNT_MODE='exact')
+    def test_exact_mode(self):
+        """Test exact mode counts rows instead of trusting the counters"""
+        WeatherRecord.objects.bulk_ingest([self.make_record(self.city) for _ in range(2)])
+        City.objects.update(weather_record_count=0)
+        self.assertEqual(self.client.get('/api/weather-records/').data['count'], 2)
+        results = self.client.get('/api/cities/').data['results']
+        self.assertEqual(results[0]['weather_records_count'], 2)
+
+
+class WeatherRecordExportTestCase(APITestCase):
+    def setUp(self):
+        self.city = City.objects.create(name='Cairo', country='Egypt',
+                                        latitude=30.04, longitude=31.24)
+        other = City.objects.create(name='Giza', country='Egypt',
+                                    latitude=30.01, longitude=31.21)
+        now = timezone.now()
+        for i, city in enumerate([self.city] * 3 + [other]):
+            WeatherRecord.objects.create(
+                city=city, temperature=30 + i, feels_like=31, humidity=20,
+                pressure=1009, wind_speed=4.5, description='Sunny, hot',
+                recorded_at=now - timedelta(days=i)
+            )
+
+    def test_export_ndjson(self):
+        """Test NDJSON export streams records matching the filters"""
+        response = self.client.get(
+            f'/api/weather-records/export/?city_id={self.city.id}&days=1'
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertTrue(response.streaming)
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in
+                b''.join(response.streaming_content).decode().splitlines()]
+        self.assertEqual([row['temperature'] for row in rows], [30.0])
+        self.assertEqual(rows[0]['city_name'], 'Cairo')
+
+    def test_export_csv(self):
+        """Test CSV export writes a header and one line per record"""
+        response = self.client.get('/api/weather-records/export/?output=csv')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(b''.join(response.streaming_content).decode().splitlines()))
+        self.assertEqual(rows[0][:3], ['id', 'city', 'city_name'])
+        self.assertEqual(len(rows), 5)
+        self.assertEqual(rows[1][8], 'Sunny, hot')
+
+        response = self.client.get('/api/weather-records/export/?output=xml')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @skipUnless(exports.pyarrow, 'pyarrow is not installed')
+    def test_export_arrow(self):
+        """Test Arrow IPC export with dictionary-encoded city columns"""
+        import pyarrow
+
+        with override_settings(WEATHER_ARROW_BATCH_SIZE=3):
+            response = self.client.get('/api/weather-records/export/?output=arrow')
+            content = b''.join(response.streaming_content)
+        self.assertEqual(response['Content-Type'], 'application/vnd.apache.arrow.stream')
+        reader = pyarrow.ipc.open_stream(content)
+        batches = list(reader)
+        self.assertEqual([batch.num_rows for batch in batches], [3, 1])
+        table = pyarrow.Table.from_batches(batches)
+        self.assertEqual(table.schema.field('city_name').type,
+                         pyarrow.dictionary(pyarrow.int32(), pyarrow.string()))
+        self.assertEqual(table.column('city_name').to_pylist(),
+                         ['Cairo', 'Cairo', 'Cairo', 'Giza'])
+        self.assertEqual(table.column('city_country').to_pylist(), ['Egypt'] * 4)
+        self.assertEqual(table.column('temperature').to_pylist(), [30.0, 31.0, 32.0, 33.0])
+
+    @skipUnless(exports.pyarrow, 'pyarrow is not installed')
+    def test_export_parquet(self):
+        """Test Parquet export honours the record filters"""
+        import pyarrow
+        import pyarrow.parquet
+
+        response = self.client.get(
+            f'/api/weather-records/export/?output=parquet&city_id={self.city.id}'
+        )
+        table = pyarrow.parquet.read_table(
+            pyarrow.BufferReader(b''.join(response.streaming_content))
+        )
+        self.assertEqual(table.num_rows, 3)
+        self.assertEqual(set(table.column('city_name').to_pylist()), {'Cairo'})
+
+    def test_export_columnar_without_pyarrow(self):
+        """Test columnar exports report a missing pyarrow install"""
+        with mock.patch.object(exports, 'pyarrow', None):
+            response = self.client.get('/api/weather-records/export/?output=parquet')
+        self.assertEqual(response.status_code, status.HTTP_501_NOT_IMPLEMENTED)
+
+
+class BulkIngestTestCase(APITestCase):
+    def setUp(self):
+        self.cities = [
+            City.objects.create(name=f'Bulk {i}', country='Testland',
+                                latitude=float(i), longitude=0.0)
+            for i in range(3)
+        ]
+        self.recorded_at = timezone.now().replace(minute=0, second=0, microsecond=0)
+
+    def row(self, city_id, temperature=10.0, **overrides):
+        row = {
+            'city': city_id, 'temperature': temperature, 'feels_like': temperature,
+            'humidity': 60, 'pressure': 1012, 'wind_speed': 1.5,
+            'description': 'Mist', 'recorded_at': self.recorded_at.isoformat()
+        }
+        row.update(overrides)
+        return row
+
+    def test_bulk_create_json_array(self):
+        """Test a JSON array of records is inserted with one city lookup"""
+        rows = [self.row(self.cities[i % 3].id, float(i)) for i in range(30)]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/weather-records/bulk/', rows, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data, {'created': 30, 'failed': 0, 'errors': []})
+        self.assertEqual(WeatherRecord.objects.count(), 30)
+        city_lookups = [q for q in queries if q['sql'].startswith('SELECT "cities"."id"')]
+        self.assertEqual(len(city_lookups), 1)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "weather_records"')]
+        self.assertEqual(len(inserts), 1)
+        self.assertEqual(
+            HourlyWeatherRollup.objects.get(city=self.cities[0]).record_count, 10
+        )
+
+    def test_bulk_create_query_count_is_flat(self):
+        """Test the queries per upload do not grow with its rows or cities"""
+        cities = self.cities + [
+            City.objects.create(name=f'Bulk {i}', country='Testland',
+                                latitude=float(i), longitude=0.0)
+            for i in range(3, 40)
+        ]
+
+        def upload(rows):
+            with CaptureQueriesContext(connection) as queries, \
+                    self.captureOnCommitCallbacks(execute=True):
+                response = self.client.post('/api/weather-records/bulk/', rows, format='json')
+            self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+            inserts = [q for q in queries if q['sql'].startswith('INSERT')]
+            return len(queries) - len(inserts), len(inserts)
+
+        small_other, small_inserts = upload([self.row(cities[0].id)])
+        large_other, large_inserts = upload([
+            self.row(city.id, float(i), recorded_at=(self.recorded_at - timedelta(hours=i)).isoformat())
+            for city in cities for i in range(10)
+        ])
+
+        self.assertEqual(large_other, small_other)
+        # Only the parameter limit of the backend (999 on SQLite) splits the
+        # records and each resolution's rollup upsert into several INSERTs
+        max_params = connection.features.max_query_params or 10000
+        self.assertEqual(small_inserts, 3)
+        self.assertLessEqual(large_inserts, math.ceil(400 / (max_params // 9))
+                             + 2 * math.ceil(400 / (max_params // 15)))
+        self.assertEqual(WeatherRecord.objects.count(), 401)
+
+    def test_bulk_create_reports_row_errors(self):
+        """Test invalid rows are reported without failing the batch"""
+        rows = [
+            self.row(self.cities[0].id),
+            self.row(99999),
+            self.row(self.cities[1].id, temperature='hot'),
+            'not a record',
+            self.row(self.cities[2].id),
+        ]
+        response = self.client.post('/api/weather-records/bulk/', rows, format='json')
+
+        self.assertEqual(response.status_code, status.HTTP_207_MULTI_STATUS)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([e['index'] for e in response.data['errors']], [1, 2, 3])
+        self.assertIn('city', response.data['errors'][0]['errors'])
+        self.assertIn('temperature', response.data['errors'][1]['errors'])
+        self.assertEqual(WeatherRecord.objects.count(), 2)
+
+    def test_bulk_create_ndjson(self):
+        """Test records can be uploaded as newline-delimited JSON"""
+        body = '\n'.join(json.dumps(self.row(city.id)) for city in self.cities) + '\n\n'
+        response = self.client.post('/api/weather-records/bulk/', body,
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(WeatherRecord.objects.count(), 3)
+
+        response = self.client.post('/api/weather-records/bulk/', '{"city": 1\n',
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_bulk_create_all_invalid(self):
+        """Test a batch with no valid rows is rejected"""
+        response = self.client.post('/api/weather-records/bulk/',
+                                    [self.row(99999)], format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertEqual(WeatherRecord.objects.count(), 0)
+
+
+class PartitionTestCase(TestCase):
+    def test_month_arithmetic(self):
+        """Test partition months are UTC calendar months"""
+        month = partitions.month_start(timezone.now().replace(year=2025, month=12, day=31))
+        self.assertEqual(partitions.partition_name(month), 'weather_records_y2025m12')
+        self.assertEqual(partitions.partition_name(partitions.add_months(month, 1)),
+                         'weather_records_y2026m01')
+        self.assertEqual(partitions.add_months(month, -12).year, 2024)
+
+    @skipUnless(connection.vendor == 'postgresql', 'partitioning needs PostgreSQL')
+    def test_partition_command(self):
+        """Test partitions are created ahead and expired months dropped"""
+        city = City.objects.create(name='Riga', country='Latvia', latitude=56.95, longitude=24.1)
+        old = timezone.now() - timedelta(days=400)
+        WeatherRecord.objects.create(city=city, temperature=1.0, feels_like=-2.0, humidity=85,
+                                     pressure=1012, wind_speed=5.0, description='Snow',
+                                     recorded_at=old)
+        recent = WeatherRecord.objects.create(city=city, temperature=3.0, feels_like=1.0,
+                                              humidity=80, pressure=1010, wind_speed=4.0,
+                                              description='Cloudy')
+
+        call_command('partition_weather', '--convert', '--ahead=2', '--retain-months=6',
+                     stdout=StringIO())
+        self.assertTrue(partitions.is_partitioned(connection))
+        names = [name for _, name in partitions.monthly_partitions(connection)]
+        self.assertIn(partitions.partition_name(partitions.month_start(recent.recorded_at)), names)
+        self.assertNotIn(partitions.partition_name(partitions.month_start(old)), names)
+        self.assertEqual(list(WeatherRecord.objects.values_list('id', flat=True)), [recent.id])
+        city.refresh_from_db()
+        self.assertEqual(city.weather_record_count, 1)
+
+    def test_partition_command_needs_postgresql(self):
+        """Test the partition command refuses other databases"""
+        if connection.vendor == 'postgresql':
+            self.skipTest('running on PostgreSQL')
+        with self.assertRaises(CommandError):
+            call_command('partition_weather', stdout=StringIO())
+
+
+class LoadWeatherCommandTestCase(TestCase):
+    def setUp(self):
+        City.objects.create(name='Lima', country='Peru', latitude=-12.05, longitude=-77.04)
+        City.objects.create(name='Quito', country='Ecuador', latitude=-0.18, longitude=-78.47)
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+
+    def write(self, name, content):
+        path = os.path.join(self.tmpdir.name, name)
+        with open(path, 'w') as f:
+            f.write(content)
+        return path
+
+    def test_load_csv(self):
+        """Test loading a CSV resolves city names and updates rollups"""
+        path = self.write('history.csv', (
+            'city,temperature,feels_like,humidity,pressure,wind_speed,description,recorded_at\n'
+            'Lima,18.5,18.0,80,1012,3.1,Fog,2024-01-01T10:15:00Z\n'
+            'Quito,12.0,11.0,70,1025,1.0,Rain,2024-01-01T10:45:00\n'
+            'Atlantis,1,1,1,1,1,Sunk,2024-01-01T10:00:00Z\n'
+            'Lima,20.5,20.0,75,1011,2.9,Clear,2024-01-01T10:55:00Z\n'
+        ))
+        out, err = StringIO(), StringIO()
+        call_command('load_weather', path, '--chunk-size', '2', stdout=out, stderr=err)
+
+        self.assertIn('Loaded 3 rows (1 skipped)', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+        self.assertIn("unknown city 'Atlantis'", err.getvalue())
+        self.assertEqual(WeatherRecord.objects.filter(city__name='Lima').count(), 2)
+        rollup = HourlyWeatherRollup.objects.get(city__name='Lima')
+        self.assertEqual((rollup.record_count, rollup.temperature_sum), (2, 39.0))
+
+    @skipUnless(connection.vendor == 'postgresql', 'COPY needs PostgreSQL')
+    def test_copy_keeps_empty_description(self):
+        """Test COPY loads an empty description as an empty string, not NULL"""
+        path = self.write('history.csv', (
+            'city,temperature,feels_like,humidity,pressure,wind_speed,description,recorded_at\n'
+            'Lima,18.5,18.0,80,1012,3.1,,2024-01-01T10:15:00Z\n'
+        ))
+        out = StringIO()
+        call_command('load_weather', path, stdout=out, stderr=StringIO())
+
+        self.assertIn('via COPY', out.getvalue())
+        self.assertEqual(WeatherRecord.objects.get().description, '')
+
+    def test_interrupted_load_keeps_committed_chunks_accounted(self):
+        """Test counts and rollups cover every chunk committed before a failure"""
+        path = self.write('history.csv', (
+            'city,temperature,feels_like,humidity,pressure,wind_speed,description,recorded_at\n'
+            'Lima,18.5,18.0,80,1012,3.1,Fog,2024-01-01T10:15:00Z\n'
+            'Lima,20.5,20.0,75,1011,2.9,Clear,2024-01-01T10:55:00Z\n'
+            'Lima,22.5,22.0,70,1010,2.5,Clear,2024-01-01T11:05:00Z\n'
+        ))
+        write_chunk = LoadWeatherCommand.bulk_create_chunk
+
+        def fail_second_chunk(command, chunk):
+            if WeatherRecord.objects.exists():
+                raise DatabaseError('connection lost')
+            write_chunk(command, chunk)
+
+        with mock.patch.object(LoadWeatherCommand, 'bulk_create_chunk', fail_second_chunk), \
+                self.assertRaises(DatabaseError):
+            call_command('load_weather', path, '--chunk-size', '2', '--no-copy',
+                         stdout=StringIO(), stderr=StringIO())
+
+        lima = City.objects.get(name='Lima')
+        self.assertEqual(WeatherRecord.objects.count(), 2)
+        self.assertEqual(lima.weather_record_count, 2)
+        self.assertEqual(DailyWeatherRollup.objects.get(city=lima).record_count, 2)
+
+    def test_load_ndjson(self):
+        """Test loading NDJSON skips malformed lines"""
+        rows = [
+            {'city': 'Quito', 'temperature': 10, 'feels_like': 9, 'humidity': 60,
+             'pressure': 1020, 'wind_speed': 2, 'description': 'Cloudy',
+             'recorded_at': '2024-02-01T00:00:00Z'},
+            {'city': 'Quito', 'temperature': 'cold'},
+        ]
+        path = self.write('history.ndjson',
+                          '\n'.join(json.dumps(row) for row in rows) + '\n{broken\n')
+        out = StringIO()
+        call_command('load_weather', path, stdout=out, stderr=StringIO())
+
+        self.assertIn('Loaded 1 rows (2 skipped)', out.getvalue())
+        self.assertEqual(DailyWeatherRollup.objects.get().record_count, 1)
+
+
+class StubWeatherHandler(BaseHTTPRequestHandler):
+    """
+    Serves OpenWeatherMap-shaped responses. A city at latitude N reports
+    provider ID 1000 + N and temperature N; latitude 0 is not found. The
+    first ``server.unavailable`` requests get a 503, and every response
+    takes ``server.delay`` seconds.
+    """
+
+    def do_GET(self):
+        url = urlparse(self.path)
+        params = parse_qs(url.query)
+        self.server.requests.append((url.path, params))
+        time.sleep(self.server.delay)
+        if len(self.server.requests) <= self.server.unavailable:
+            self.send_response(503)
+            self.send_header('Retry-After', '0')
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        if url.path.endswith('/group'):
+            ids = [int(i) for i in params['id'][0].split(',')]
+            items = [self.payload(i - 1000) for i in ids if i != 1000]
+            return self.send_json({'cnt': len(items), 'list': items})
+        latitude = float(params['lat'][0])
+        if latitude == 0:
+            self.send_response(404)
+            self.send_header('Content-Length', '0')
+            self.end_headers()
+            return
+        self.send_json(self.payload(latitude))
+
+    def payload(self, latitude):
+        return {
+            'id': 1000 + int(latitude),
+            'main': {'temp': float(latitude), 'feels_like': 1.0,
+                     'humidity': 50, 'pressure': 1010},
+            'wind': {'speed': 2.5},
+            'weather': [{'description': 'clear sky'}]
+        }
+
+    def send_json(self, data):
+        body = json.dumps(data).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class StubWeatherServerMixin:
+    def setUp(self):
+        super().setUp()
+        self.stub = ThreadingHTTPServer(('127.0.0.1', 0), StubWeatherHandler)
+        self.stub.requests = []
+        self.stub.unavailable = 0
+        self.stub.delay = 0
+        threading.Thread(target=self.stub.serve_forever, args=(0.05,), daemon=True).start()
+        self.addCleanup(self.stub.server_close)
+        self.addCleanup(self.stub.shutdown)
+        settings_override = override_settings(
+            OPENWEATHER_API_URL=f'http://127.0.0.1:{self.stub.server_port}',
+            OPENWEATHER_RATE_LIMIT=0,
+            OPENWEATHER_BACKOFF=0,
+        )
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+
+class FetchWeatherTestCase(StubWeatherServerMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.cities = [
+            City.objects.create(name=f'City {i}', country='Testland',
+                                latitude=float(i), longitude=10.0)
+            for i in range(4)
+        ]
+
+    def test_fetch_weather(self):
+        """Test fetching weather for a single city"""
+        response = self.client.post(f'/api/cities/{self.cities[2].id}/fetch_weather/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['data']['temperature'], 2.0)
+        self.assertEqual(HourlyWeatherRollup.objects.get().record_count, 1)
+        self.cities[2].refresh_from_db()
+        self.assertEqual(self.cities[2].openweather_id, 1002)
+
+    def test_fetch_weather_served_from_cache(self):
+        """Test repeat fetches for the same coordinates reuse the response"""
+        url = f'/api/cities/{self.cities[2].id}/fetch_weather/'
+        first = self.client.post(url)
+        second = self.client.post(url)
+
+        self.assertFalse(first.data['cached'])
+        self.assertTrue(second.data['cached'])
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertEqual(second.data['data']['id'], first.data['data']['id'])
+        self.assertEqual(len(self.stub.requests), 1)
+        self.assertEqual(WeatherRecord.objects.count(), 1)
+
+        # A different city at the same rounded coordinates gets its own record
+        twin = City.objects.create(name='Twin', country='Testland',
+                                   latitude=2.001, longitude=10.0)
+        response = self.client.post(f'/api/cities/{twin.id}/fetch_weather/')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertTrue(response.data['cached'])
+        self.assertEqual(len(self.stub.requests), 1)
+
+    @override_settings(OPENWEATHER_CACHE_BACKEND='django')
+    def test_fetch_weather_django_cache_backend(self):
+        """Test the response cache can live in the Django cache"""
+        cache.clear()
+        self.addCleanup(cache.clear)
+        url = f'/api/cities/{self.cities[1].id}/fetch_weather/'
+        self.client.post(url)
+        self.assertTrue(self.client.post(url).data['cached'])
+        self.assertEqual(len(self.stub.requests), 1)
+
+    def test_memory_response_cache(self):
+        """Test the in-process cache expires entries and evicts the LRU one"""
+        response_cache = openweather.MemoryResponseCache(ttl=60, max_entries=2)
+        response_cache.set('a', 1)
+        response_cache.set('b', 2)
+        response_cache.get('a')
+        response_cache.set('c', 3)
+        self.assertIsNone(response_cache.get('b'))
+        self.assertEqual((response_cache.get('a'), response_cache.get('c')), (1, 3))
+
+        expired = openweather.MemoryResponseCache(ttl=0, max_entries=2)
+        expired.set('a', 1)
+        self.assertIsNone(expired.get('a'))
+
+    def test_fetch_weather_bulk(self):
+        """Test bulk fetch reports per-city results and saves in one insert"""
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.post('/api/cities/fetch_weather_bulk/', {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['fetched'], 3)
+        self.assertEqual(response.data['failed'], 1)
+        failed = [r for r in response.data['results'] if not r['success']]
+        self.assertEqual(failed[0]['city_id'], self.cities[0].id)
+        self.assertEqual(len(self.stub.requests), 4)
+        self.assertEqual(WeatherRecord.objects.count(), 3)
+        inserts = [q for q in queries if q['sql'].startswith('INSERT INTO "weather_records"')]
+        self.assertEqual(len(inserts), 1)
+
+    def test_fetch_weather_bulk_selected_cities(self):
+        """Test bulk fetch limited to selected city IDs"""
+        response = self.client.post('/api/cities/fetch_weather_bulk/', {
+            'city_ids': [self.cities[1].id, self.cities[3].id]
+        }, format='json')
+        self.assertEqual(response.data['fetched'], 2)
+        self.assertEqual(sorted(WeatherRecord.objects.values_list('temperature', flat=True)),
+                         [1.0, 3.0])
+
+        for city_ids in [3, ['a'], [1.5], [True]]:
+            response = self.client.post('/api/cities/fetch_weather_bulk/',
+                                        {'city_ids': city_ids}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_fetch_weather_bulk_uses_group_endpoint(self):
+        """Test cities with known provider IDs are fetched in batches"""
+        self.client.post('/api/cities/fetch_weather_bulk/', {}, format='json')
+        self.assertEqual(
+            sorted(City.objects.values_list('openweather_id', flat=True), key=str),
+            [1001, 1002, 1003, None]
+        )
+        City.objects.filter(id=self.cities[0].id).update(openweather_id=1000)
+        for i in range(4, 30):
+            City.objects.create(name=f'City {i}', country='Testland',
+                                latitude=float(i), longitude=10.0,
+                                openweather_id=1000 + i)
+        self.stub.requests.clear()
+
+        response = self.client.post('/api/cities/fetch_weather_bulk/', {}, format='json')
+
+        self.assertEqual([path for path, _ in self.stub.requests], ['/group', '/group'])
+        self.assertEqual(response.data['fetched'], 29)
+        self.assertEqual(response.data['failed'], 1)
+        failed = [r for r in response.data['results'] if not r['success']]
+        self.assertEqual(failed[0]['city_id'], self.cities[0].id)
+        self.assertEqual(WeatherRecord.objects.filter(city__name='City 29').get().temperature, 29.0)
+
+    def test_fetch_weather_bulk_malformed_group_response(self):
+        """Test group items without an ID fail their cities instead of the request"""
+        City.objects.update(openweather_id=1001)
+        for payload in [{'list': [{'name': 'x'}]}, ['x'], {'list': 'x'}]:
+            with mock.patch.object(openweather.OpenWeatherClient, 'get', return_value=payload):
+                response = self.client.post('/api/cities/fetch_weather_bulk/', {}, format='json')
+            self.assertEqual(response.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+            self.assertEqual(response.data['failed'], 4)
+        self.assertFalse(WeatherRecord.objects.exists())
+
+        # One good item still saves its city
+        payload = {'list': [{'name': 'x'}, StubWeatherHandler.payload(None, 1)]}
+        with mock.patch.object(openweather.OpenWeatherClient, 'get', return_value=payload):
+            response = self.client.post('/api/cities/fetch_weather_bulk/', {}, format='json')
+        self.assertEqual(response.data['fetched'], 4)
+
+    def test_client_retries_unavailable_provider(self):
+        """Test the provider client retries 503s and counts them"""
+        self.stub.unavailable = 2
+        client = openweather.get_client()
+
+        data = client.get('weather', {'lat': 5, 'lon': 10})
+
+        self.assertEqual(data['main']['temp'], 5.0)
+        stats = client.stats.snapshot()
+        self.assertEqual((stats['requests'], stats['retries'], stats['failures']), (3, 2, 0))
+
+        self.stub.unavailable = 100
+        with self.assertRaises(requests.HTTPError):
+            client.get('weather', {'lat': 5, 'lon': 10})
+        self.assertEqual(client.stats.snapshot()['retries'], 5)
+        self.assertEqual(client.stats.snapshot()['failures'], 1)
+
+    def test_client_retry_delay(self):
+        """Test backoff grows exponentially and honours Retry-After"""
+        client = openweather.OpenWeatherClient('http://example.invalid', 'key',
+                                               backoff=1, max_backoff=5)
+        self.assertLessEqual(client.retry_delay(1), 2)
+        self.assertLessEqual(client.retry_delay(10), 5)
+        response = requests.Response()
+        response.headers['Retry-After'] = '3'
+        self.assertEqual(client.retry_delay(0, response), 3)
+
+    def test_fetch_weather_command(self):
+        """Test the fetch_weather management command"""
+        out = StringIO()
+        call_command('fetch_weather', '--workers', '2', stdout=out, stderr=StringIO())
+        self.assertIn('Fetched 3 of 4 cities', out.getvalue())
+        self.assertEqual(WeatherRecord.objects.count(), 3)
+
+
+@override_settings(WEATHER_ASYNC_DB_WORKERS=0)
+class AsyncViewsTestCase(StubWeatherServerMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        caches['analytics'].clear()
+        self.cities = [
+            City.objects.create(name=f'City {i}', country='Testland',
+                                latitude=float(i), longitude=10.0)
+            for i in range(4)
+        ]
+
+    def test_async_fetch_weather(self):
+        """Test the async fetch saves a reading and reuses cached responses"""
+        url = f'/api/async/cities/{self.cities[2].id}/fetch_weather/'
+        first = self.client.post(url)
+        self.assertEqual(first.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(first.json()['data']['temperature'], 2.0)
+        second = self.client.post(url)
+        self.assertEqual(second.status_code, status.HTTP_200_OK)
+        self.assertTrue(second.json()['cached'])
+        self.assertEqual(len(self.stub.requests), 1)
+        self.cities[2].refresh_from_db()
+        self.assertEqual(self.cities[2].openweather_id, 1002)
+
+        missing = self.client.post(f'/api/async/cities/{self.cities[0].id}/fetch_weather/')
+        self.assertEqual(missing.status_code, status.HTTP_503_SERVICE_UNAVAILABLE)
+        self.assertEqual(self.client.post('/api/async/cities/999/fetch_weather/').status_code,
+                         status.HTTP_404_NOT_FOUND)
+        self.assertEqual(self.client.get(url).status_code, status.HTTP_405_METHOD_NOT_ALLOWED)
+
+    def test_async_fetch_weather_bulk(self):
+        """Test the async bulk fetch reports per-city results like the sync one"""
+        url = '/api/async/cities/fetch_weather_bulk/'
+        response = self.client.post(url, {}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual((response.json()['fetched'], response.json()['failed']), (3, 1))
+        self.assertEqual(WeatherRecord.objects.count(), 3)
+
+        response = self.client.post(url, {'city_ids': [self.cities[3].id]}, format='json')
+        self.assertEqual(response.json()['fetched'], 1)
+        for body in [{'city_ids': 3}, {'city_ids': ['a']}, [1, 2]]:
+            response = self.client.post(url, body, format='json')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_async_reads_match_sync(self):
+        """Test async analytics and compare answer like their DRF twins"""
+        self.client.post('/api/cities/fetch_weather_bulk/', {}, format='json')
+        query = f'?city_id={self.cities[1].id}&bucket=hour'
+        response = self.client.get(f'/api/async/weather-records/analytics/{query}')
+        self.assertEqual(response.json(),
+                         self.client.get(f'/api/weather-records/analytics/{query}').json())
+        repeat = self.client.get(f'/api/async/weather-records/analytics/{query}',
+                                 HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(repeat.status_code, status.HTTP_304_NOT_MODIFIED)
+        self.assertEqual(repeat['X-Cache'], 'HIT')
+
+        query = f'?city_ids={self.cities[2].id},{self.cities[1].id}'
+        self.assertEqual(self.client.get(f'/api/async/weather-records/compare/{query}').json(),
+                         self.client.get(f'/api/weather-records/compare/{query}').json())
+        for url in ['analytics/?days=x', 'compare/?city_ids=']:
+            response = self.client.get(f'/api/async/weather-records/{url}')
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_async_client_keeps_requests_in_flight(self):
+        """Test slow provider calls overlap on one event loop and retry 503s"""
+        self.stub.delay = 0.3
+
+        async def fetch_many():
+            return await asyncio.gather(*(
+                openweather.afetch_current_weather(float(i), 10.0) for i in range(1, 21)
+            ))
+
+        started = time.monotonic()
+        payloads = async_to_sync(fetch_many)()
+        self.assertLess(time.monotonic() - started, 3)  # 6s one at a time
+        self.assertEqual([p['main']['temp'] for p in payloads], [float(i) for i in range(1, 21)])
+
+        self.stub.delay, self.stub.unavailable = 0, len(self.stub.requests) + 1
+        with self.assertRaises(httpx.HTTPStatusError):
+            with override_settings(OPENWEATHER_MAX_RETRIES=0):
+                async_to_sync(openweather.afetch_current_weather)(5.0, 10.0)
+        payload = async_to_sync(openweather.afetch_current_weather)(5.0, 10.0)
+        self.assertEqual(payload['main']['temp'], 5.0)
+
+    def test_provider_stats_endpoint(self):
+        """Test the sync and async provider clients' counters are exposed"""
+        before = self.client.get('/api/cities/fetch_weather/stats/').json()
+        self.client.post(f'/api/cities/{self.cities[1].id}/fetch_weather/')
+        self.client.post(f'/api/async/cities/{self.cities[2].id}/fetch_weather/')
+        self.client.post(f'/api/async/cities/{self.cities[0].id}/fetch_weather/')
+
+        after = self.client.get('/api/cities/fetch_weather/stats/').json()
+        self.assertEqual(after['sync']['requests'] - before['sync']['requests'], 1)
+        self.assertEqual(after['async']['requests'] - before['async']['requests'], 2)
+        self.assertEqual(after['async']['failures'] - before['async']['failures'], 1)
+        self.assertIsNotNone(after['async']['avg_latency_ms'])
+
+    def test_async_client_session_closes_client(self):
+        """Test async views under WSGI close the provider client they used"""
+        async def fetch_in_session():
+            async with openweather.async_client_session() as client:
+                self.assertIs(openweather.get_async_client(), client)
+                await openweather.afetch_current_weather(5.0, 10.0)
+            self.assertIsNot(openweather.get_async_client(), client)
+            return client
+
+        self.assertTrue(async_to_sync(fetch_in_session)().client.is_closed)
+
+        closes = []
+        original = openweather.AsyncOpenWeatherClient.aclose
+
+        async def aclose(client):
+            closes.append(client)
+            await original(client)
+
+        with mock.patch.object(openweather.AsyncOpenWeatherClient, 'aclose', aclose):
+            self.client.post(f'/api/async/cities/{self.cities[1].id}/fetch_weather/')
+            self.client.post('/api/async/cities/fetch_weather_bulk/', {}, format='json')
+        self.assertEqual(len(closes), 2)
+        self.assertTrue(all(client.client.is_closed for client in closes))
+
+    def test_run_sync_uses_bounded_pool(self):
+        """Test blocking calls run on at most WEATHER_ASYNC_DB_WORKERS threads"""
+        def work():
+            time.sleep(0.05)
+            return threading.current_thread().name
+
+        async def run_many():
+            return await asyncio.gather(*(run_sync(work) for _ in range(8)))
+
+        with override_settings(WEATHER_ASYNC_DB_WORKERS=2):
+            names = set(async_to_sync(run_many)())
+        self.assertEqual(len(names), 2)
+        self.assertTrue(all(name.startswith('weather-db') for name in names))
+
+
+class FetchSchedulerTestCase(StubWeatherServerMixin, APITestCase):
+    def setUp(self):
+        super().setUp()
+        self.now = datetime(2025, 6, 1, 12, 0, tzinfo=dt_timezone.utc)
+        # Latitude 0 is unknown to the stub, so City 0 always fails
+        self.cities = [
+            City.objects.create(name=f'City {i}', country='Testland',
+                                latitude=float(i), longitude=10.0)
+            for i in range(4)
+        ]
+
+    def make_scheduler(self, **kwargs):
+        options = dict(jitter=0, spread=300, max_backoff=10000,
+                       clock=lambda: self.now, rng=random.Random(1))
+        options.update(kwargs)
+        return FetchScheduler(**options)
+
+    def advance(self, seconds):
+        self.now += timedelta(seconds=seconds)
+
+    def test_load_spreads_unscheduled_cities(self):
+        """Test new cities get due times spread over the window, saved to the table"""
+        overdue = self.cities[3]
+        overdue.next_fetch_at = self.now - timedelta(hours=5)
+        overdue.save()
+        scheduler = self.make_scheduler()
+        scheduler.load()
+
+        due = dict(City.objects.values_list('id', 'next_fetch_at'))
+        for city in self.cities[:3]:
+            self.assertTrue(self.now <= due[city.id] <= self.now + timedelta(seconds=300))
+        self.assertEqual(len(set(due.values())), 4)
+        # Overdue cities are only spread out on start-up
+        self.assertEqual(due[overdue.id], self.now - timedelta(hours=5))
+        scheduler.load(initial=True)
+        self.assertGreaterEqual(City.objects.get(id=overdue.id).next_fetch_at, self.now)
+        self.assertEqual(sorted(scheduler.heap)[0], scheduler.heap[0])
+
+    def test_run_due_fetches_and_reschedules(self):
+        """Test due cities are fetched together and pushed back one interval"""
+        City.objects.filter(id=self.cities[2].id).update(refresh_interval=600)
+        City.objects.update(next_fetch_at=self.now)
+        City.objects.filter(id=self.cities[3].id).update(
+            next_fetch_at=self.now + timedelta(minutes=5))
+        scheduler = self.make_scheduler()
+        scheduler.load()
+
+        results = scheduler.run_due()
+        self.assertEqual(sorted(result['city_id'] for result in results),
+                         sorted(city.id for city in self.cities[:3]))
+        self.assertEqual(WeatherRecord.objects.count(), 2)
+        self.assertEqual(scheduler.run_due(), [])
+        self.assertAlmostEqual(scheduler.seconds_until_due(), 300)
+
+        cities = City.objects.in_bulk()
+        self.assertEqual(cities[self.cities[1].id].next_fetch_at,
+                         self.now + timedelta(seconds=3600))
+        self.assertEqual(cities[self.cities[2].id].next_fetch_at,
+                         self.now + timedelta(seconds=600))
+        self.assertEqual(cities[self.cities[1].id].fetch_failures, 0)
+
+        self.advance(300)
+        self.assertEqual([result['city_id'] for result in scheduler.run_due()],
+                         [self.cities[3].id])
+
+    def test_failing_city_backs_off(self):
+        """Test consecutive failures double the delay up to the cap, success resets it"""
+        failing = self.cities[0]
+        City.objects.exclude(id=failing.id).delete()
+        City.objects.update(next_fetch_at=self.now)
+        scheduler = self.make_scheduler()
+        scheduler.load()
+
+        delays = []
+        for _ in range(4):
+            self.assertFalse(scheduler.run_due()[0]['success'])
+            failing.refresh_from_db()
+            delay = (failing.next_fetch_at - self.now).total_seconds()
+            delays.append(delay)
+            self.advance(delay)
+        self.assertEqual(delays, [7200, 10000, 10000, 10000])
+        self.assertEqual(failing.fetch_failures, 4)
+
+        City.objects.filter(id=failing.id).update(latitude=5.0)
+        self.assertTrue(scheduler.run_due()[0]['success'])
+        failing.refresh_from_db()
+        self.assertEqual(failing.fetch_failures, 0)
+        self.assertEqual(failing.next_fetch_at, self.now + timedelta(seconds=3600))
+
+    def test_jitter_and_batch_size(self):
+        """Test batches are capped, earliest first, and jitter varies the next due time"""
+        self.cities[0].delete()
+        City.objects.update(next_fetch_at=self.now)
+        City.objects.filter(id=self.cities[1].id).update(
+            next_fetch_at=self.now - timedelta(minutes=1))
+        scheduler = self.make_scheduler(batch_size=1, jitter=0.1)
+        scheduler.load()
+
+        self.assertEqual([result['city_id'] for result in scheduler.run_due()],
+                         [self.cities[1].id])
+        for _ in range(2):
+            self.assertEqual(len(scheduler.run_due()), 1)
+        self.assertEqual(scheduler.run_due(), [])
+
+        due = City.objects.values_list('next_fetch_at', flat=True)
+        for next_fetch_at in due:
+            self.assertTrue(self.now + timedelta(seconds=3240) <= next_fetch_at
+                            <= self.now + timedelta(seconds=3960))
+        self.assertEqual(len(set(due)), 3)
+
+    def test_deleted_city_dropped(self):
+        """Test a city deleted after it was queued is skipped"""
+        City.objects.update(next_fetch_at=self.now)
+        scheduler = self.make_scheduler()
+        scheduler.load()
+        self.cities[1].delete()
+        self.assertEqual(len(scheduler.run_due()), 3)
+        self.assertEqual(len(scheduler.heap), 3)
+
+    def test_failed_batch_is_rescheduled(self):
+        """Test an exception during a batch fails its cities instead of dropping them"""
+        City.objects.update(next_fetch_at=self.now)
+        scheduler = self.make_scheduler()
+        scheduler.load()
+
+        with mock.patch('weather_app.scheduler.fetch_cities', side_effect=KeyError('id')), \
+                self.assertLogs('weather_app.scheduler', 'ERROR'):
+            results = scheduler.run_due()
+        self.assertEqual(len(results), 4)
+        self.assertFalse(any(result['success'] for result in results))
+        self.assertEqual(len(scheduler.heap), 4)
+        self.assertEqual(set(City.objects.values_list('fetch_failures', flat=True)), {1})
+        self.assertEqual(scheduler.seconds_until_due(), 7200)
+
+        # Without the cities the batch goes back on the heap as it was
+        self.advance(7200)
+        with mock.patch.object(City.objects, 'filter', side_effect=DatabaseError('gone')):
+            with self.assertRaises(DatabaseError):
+                scheduler.run_due()
+        self.assertEqual(len(scheduler.heap), 4)
+        self.assertEqual(len(scheduler.run_due()), 4)
+
+    def test_schedule_weather_survives_failed_batch(self):
+        """Test the worker logs a failing batch and keeps running until SIGTERM"""
+        calls = []
+
+        def run_due(scheduler):
+            calls.append(1)
+            if len(calls) == 1:
+                raise DatabaseError('connection lost')
+            os.kill(os.getpid(), signal.SIGTERM)
+            return []
+
+        handler = signal.getsignal(signal.SIGTERM)
+        self.addCleanup(signal.signal, signal.SIGTERM, handler)
+        out = StringIO()
+        with mock.patch.object(FetchScheduler, 'run_due', run_due), \
+                mock.patch('weather_app.management.commands.schedule_weather.ERROR_PAUSE', 0), \
+                self.assertLogs('weather_app.management.commands.schedule_weather', 'ERROR'):
+            call_command('schedule_weather', stdout=out, stderr=StringIO())
+        self.assertEqual(len(calls), 2)
+        self.assertIn('Scheduler stopped', out.getvalue())
+
+    def test_schedule_weather_once(self):
+        """Test the schedule_weather command fetches due cities and exits"""
+        City.objects.update(next_fetch_at=timezone.now() - timedelta(minutes=1))
+        City.objects.filter(id=self.cities[3].id).update(
+            next_fetch_at=timezone.now() + timedelta(hours=1))
+        out = StringIO()
+        call_command('schedule_weather', '--once', '--batch-size', '2',
+                     stdout=out, stderr=StringIO())
+        self.assertIn('Fetched 2 of 3 due cities', out.getvalue())
+        self.assertEqual(WeatherRecord.objects.count(), 2)
+        self.assertEqual(City.objects.get(id=self.cities[0].id).fetch_failures, 1)
+
+    def test_refresh_interval_api(self):
+        """Test refresh_interval is writable and validated; schedule fields are read-only"""
+        url = f'/api/cities/{self.cities[1].id}/'
+        response = self.client.patch(url, {'refresh_interval': 900,
+                                           'fetch_failures': 7}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['refresh_interval'], 900)
+        self.assertEqual(response.data['fetch_failures'], 0)
+        response = self.client.patch(url, {'refresh_interval': 5}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
 
 class IntegrationTestCase(APITestCase):
+    def setUp(self):
+        caches['analytics'].clear()
+
     def test_full_workflow(self):
         """Test complete workflow: create city, fetch weather, get analytics"""
         # 1. Create a city
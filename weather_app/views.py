@@ -1,43 +1,105 @@
 from django.http import HttpResponse  # ADD THIS IMPORT
+from django.utils.html import escape
 from rest_framework import viewsets, status
 from rest_framework.decorators import action
+from rest_framework.parsers import JSONParser
 from rest_framework.response import Response
-from django.db.models import Avg, Max, Min, Count
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count
 from django.utils import timezone
 from datetime import timedelta
+from functools import lru_cache
+from zoneinfo import ZoneInfo, ZoneInfoNotFoundError
+import re
 import requests
-import os
 
+from . import analytics, analytics_cache, counts, dashboard, exports, openweather, rollups, stats
+from .conditional import ConditionalGetMixin, conditional_response, make_etag
 from .models import City, WeatherRecord
+from .pagination import WeatherRecordPagination
+from .parsers import NDJSONParser
 from .serializers import (
     CitySerializer, CityDetailSerializer,
-    WeatherRecordSerializer, WeatherRecordCreateSerializer
+    WeatherRecordSerializer, WeatherRecordCreateSerializer,
+    WeatherRecordBulkSerializer
 )
 
-# Homepage function
-def home(request):
-    # Get counts from database
-    city_count = City.objects.count()
-    weather_count = WeatherRecord.objects.count()
-    
-    # Get recent cities
-    recent_cities = City.objects.all()[:5]
-    cities_html = ""
-    for city in recent_cities:
-        cities_html += f'<div class="card-item">📍 {city.name}, {city.country}</div>'
-    
-    if not cities_html:
-        cities_html = '<div class="card-item">No cities yet. Use the API to add some!</div>'
-    
-    # Get recent weather records
-    recent_weather = WeatherRecord.objects.select_related('city').order_by('-recorded_at')[:5]
-    weather_html = ""
-    for record in recent_weather:
-        weather_html += f'<div class="card-item">🌡️ {record.city.name}: {record.temperature}°C - {record.description}</div>'
-    
-    if not weather_html:
-        weather_html = '<div class="card-item">No weather data yet. Fetch some using the API!</div>'
-    
+
+# Longest window (in days) a query may ask for; far longer ones reach back
+# past year 1 and overflow datetime
+MAX_DAYS = 36500
+
+
+def time_zone(name):
+    """ZoneInfo for ``name``, or None if no name was given."""
+    if not name:
+        return None
+    try:
+        return ZoneInfo(name)
+    except (ZoneInfoNotFoundError, ValueError, OSError):
+        raise ValueError(f'Unknown time zone: {name}')
+
+
+def analytics_params(query):
+    """
+    ``analytics`` keyword arguments from the query string; raises ValueError
+    with the message for a 400 response.
+    """
+    try:
+        city_id = int(query.get('city_id') or 0) or None
+        days = int(query.get('days', 7))
+    except ValueError:
+        raise ValueError('city_id and days must be integers')
+    if not 1 <= days <= MAX_DAYS:
+        raise ValueError(f'days must be between 1 and {MAX_DAYS}')
+    align = query.get('align')
+    if align is not None and align not in rollups.RESOLUTIONS:
+        raise ValueError(f"align must be one of: {', '.join(rollups.RESOLUTIONS)}")
+    bucket = query.get('bucket')
+    if bucket is not None and bucket not in analytics.BUCKETS:
+        raise ValueError(f"bucket must be one of: {', '.join(analytics.BUCKETS)}")
+    return {'days': days, 'city_id': city_id, 'align': align, 'bucket': bucket,
+            'tz': time_zone(query.get('tz'))}
+
+
+def compare_params(query):
+    """Like analytics_params, for ``compare``."""
+    try:
+        city_ids = list(dict.fromkeys(
+            int(value) for value in query.get('city_ids', '').split(',') if value
+        ))
+        days = int(query.get('days', 7))
+    except ValueError:
+        raise ValueError('city_ids must be comma-separated integers and days an integer')
+    if not city_ids or len(city_ids) > settings.WEATHER_COMPARE_MAX_CITIES:
+        raise ValueError(f'city_ids must list 1 to {settings.WEATHER_COMPARE_MAX_CITIES} cities')
+    if not 1 <= days <= MAX_DAYS:
+        raise ValueError(f'days must be between 1 and {MAX_DAYS}')
+    bucket = query.get('bucket', 'day')
+    if bucket not in analytics.BUCKETS:
+        raise ValueError(f"bucket must be one of: {', '.join(analytics.BUCKETS)}")
+    return {'city_ids': city_ids, 'days': days, 'bucket': bucket,
+            'tz': time_zone(query.get('tz'))}
+
+
+def build_comparison(city_ids, days, bucket, tz):
+    """``(payload, None)``, or ``(None, error)`` if some of ``city_ids`` do not exist."""
+    names = dict(City.objects.filter(pk__in=city_ids).values_list('id', 'name'))
+    missing = [city_id for city_id in city_ids if city_id not in names]
+    if missing:
+        return None, f"Unknown city_ids: {', '.join(map(str, missing))}"
+    cities = [(city_id, names[city_id]) for city_id in city_ids]
+    return analytics.build_comparison(cities, days, bucket=bucket, tz=tz), None
+
+
+@lru_cache(maxsize=32)
+def home_shell(base_url):
+    """
+    Render the static part of the home page once per host. Returns the page
+    split into literal chunks alternating with placeholder names.
+    """
+    base_url = escape(base_url)
     html = f"""
     <!DOCTYPE html>
     <html>
@@ -164,11 +226,11 @@ def home(request):
                 
                 <div class="stats">
                     <div class="stat-card">
-                        <div class="stat-number">{city_count}</div>
+                        <div class="stat-number"><!--city_count--></div>
                         <div class="stat-label">Cities Tracked</div>
                     </div>
                     <div class="stat-card">
-                        <div class="stat-number">{weather_count}</div>
+                        <div class="stat-number"><!--weather_count--></div>
                         <div class="stat-label">Weather Records</div>
                     </div>
                 </div>
@@ -182,12 +244,12 @@ def home(request):
             <div class="grid">
                 <div class="card">
                     <h2>🌆 Recent Cities</h2>
-                    {cities_html}
+                    <!--cities_html-->
                 </div>
                 
                 <div class="card">
                     <h2>🌡️ Latest Weather Data</h2>
-                    {weather_html}
+                    <!--weather_html-->
                 </div>
             </div>
 
@@ -217,19 +279,19 @@ def home(request):
                 
                 <h3 style="margin-top: 20px; margin-bottom: 10px;">1. Create a City</h3>
                 <div class="code-block">
-curl -X POST {request.build_absolute_uri('/api/cities/')} \\<br>
+curl -X POST {base_url}/api/cities/ \\<br>
 &nbsp;&nbsp;-H "Content-Type: application/json" \\<br>
 &nbsp;&nbsp;-d '{{"name": "Mumbai", "country": "India", "latitude": 19.0760, "longitude": 72.8777}}'
                 </div>
                 
                 <h3 style="margin-top: 20px; margin-bottom: 10px;">2. Fetch Weather Data</h3>
                 <div class="code-block">
-curl -X POST {request.build_absolute_uri('/api/cities/1/fetch_weather/')}
+curl -X POST {base_url}/api/cities/1/fetch_weather/
                 </div>
                 
                 <h3 style="margin-top: 20px; margin-bottom: 10px;">3. View Analytics</h3>
                 <div class="code-block">
-curl {request.build_absolute_uri('/api/weather-records/analytics/')}
+curl {base_url}/api/weather-records/analytics/
                 </div>
             </div>
 
@@ -246,11 +308,38 @@ curl {request.build_absolute_uri('/api/weather-records/analytics/')}
     </body>
     </html>
     """
+    return tuple(re.split(r'<!--(\w+)-->', html))
+
+
+# Homepage function
+def home(request):
+    snapshot = dashboard.get_snapshot()
+
+    cities_html = ''.join(
+        f'<div class="card-item">📍 {escape(name)}, {escape(country)}</div>'
+        for name, country in snapshot['recent_cities']
+    ) or '<div class="card-item">No cities yet. Use the API to add some!</div>'
+
+    weather_html = ''.join(
+        f'<div class="card-item">🌡️ {escape(city_name)}: {temperature}°C - {escape(description)}</div>'
+        for city_name, temperature, description in snapshot['recent_weather']
+    ) or '<div class="card-item">No weather data yet. Fetch some using the API!</div>'
+
+    values = {
+        'city_count': snapshot['city_count'],
+        'weather_count': snapshot['weather_count'],
+        'cities_html': cities_html,
+        'weather_html': weather_html,
+    }
+    parts = home_shell(request.build_absolute_uri('/').rstrip('/'))
+    html = ''.join(
+        part if i % 2 == 0 else str(values[part]) for i, part in enumerate(parts)
+    )
     return HttpResponse(html)
 
 
 # City ViewSet - DEFINE ONLY ONCE
-class CityViewSet(viewsets.ModelViewSet):
+class CityViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = City.objects.all()
     serializer_class = CitySerializer
 
@@ -259,44 +348,93 @@ class CityViewSet(viewsets.ModelViewSet):
             return CityDetailSerializer
         return CitySerializer
 
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('retrieve', 'latest') and settings.WEATHER_COUNT_MODE == 'exact':
+            # Otherwise CitySerializer reads the maintained counter column.
+            # GROUP BY queries drop Meta.ordering, so restate it for pagination
+            queryset = queryset.annotate(
+                num_weather_records=Count('weather_records')
+            ).order_by(*City._meta.ordering)
+        return queryset
+
+    def get_object(self):
+        city = super().get_object()
+        if self.action == 'retrieve':
+            self.attach_recent_weather([city])
+        return city
+
+    def object_state(self, city):
+        recent = getattr(city, 'recent_weather_records', ())
+        return (city.id, city.updated_at, city.next_fetch_at, city.fetch_failures,
+                getattr(city, 'num_weather_records', city.weather_record_count),
+                tuple((record.id, record.updated_at) for record in recent))
+
+    @staticmethod
+    def attach_recent_weather(cities, limit=5):
+        """
+        Set ``recent_weather_records`` on every city from a single
+        window-function query, for CityDetailSerializer to read.
+        """
+        by_id = {city.id: city for city in cities}
+        for city in cities:
+            city.recent_weather_records = []
+        for record in WeatherRecord.objects.latest_per_city(list(by_id), limit):
+            record.city = by_id[record.city_id]
+            record.city.recent_weather_records.append(record)
+        return cities
+
+    @action(detail=False, methods=['get'])
+    def latest(self, request):
+        """
+        List cities with their latest ``readings`` weather records each
+        (default 5, max 50), fetched for the whole page in one query.
+        """
+        try:
+            readings = min(max(int(request.query_params.get('readings', 5)), 1), 50)
+        except ValueError:
+            return Response({
+                'error': 'readings must be an integer'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        page = self.paginate_queryset(self.get_queryset())
+        cities = self.attach_recent_weather(list(page), readings)
+        return conditional_response(
+            request, self.page_etag(request, cities),
+            lambda: self.get_paginated_response(CityDetailSerializer(cities, many=True).data)
+        )
+
+    @action(detail=False, methods=['get'], url_path='fetch_weather/stats')
+    def fetch_weather_stats(self, request):
+        """
+        Request, retry, failure and latency counters of this process's
+        OpenWeatherMap clients
+        """
+        return Response(openweather.client_stats())
+
     @action(detail=True, methods=['post'])
     def fetch_weather(self, request, pk=None):
         """
         Fetch current weather from OpenWeatherMap API and save to database
         """
         city = self.get_object()
-        api_key = os.getenv('OPENWEATHER_API_KEY', 'your_api_key_here')
-        
-        url = "http://api.openweathermap.org/data/2.5/weather"
-        params = {
-            'lat': city.latitude,
-            'lon': city.longitude,
-            'appid': api_key,
-            'units': 'metric'
-        }
 
         try:
-            response = requests.get(url, params=params, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-
-            weather_record = WeatherRecord.objects.create(
-                city=city,
-                temperature=data['main']['temp'],
-                feels_like=data['main']['feels_like'],
-                humidity=data['main']['humidity'],
-                pressure=data['main']['pressure'],
-                wind_speed=data['wind']['speed'],
-                description=data['weather'][0]['description'],
-                recorded_at=timezone.now()
+            data, fetched_at, cached = openweather.fetch_current_weather_cached(
+                city.latitude, city.longitude
+            )
+            weather_record, created = openweather.store_current_weather(
+                city, data, fetched_at, cached
             )
 
             serializer = WeatherRecordSerializer(weather_record)
             return Response({
                 'success': True,
-                'message': 'Weather data fetched and saved successfully',
+                'cached': cached,
+                'message': 'Weather data fetched and saved successfully' if created
+                else 'Recent weather data served from cache',
                 'data': serializer.data
-            }, status=status.HTTP_201_CREATED)
+            }, status=status.HTTP_201_CREATED if created else status.HTTP_200_OK)
 
         except requests.RequestException as e:
             return Response({
@@ -304,11 +442,47 @@ class CityViewSet(viewsets.ModelViewSet):
                 'error': f'Failed to fetch weather data: {str(e)}'
             }, status=status.HTTP_503_SERVICE_UNAVAILABLE)
 
+    @action(detail=False, methods=['post'])
+    def fetch_weather_bulk(self, request):
+        """
+        Fetch current weather for many cities concurrently and save the
+        results in one bulk insert. Pass ``city_ids`` to limit the cities,
+        otherwise every city is refreshed.
+        """
+        cities = City.objects.all()
+        city_ids = request.data.get('city_ids')
+        if city_ids is not None:
+            if not isinstance(city_ids, list) or not all(
+                isinstance(city_id, int) and not isinstance(city_id, bool) for city_id in city_ids
+            ):
+                return Response({
+                    'success': False,
+                    'error': 'city_ids must be a list of city IDs'
+                }, status=status.HTTP_400_BAD_REQUEST)
+            cities = cities.filter(id__in=city_ids)
+
+        results = openweather.fetch_cities(cities)
+        fetched = sum(1 for result in results if result['success'])
+        failed = len(results) - fetched
+
+        if fetched or not failed:
+            response_status = status.HTTP_201_CREATED
+        else:
+            response_status = status.HTTP_503_SERVICE_UNAVAILABLE
+
+        return Response({
+            'success': failed == 0,
+            'fetched': fetched,
+            'failed': failed,
+            'results': results
+        }, status=response_status)
+
 
 # Weather Record ViewSet
-class WeatherRecordViewSet(viewsets.ModelViewSet):
+class WeatherRecordViewSet(ConditionalGetMixin, viewsets.ModelViewSet):
     queryset = WeatherRecord.objects.select_related('city').all()
     serializer_class = WeatherRecordSerializer
+    pagination_class = WeatherRecordPagination
 
     def get_serializer_class(self):
         if self.action == 'create':
@@ -333,76 +507,161 @@ class WeatherRecordViewSet(viewsets.ModelViewSet):
 
         return queryset
 
+    def get_count_hint(self):
+        """
+        Record count for the paginator from weather_app.counts, or None
+        when the filters need an exact count.
+        """
+        params = self.request.query_params
+        if params.get('days'):
+            return None
+        try:
+            city_id = int(params['city_id']) if params.get('city_id') else None
+        except ValueError:
+            return None
+        return counts.record_count(city_id)
+
+    def object_state(self, record):
+        return (record.id, record.updated_at, record.city.updated_at)
+
+    def object_last_modified(self, record):
+        return max(record.updated_at, record.city.updated_at)
+
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, NDJSONParser])
+    def bulk(self, request):
+        """
+        Create many weather records from a JSON array or NDJSON body.
+        Valid rows are inserted in chunks within one transaction; invalid
+        rows are reported by index without failing the rest.
+        """
+        rows = request.data
+        if not isinstance(rows, list):
+            return Response({
+                'error': 'Expected a JSON array or NDJSON of weather records'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if len(rows) > settings.WEATHER_BULK_MAX_RECORDS:
+            return Response({
+                'error': f'At most {settings.WEATHER_BULK_MAX_RECORDS} records per request'
+            }, status=status.HTTP_400_BAD_REQUEST)
+
+        errors = {}
+        valid = {}
+        for index, row in enumerate(rows):
+            if not isinstance(row, dict):
+                errors[index] = {'non_field_errors': ['Expected an object']}
+                continue
+            serializer = WeatherRecordBulkSerializer(data=row)
+            if serializer.is_valid():
+                valid[index] = serializer.validated_data
+            else:
+                errors[index] = serializer.errors
+
+        city_ids = {data['city'] for data in valid.values()}
+        known_cities = set(City.objects.filter(id__in=city_ids).values_list('id', flat=True))
+        records = []
+        for index, data in list(valid.items()):
+            if data['city'] not in known_cities:
+                errors[index] = {'city': [f'Invalid pk "{data["city"]}" - object does not exist.']}
+                continue
+            data = dict(data)
+            records.append(WeatherRecord(city_id=data.pop('city'), **data))
+
+        with transaction.atomic():
+            WeatherRecord.objects.bulk_ingest(records, batch_size=settings.WEATHER_BULK_BATCH_SIZE)
+
+        if not errors:
+            response_status = status.HTTP_201_CREATED
+        elif records:
+            response_status = status.HTTP_207_MULTI_STATUS
+        else:
+            response_status = status.HTTP_400_BAD_REQUEST
+
+        return Response({
+            'created': len(records),
+            'failed': len(errors),
+            'errors': [{'index': index, 'errors': errors[index]} for index in sorted(errors)]
+        }, status=response_status)
+
+    @action(detail=False, methods=['get'])
+    def export(self, request):
+        """
+        Stream every record matching ``city_id``/``days`` as NDJSON
+        (default), or with ``?output=csv|arrow|parquet``.
+        """
+        output = request.query_params.get('output', 'ndjson')
+        if output not in exports.STREAMERS:
+            return Response({
+                'error': f"output must be one of: {', '.join(exports.STREAMERS)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        reason = exports.unavailable_reason(output)
+        if reason:
+            return Response({'error': reason}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        return exports.export_response(self.get_queryset(), output)
+
     @action(detail=False, methods=['get'])
     def analytics(self, request):
         """
         Get weather analytics and statistics
         """
-        city_id = request.query_params.get('city_id')
-        days = int(request.query_params.get('days', 7))
-        
-        start_date = timezone.now() - timedelta(days=days)
-        queryset = WeatherRecord.objects.filter(recorded_at__gte=start_date)
-        
-        if city_id:
-            queryset = queryset.filter(city_id=city_id)
+        try:
+            params = analytics_params(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        stats = queryset.aggregate(
-            avg_temperature=Avg('temperature'),
-            max_temperature=Max('temperature'),
-            min_temperature=Min('temperature'),
-            avg_humidity=Avg('humidity'),
-            avg_pressure=Avg('pressure'),
-            avg_wind_speed=Avg('wind_speed'),
-            total_records=Count('id')
-        )
+        payload, digest, hit = analytics_cache.get_analytics(**params)
+        response = conditional_response(request, make_etag(request, digest),
+                                        lambda: Response(payload))
+        response['X-Cache'] = 'HIT' if hit else 'MISS'
+        return response
 
-        daily_data = []
-        for i in range(days):
-            day_start = start_date + timedelta(days=i)
-            day_end = day_start + timedelta(days=1)
-            day_records = queryset.filter(
-                recorded_at__gte=day_start,
-                recorded_at__lt=day_end
-            )
-            day_avg = day_records.aggregate(
-                avg_temp=Avg('temperature'),
-                avg_humidity=Avg('humidity')
-            )
-            daily_data.append({
-                'date': day_start.strftime('%Y-%m-%d'),
-                'avg_temperature': round(day_avg['avg_temp'], 2) if day_avg['avg_temp'] else None,
-                'avg_humidity': round(day_avg['avg_humidity'], 2) if day_avg['avg_humidity'] else None
-            })
-
-        city_summary = []
-        if not city_id:
-            cities = City.objects.all()
-            for city in cities:
-                city_records = queryset.filter(city=city)
-                if city_records.exists():
-                    city_stats = city_records.aggregate(
-                        avg_temp=Avg('temperature'),
-                        count=Count('id')
-                    )
-                    city_summary.append({
-                        'city_name': city.name,
-                        'country': city.country,
-                        'avg_temperature': round(city_stats['avg_temp'], 2),
-                        'record_count': city_stats['count']
-                    })
+    @action(detail=False, methods=['get'])
+    def compare(self, request):
+        """
+        Statistics and bucketed trends for several cities side by side
+        """
+        try:
+            params = compare_params(request.query_params)
+        except ValueError as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        payload, error = build_comparison(**params)
+        if error:
+            return Response({'error': error}, status=status.HTTP_404_NOT_FOUND)
+        return Response(payload)
 
-        return Response({
-            'period': f'Last {days} days',
-            'statistics': {
-                'average_temperature': round(stats['avg_temperature'], 2) if stats['avg_temperature'] else None,
-                'max_temperature': round(stats['max_temperature'], 2) if stats['max_temperature'] else None,
-                'min_temperature': round(stats['min_temperature'], 2) if stats['min_temperature'] else None,
-                'average_humidity': round(stats['avg_humidity'], 2) if stats['avg_humidity'] else None,
-                'average_pressure': round(stats['avg_pressure'], 2) if stats['avg_pressure'] else None,
-                'average_wind_speed': round(stats['avg_wind_speed'], 2) if stats['avg_wind_speed'] else None,
-                'total_records': stats['total_records']
-            },
-            'daily_trends': daily_data,
-            'city_summary': city_summary
-        })
\ No newline at end of file
+    @action(detail=False, methods=['get'], url_path='analytics/cache')
+    def analytics_cache_stats(self, request):
+        """
+        Hit/miss counters of the analytics response cache
+        """
+        return Response(analytics_cache.stats())
+
+    @action(detail=False, methods=['get'])
+    def statistics(self, request):
+        """
+        Percentiles, standard deviation and 24h/7d moving averages per city
+        """
+        try:
+            city_id = int(request.query_params.get('city_id') or 0) or None
+            days = int(request.query_params.get('days', 7))
+        except ValueError:
+            return Response({
+                'error': 'city_id and days must be integers'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        if not 1 <= days <= MAX_DAYS:
+            return Response({
+                'error': f'days must be between 1 and {MAX_DAYS}'
+            }, status=status.HTTP_400_BAD_REQUEST)
+        field = request.query_params.get('field', 'temperature')
+        if field not in stats.STAT_FIELDS:
+            return Response({
+                'error': f"field must be one of: {', '.join(stats.STAT_FIELDS)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        engine = request.query_params.get('engine') or stats.default_engine()
+        if engine not in stats.ENGINES:
+            return Response({
+                'error': f"engine must be one of: {', '.join(stats.ENGINES)}"
+            }, status=status.HTTP_400_BAD_REQUEST)
+        reason = stats.unavailable_reason(engine)
+        if reason:
+            return Response({'error': reason}, status=status.HTTP_501_NOT_IMPLEMENTED)
+        return Response(stats.build_statistics(days, field=field, city_id=city_id, engine=engine))
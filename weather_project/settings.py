@@ -143,3 +143,110 @@ if not DEBUG:
 # OpenWeatherMap API
 
 OPENWEATHER_API_KEY = os.getenv('OPENWEATHER_API_KEY', 'b2146676cdfa655806c3fded53cb3387')
+OPENWEATHER_API_URL = os.getenv('OPENWEATHER_API_URL', 'http://api.openweathermap.org/data/2.5')
+
+# Bulk fetches: concurrent HTTP workers and the outbound request rate
+# (requests per second, 0 disables throttling) to stay inside the quota.
+OPENWEATHER_FETCH_WORKERS = int(os.getenv('OPENWEATHER_FETCH_WORKERS', '8'))
+OPENWEATHER_RATE_LIMIT = float(os.getenv('OPENWEATHER_RATE_LIMIT', '1'))
+
+# Cities with a known OpenWeatherMap ID are fetched this many per request
+# (the provider's group endpoint accepts at most 20).
+OPENWEATHER_GROUP_SIZE = int(os.getenv('OPENWEATHER_GROUP_SIZE', '20'))
+
+# Provider HTTP client: connection pool size, retries on 429/5xx with
+# exponential backoff (seconds, with jitter) and the per-request timeout.
+OPENWEATHER_POOL_SIZE = int(os.getenv('OPENWEATHER_POOL_SIZE', '10'))
+OPENWEATHER_MAX_RETRIES = int(os.getenv('OPENWEATHER_MAX_RETRIES', '3'))
+OPENWEATHER_BACKOFF = float(os.getenv('OPENWEATHER_BACKOFF', '0.5'))
+OPENWEATHER_MAX_BACKOFF = float(os.getenv('OPENWEATHER_MAX_BACKOFF', '30'))
+OPENWEATHER_TIMEOUT = float(os.getenv('OPENWEATHER_TIMEOUT', '10'))
+
+# Cache of current-weather responses keyed by coordinates rounded to
+# OPENWEATHER_CACHE_PRECISION decimals. BACKEND is 'memory' (per process,
+# LRU-bounded), 'django' (the OPENWEATHER_CACHE_ALIAS cache, shared between
+# workers) or 'none'.
+OPENWEATHER_CACHE_BACKEND = os.getenv('OPENWEATHER_CACHE_BACKEND', 'memory')
+OPENWEATHER_CACHE_TTL = int(os.getenv('OPENWEATHER_CACHE_TTL', '60'))
+OPENWEATHER_CACHE_MAX_ENTRIES = int(os.getenv('OPENWEATHER_CACHE_MAX_ENTRIES', '1024'))
+OPENWEATHER_CACHE_ALIAS = os.getenv('OPENWEATHER_CACHE_ALIAS', 'default')
+OPENWEATHER_CACHE_PRECISION = int(os.getenv('OPENWEATHER_CACHE_PRECISION', '2'))
+
+# Async views (/api/async/..., served by an ASGI server such as uvicorn):
+# provider connections kept per event loop, provider requests in flight per
+# bulk fetch, and threads running their database work (0 uses Django's
+# default thread-sensitive sync_to_async).
+OPENWEATHER_ASYNC_POOL_SIZE = int(os.getenv('OPENWEATHER_ASYNC_POOL_SIZE', '200'))
+OPENWEATHER_ASYNC_CONCURRENCY = int(os.getenv('OPENWEATHER_ASYNC_CONCURRENCY', '50'))
+WEATHER_ASYNC_DB_WORKERS = int(os.getenv('WEATHER_ASYNC_DB_WORKERS', '16'))
+
+
+# Bulk ingestion (POST /api/weather-records/bulk/)
+
+WEATHER_BULK_MAX_RECORDS = int(os.getenv('WEATHER_BULK_MAX_RECORDS', '10000'))
+WEATHER_BULK_BATCH_SIZE = int(os.getenv('WEATHER_BULK_BATCH_SIZE', '1000'))
+
+# Streaming exports (GET /api/weather-records/export/): rows fetched per
+# round trip from the server-side cursor.
+WEATHER_EXPORT_CHUNK_SIZE = int(os.getenv('WEATHER_EXPORT_CHUNK_SIZE', '2000'))
+# Arrow/Parquet exports (optional pyarrow): rows per record batch / row group.
+WEATHER_ARROW_BATCH_SIZE = int(os.getenv('WEATHER_ARROW_BATCH_SIZE', '65536'))
+
+
+# Caches. Analytics responses get their own alias so a shared backend
+# (e.g. django.core.cache.backends.redis.RedisCache) can be configured for
+# multi-process deployments without touching the default cache.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'analytics': {
+        'BACKEND': os.getenv('ANALYTICS_CACHE_BACKEND',
+                             'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('ANALYTICS_CACHE_LOCATION', 'analytics'),
+    },
+}
+
+# Analytics responses (GET /api/weather-records/analytics/) are cached per
+# parameter set for one ANALYTICS_CACHE_BUCKET_SECONDS slot of wall-clock
+# time and dropped early when a reading inside their window changes.
+ANALYTICS_CACHE_ALIAS = os.getenv('ANALYTICS_CACHE_ALIAS', 'analytics')
+ANALYTICS_CACHE_BUCKET_SECONDS = int(os.getenv('ANALYTICS_CACHE_BUCKET_SECONDS', '60'))
+
+# Home page snapshot (counts, latest cities and readings): seconds it is
+# reused for; writes to cities or readings drop it sooner.
+WEATHER_DASHBOARD_TTL = int(os.getenv('WEATHER_DASHBOARD_TTL', '30'))
+
+# Where record counts (home page, weather record pages, city
+# weather_records_count) come from: 'maintained' per-city counters,
+# 'estimate' (PostgreSQL planner statistics for unfiltered totals) or
+# 'exact' COUNT(*). See weather_app/counts.py.
+WEATHER_COUNT_MODE = os.getenv('WEATHER_COUNT_MODE', 'maintained')
+
+# Optional PostgreSQL monthly partitioning of weather_records (applied by
+# migration 0006 when enabled; see weather_app/partitions.py). The
+# partition_weather command keeps MONTHS_AHEAD future months created and
+# drops months older than RETENTION_MONTHS (0 keeps everything).
+WEATHER_PARTITIONING = os.getenv('WEATHER_PARTITIONING', 'False') == 'True'
+WEATHER_PARTITION_MONTHS_AHEAD = int(os.getenv('WEATHER_PARTITION_MONTHS_AHEAD', '3'))
+WEATHER_PARTITION_RETENTION_MONTHS = int(os.getenv('WEATHER_PARTITION_RETENTION_MONTHS', '0'))
+
+# Raw readings older than this many days are downsampled into the rollups
+# and deleted by manage.py purge_weather.
+WEATHER_RAW_RETENTION_DAYS = int(os.getenv('WEATHER_RAW_RETENTION_DAYS', '90'))
+
+# Most cities one /api/weather-records/compare/ request may list.
+WEATHER_COMPARE_MAX_CITIES = int(os.getenv('WEATHER_COMPARE_MAX_CITIES', '50'))
+
+# Background fetches (manage.py schedule_weather, see weather_app/scheduler.py).
+# Cities without their own refresh_interval are fetched every
+# WEATHER_REFRESH_INTERVAL seconds, up to BATCH_SIZE at a time. Next due
+# times vary by +/- JITTER of the interval; unscheduled or overdue cities are
+# spread over the next SPREAD seconds; failing cities wait interval * 2^n,
+# at most MAX_BACKOFF seconds.
+WEATHER_REFRESH_INTERVAL = int(os.getenv('WEATHER_REFRESH_INTERVAL', '3600'))
+WEATHER_SCHEDULER_BATCH_SIZE = int(os.getenv('WEATHER_SCHEDULER_BATCH_SIZE', '100'))
+WEATHER_SCHEDULER_JITTER = float(os.getenv('WEATHER_SCHEDULER_JITTER', '0.1'))
+WEATHER_SCHEDULER_SPREAD = int(os.getenv('WEATHER_SCHEDULER_SPREAD', '300'))
+WEATHER_SCHEDULER_MAX_BACKOFF = int(os.getenv('WEATHER_SCHEDULER_MAX_BACKOFF', '86400'))
@@ -1,6 +1,7 @@
 from django.contrib import admin
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from weather_app import async_views
 from weather_app.views import CityViewSet, WeatherRecordViewSet, home
 
 router = DefaultRouter()
@@ -11,4 +12,8 @@ urlpatterns = [
     path('', home, name='home'),  # Homepage
     path('admin/', admin.site.urls),
     path('api/', include(router.urls)),
+    path('api/async/cities/<int:pk>/fetch_weather/', async_views.fetch_weather),
+    path('api/async/cities/fetch_weather_bulk/', async_views.fetch_weather_bulk),
+    path('api/async/weather-records/analytics/', async_views.analytics),
+    path('api/async/weather-records/compare/', async_views.compare),
 ]
\ No newline at end of file